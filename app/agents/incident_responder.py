@@ -1,6 +1,10 @@
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
+import threading
+from ..database import SessionLocal
+from ..plan_cache import STUDENT_PLACEHOLDER, normalize_alert, plan_key, find_plan, store_plan
+
+# Subir al cambiar plan_prompt: invalida los planes guardados en la caché (app/plan_cache.py)
+PLAN_PROMPT_VERSION = 1
+ALERT_EMAIL_SUBJECT = "🚨 ALERTA ANTIBULLYING: Acción Requerida"
 
 class IncidentResponder:
     """
@@ -11,6 +15,34 @@ class IncidentResponder:
     """
     
     def __init__(self):
+        # El cliente LLM y las cadenas se crean en el primer uso (importar el módulo no carga langchain)
+        self._lock = threading.Lock()
+        self._chain = None
+        self._digest_chain = None
+
+    def _ensure_chains(self):
+        if self._chain is not None:
+            return
+        with self._lock:
+            if self._chain is not None:
+                return
+            self._build_chains()
+
+    @property
+    def chain(self):
+        self._ensure_chains()
+        return self._chain
+
+    @property
+    def digest_chain(self):
+        self._ensure_chains()
+        return self._digest_chain
+
+    def _build_chains(self):
+        from langchain_openai import ChatOpenAI
+        from langchain_core.prompts import ChatPromptTemplate
+        from langchain_core.output_parsers import StrOutputParser
+
         self.llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0.3)
         
         # Prompt especializado en protocolos de actuación
@@ -31,51 +63,104 @@ class IncidentResponder:
             2. Resumen de los hechos.
             3. Lista de 3 pasosa seguir en las próximas 24 horas (basado en protocolos anti-acoso estándar).
             4. Tono profesional, urgente pero calmado.
+            Escribe el código del alumno exactamente como aparece arriba, sin modificarlo.
             
             Firma como: Agente de Respuesta a Incidentes - Sistema Anti-Bullying.
             """
         )
         
-        self.chain = self.plan_prompt | self.llm | StrOutputParser()
+        plan_chain = self.plan_prompt | self.llm | StrOutputParser()
 
-    def handle_alert(self, student, risk_analysis, teacher_email: str):
-        """
-        Método principal que orquesta la respuesta.
-        """
-        print(f"🚨 [INCIDENT AGENT] Activado para estudiante {student.internal_code}")
-        
-        # 1. Generar Plan con LLM
-        action_plan_email = self.chain.invoke({
-            "risk_level": risk_analysis.risk_level,
-            "student_code": student.internal_code,
-            "flags": ", ".join(risk_analysis.flags),
-            "ai_summary": risk_analysis.recommendation
-        })
-        
-        # 2. Enviar Notificación (Simulada)
-        self._send_email(teacher_email, action_plan_email)
-        
-        return action_plan_email
+        # Resumen agrupado: varias alertas del mismo tutor en un único email
+        self.digest_prompt = ChatPromptTemplate.from_template(
+            """
+            Actúas como un Coordinador de Bienestar y Protección del Menor.
+            En las últimas horas se han detectado {n_alerts} ALERTAS en la clase del mismo Profesor Tutor.
+
+            Alumnos afectados (nivel, indicadores y resumen del análisis inicial):
+            {alerts}
+
+            Genera un único PLAN DE ACCIÓN INMEDIATO (Email formal) dirigido al Profesor Tutor.
+            El email debe incluir:
+            1. Asunto Urgente.
+            2. Resumen de los hechos por alumno, empezando por los de mayor nivel.
+            3. Lista de 3 pasos a seguir en las próximas 24 horas por alumno (basado en protocolos anti-acoso estándar),
+               señalando si los casos pueden estar relacionados.
+            4. Tono profesional, urgente pero calmado.
 
-    def _send_email(self, to_email: str, content: str):
-        # Enviar correo real usando utilidad SMTP
+            Firma como: Agente de Respuesta a Incidentes - Sistema Anti-Bullying.
+            """
+        )
+
+        self._digest_chain = self.digest_prompt | self.llm | StrOutputParser()
+        self._chain = plan_chain # Al final: marca las cadenas como listas
+
+    def plan_for_student(self, student, risk_analysis) -> str:
+        """Email con el plan de acción de un alumno (sin enviarlo)."""
+        plan = self._get_plan(risk_analysis)
+        if STUDENT_PLACEHOLDER in plan:
+            return plan.replace(STUDENT_PLACEHOLDER, student.internal_code)
+        return f"Alumno: {student.internal_code}\n\n{plan}"
+
+    def _get_plan(self, risk_analysis) -> str:
+        """Plan para (nivel, indicadores, recomendación): caché persistente o una llamada al LLM."""
+        risk_level, flags, recommendation = normalize_alert(
+            risk_analysis.risk_level, risk_analysis.flags, risk_analysis.recommendation
+        )
+        key = plan_key(PLAN_PROMPT_VERSION, risk_level, flags, recommendation)
+        db = SessionLocal()
         try:
-            from ..utils.email import send_email
-            # Extract basic subject or use default
-            subject = "🚨 ALERTA ANTIBULLYING: Acción Requerida"
-            
-            # Convierte saltos de linea a <br> para HTML básico si es texto plano
-            html_content = content.replace("\n", "<br>")
-            
-            send_email(to_email, subject, html_content)
-            
+            plan = find_plan(db, key)
+            if plan is not None:
+                db.commit() # Contador de aciertos
+                print(f"⚡ [INCIDENT AGENT] Plan reutilizado de la caché ({risk_level}, {len(flags)} indicadores)")
+                return plan
         except Exception as e:
-            print(f"❌ Error enviando email SMTP: {e}")
+            db.rollback()
+            print(f"⚠️ [INCIDENT AGENT] Plan cache unavailable: {e}")
+
+        try:
+            plan = self.chain.invoke({
+                "risk_level": risk_level,
+                "student_code": STUDENT_PLACEHOLDER,
+                "flags": ", ".join(flags),
+                "ai_summary": recommendation
+            })
+            # Sin el marcador el plan no se puede personalizar: no se guarda
+            if STUDENT_PLACEHOLDER in plan:
+                try:
+                    store_plan(db, key, PLAN_PROMPT_VERSION, risk_level, flags, recommendation, plan)
+                    db.commit()
+                except Exception as e:
+                    db.rollback()
+                    print(f"⚠️ [INCIDENT AGENT] Could not cache plan: {e}")
+            return plan
+        finally:
+            db.close()
+
+    def compose(self, alerts) -> str:
+        """Email para una o varias alertas del mismo tutor [(student, risk_analysis)], sin enviarlo."""
+        if len(alerts) == 1:
+            return self.plan_for_student(*alerts[0])
+
+        codes = ", ".join(student.internal_code for student, _ in alerts)
+        print(f"🚨 [INCIDENT AGENT] Activado para {len(alerts)} estudiantes ({codes})")
+
+        # Críticas primero
+        ordered = sorted(alerts, key=lambda a: a[1].risk_level != "critical")
+        alerts_text = "\n".join(
+            f"- {student.internal_code} | {risk_analysis.risk_level} | "
+            f"{', '.join(risk_analysis.flags) or 'sin indicadores'} | {risk_analysis.recommendation}"
+            for student, risk_analysis in ordered
+        )
+        return self.digest_chain.invoke({
+            "n_alerts": len(alerts),
+            "alerts": alerts_text
+        })
 
-        # Log en terminal (solicitado por usuario)
-        print(f"\n📨 [EMAIL SENT] To: {to_email}")
-        print("---------------------------------------------------")
-        print(content)
-        print("---------------------------------------------------\n")
+    def deliver(self, to_email: str, content: str) -> bool:
+        """Envío síncrono (conexión SMTP del pool) para quien necesita saber si salió: el dispatcher del outbox."""
+        from ..utils.email import send_email
+        return send_email(to_email, ALERT_EMAIL_SUBJECT, content.replace("\n", "<br>"))
 
 incident_responder = IncidentResponder()
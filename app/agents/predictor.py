@@ -1,6 +1,32 @@
+import numpy as np
 from ..schemas import SurveyInput, RiskAnalysisResult, Frequency, YesNo
 from ..models import AlertLevel
 
+# Orden de columnas de la ruta vectorizada (analyze_batch)
+PARENT_ITEMS = [f'p_item_{i}' for i in range(1, 14)]
+TEACHER_ITEMS = [
+    't_vic_insults', 't_vic_exclusion', 't_vic_physical', 't_vic_theft', 't_vic_rumors', 't_vic_threats',
+    't_agg_insults', 't_agg_exclusion', 't_agg_physical', 't_agg_theft', 't_agg_rumors',
+    't_cyber_messages', 't_cyber_anxiety'
+]
+
+def answers_to_matrices(answers_list):
+    """
+    raw_answers decodificados -> (parent (n x 13), teacher (n x 13), is_teacher (n,)).
+    Un cuestionario es de profesor si trae t_vic_insults (mismo criterio que analyze).
+    """
+    n = len(answers_list)
+    parent = np.zeros((n, len(PARENT_ITEMS)), dtype=np.int64)
+    teacher = np.zeros((n, len(TEACHER_ITEMS)), dtype=np.int64)
+    is_teacher = np.zeros(n, dtype=bool)
+    for row, answers in enumerate(answers_list):
+        if answers.get('t_vic_insults') is not None:
+            is_teacher[row] = True
+            teacher[row] = [answers.get(col) or 0 for col in TEACHER_ITEMS]
+        else:
+            parent[row] = [answers.get(col) or 0 for col in PARENT_ITEMS]
+    return parent, teacher, is_teacher
+
 class HeuristicPredictor:
     """
     Motor de análisis basado en reglas (Adaptación TEBAE).
@@ -20,6 +46,29 @@ class HeuristicPredictor:
     THRESHOLD_HIGH = 8
     THRESHOLD_MEDIUM = 4
 
+    # Cortes de nivel que aplica analyze (Max 52): score > corte -> MEDIUM / HIGH / CRITICAL
+    LEVEL_CUTOFFS = (8, 15, 25)
+    # Índice = nº de cortes superados (ruta vectorizada)
+    LEVELS = [AlertLevel.LOW, AlertLevel.MEDIUM, AlertLevel.HIGH, AlertLevel.CRITICAL]
+
+    # Flags en el orden de las columnas que devuelve analyze_batch
+    BATCH_FLAGS = [
+        "Alta Victimización detectada",
+        "Comportamiento Agresor detectado",
+        "Indicios de Ciberacoso",
+        "Indicadores Directos/Físicos Altos",
+        "Alto Malestar Psicosomático",
+        "Marcador Crítico Detectado (Heridas/Coacción)",
+        "Ambiente de Clase Negativo"
+    ]
+
+    def _level_for_score(self, score: int) -> AlertLevel:
+        medium, high, critical = self.LEVEL_CUTOFFS
+        if score > critical: return AlertLevel.CRITICAL
+        elif score > high: return AlertLevel.HIGH
+        elif score > medium: return AlertLevel.MEDIUM
+        else: return AlertLevel.LOW
+
     def analyze(self, data: SurveyInput, teacher_sentiment: float = 0.0) -> RiskAnalysisResult:
         score = 0
         flags = []
@@ -51,10 +100,7 @@ class HeuristicPredictor:
              if cyber_score > 4: flags.append("Indicios de Ciberacoso")
 
              # Umbrales Profesor (Max 52)
-             if score > 25: risk_level = AlertLevel.CRITICAL
-             elif score > 15: risk_level = AlertLevel.HIGH
-             elif score > 8: risk_level = AlertLevel.MEDIUM
-             else: risk_level = AlertLevel.LOW
+             risk_level = self._level_for_score(score)
              
         # --- Lógica Padres (Default: Items p_item_1...13) ---
         else:
@@ -99,10 +145,7 @@ class HeuristicPredictor:
                 flags.append(f"Ambiente de Clase Negativo (+{sentiment_boost})")
 
             # Evaluar nivel de riesgo final
-            if score > 25: risk_level = AlertLevel.CRITICAL
-            elif score > 15: risk_level = AlertLevel.HIGH
-            elif score > 8: risk_level = AlertLevel.MEDIUM
-            else: risk_level = AlertLevel.LOW
+            risk_level = self._level_for_score(score)
 
         # Recomendación básica (será enriquecida luego por el RAG)
         recommendation = self._get_recommendation(risk_level)
@@ -114,6 +157,40 @@ class HeuristicPredictor:
             recommendation=recommendation
         )
 
+    def analyze_batch(self, parent, teacher, is_teacher, teacher_sentiments=0.0):
+        """
+        Versión vectorizada de analyze para muchas encuestas a la vez (ver answers_to_matrices).
+        Devuelve (scores (n,), level_idx (n,) índice en LEVELS, flags (n x len(BATCH_FLAGS)) bool).
+        Mismas reglas que analyze, fila a fila.
+        """
+        sentiments = np.broadcast_to(np.asarray(teacher_sentiments, dtype=np.float64), is_teacher.shape)
+
+        # Profesor: victimización, agresión, ciber
+        vic = teacher[:, 0:6].sum(axis=1)
+        agg = teacher[:, 6:11].sum(axis=1)
+        cyber = teacher[:, 11:13].sum(axis=1)
+
+        # Padres: bloques A, B, C + ajuste por ambiente de clase
+        block_a = parent[:, 0:5].sum(axis=1)
+        block_b = parent[:, 5:10].sum(axis=1)
+        block_c = parent[:, 10:13].sum(axis=1)
+        boost = np.where(sentiments > 0.3, (sentiments * 10).astype(np.int64), 0)
+
+        is_parent = ~is_teacher
+        scores = np.where(is_teacher, vic + agg + cyber, block_a + block_b + block_c + boost)
+        level_idx = (scores[:, None] > np.asarray(self.LEVEL_CUTOFFS)).sum(axis=1)
+
+        flags = np.column_stack([
+            is_teacher & (vic > 10),
+            is_teacher & (agg > 10),
+            (is_teacher & (cyber > 4)) | (is_parent & (block_c > 5)),
+            is_parent & (block_a > 8),
+            is_parent & (block_b > 10),
+            is_parent & ((parent[:, 1] >= 3) | (parent[:, 4] >= 3)),
+            is_parent & (sentiments > 0.3)
+        ])
+        return scores, level_idx, flags
+
     def _get_recommendation(self, level: AlertLevel) -> str:
         if level == AlertLevel.CRITICAL:
             return "ALERTA: Se detectan indicadores graves. Se requiere intervención inmediata del centro."
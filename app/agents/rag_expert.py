@@ -1,22 +1,65 @@
 import os
-from langchain_community.document_loaders import TextLoader, PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_core.output_parsers import StrOutputParser
+import threading
+from datetime import datetime
+
+# langchain / FAISS / OpenAI se importan al inicializar el RAG (primer uso), no al importar
+# el módulo: importar app.main (workers de uvicorn, scripts) no debe pagar ese coste.
+# Al arrancar la app, la carga/reconstrucción de índices va en un hilo (start_background)
+# y el resto del servidor atiende peticiones mientras tanto.
+
+ROLES = ["parents", "teachers"]
+# Estados de índice por rol: pending -> loading (desde disco) / building (re-embedding) ->
+# ready, empty (sin documentos), error o disabled (sin OPENAI_API_KEY)
+WARMING_UP_STATES = ("pending", "loading", "building")
 
 class RagExpert:
     def __init__(self, documents_dir: str = "./documents"):
         self.documents_dir = documents_dir
         self.vectorstores = {"parents": None, "teachers": None}
         self.chains = {"parents": None, "teachers": None}
-
-        if os.environ.get("OPENAI_API_KEY"):
-            self.refresh_knowledge_base()
-        else:
-            print("WARNING: RAG no inicializado. Falta OPENAI_API_KEY")
+        self.index_state = {role: {"state": "pending", "chunks": None, "error": None, "updated_at": None} for role in ROLES}
+        self._init_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._initialized = False
+        self._thread = None
+
+    def _set_state(self, role: str, state: str, chunks: int = None, error: str = None):
+        self.index_state[role] = {
+            "state": state,
+            "chunks": chunks,
+            "error": error,
+            "updated_at": datetime.utcnow().isoformat()
+        }
+
+    def start_background(self):
+        """Lanza la inicialización en un hilo (una sola vez). No bloquea."""
+        with self._start_lock:
+            if self._initialized or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._thread = threading.Thread(target=self.ensure_initialized, name="rag-warmup", daemon=True)
+            self._thread.start()
+
+    def is_warming_up(self, role: str) -> bool:
+        return self.index_state[role]["state"] in WARMING_UP_STATES
+
+    def readiness(self) -> dict:
+        """Estado de los índices por rol (para /health/ready)."""
+        return {role: dict(self.index_state[role]) for role in ROLES}
+
+    def ensure_initialized(self):
+        """Carga (o reconstruye) los índices la primera vez que se necesitan. Thread-safe."""
+        if self._initialized:
+            return
+        with self._init_lock:
+            if self._initialized:
+                return
+            if os.environ.get("OPENAI_API_KEY"):
+                self.refresh_knowledge_base()
+            else:
+                print("WARNING: RAG no inicializado. Falta OPENAI_API_KEY")
+                for role in ROLES:
+                    self._set_state(role, "disabled", error="OPENAI_API_KEY not set")
+            self._initialized = True
 
     def refresh_knowledge_base(self, force_rebuild: bool = False):
         """
@@ -24,7 +67,12 @@ class RagExpert:
         Si existe un índice persistido y no se fuerza rebuild, lo carga.
         Si no, procesa docs y guarda el índice.
         """
-        for role in ["parents", "teachers"]:
+        from langchain_community.document_loaders import TextLoader, PyPDFLoader
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        from langchain_community.vectorstores import FAISS
+        from langchain_openai import OpenAIEmbeddings
+
+        for role in ROLES:
             try:
                 role_dir = os.path.join(self.documents_dir, role)
                 index_path = os.path.join(self.documents_dir, f"{role}_index")
@@ -33,6 +81,7 @@ class RagExpert:
                 is_outdated = self._is_index_outdated(role_dir, index_path)
                 
                 if not force_rebuild and not is_outdated and os.path.exists(index_path):
+                    self._set_state(role, "loading")
                     embeddings = OpenAIEmbeddings()
                     self.vectorstores[role] = FAISS.load_local(
                         index_path, 
@@ -40,6 +89,7 @@ class RagExpert:
                         allow_dangerous_deserialization=True
                     )
                     self._build_chain(role)
+                    self._set_state(role, "ready", chunks=self.vectorstores[role].index.ntotal)
                     print(f"Loaded existing RAG index for {role} from {index_path}")
                     continue
                 
@@ -50,8 +100,11 @@ class RagExpert:
                 if not os.path.exists(role_dir):
                     os.makedirs(role_dir)
                     print(f"Created directory: {role_dir}")
+                    self._set_state(role, "empty")
                     continue
 
+                self._set_state(role, "building")
+
                 docs = []
                 for filename in os.listdir(role_dir):
                     filepath = os.path.join(role_dir, filename)
@@ -68,6 +121,7 @@ class RagExpert:
                 
                 if not docs:
                     print(f"No documents found for {role} in {role_dir}")
+                    self._set_state(role, "empty")
                     continue
 
                 text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
@@ -82,10 +136,12 @@ class RagExpert:
                 
                 # Construir cadena específica para este rol
                 self._build_chain(role)
+                self._set_state(role, "ready", chunks=len(splits))
                 print(f"RAG Knowledge Base for {role} refreshed with {len(splits)} chunks.")
                 
             except Exception as e:
                 print(f"Error initializing RAG for {role}: {e}")
+                self._set_state(role, "error", error=str(e))
 
     def _is_index_outdated(self, role_dir: str, index_path: str) -> bool:
         """Compara la fecha de modificación del index con los archivos de documentos"""
@@ -118,6 +174,10 @@ class RagExpert:
         return latest_doc_mtime > index_mtime
 
     def _build_chain(self, role):
+        from langchain_openai import ChatOpenAI
+        from langchain_core.prompts import ChatPromptTemplate
+        from langchain_core.output_parsers import StrOutputParser
+
         retriever = self.vectorstores[role].as_retriever(search_kwargs={"k": 2})
         
         # Prompts diferenciados
@@ -162,6 +222,7 @@ class RagExpert:
         )
 
     def get_advice(self, query: str, role: str = "parents", history: str = "") -> str:
+        self.ensure_initialized()
         if role not in self.chains or not self.chains[role]:
             return f"El sistema RAG para '{role}' no está activo o no tiene documentos."
             
@@ -0,0 +1,217 @@
+import json
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import delete, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from .models import SurveyFeatures, ClassObservation, TeacherAtmosphere
+from .utils.text_analysis import score_observation, score_observations
+
+# Orden de columnas con el que se entrena y se puntúa el modelo
+ITEM_COLUMNS = [f'p_item_{i}' for i in range(1, 14)]
+FEATURE_COLUMNS = ITEM_COLUMNS + ['teacher_sentiment']
+
+def feature_values(answers: dict, teacher_sentiment: float = 0.0) -> dict:
+    """Vector de features (como dict columna -> valor) a partir de un raw_answers decodificado."""
+    values = {col: int(answers.get(col, 0) or 0) for col in ITEM_COLUMNS}
+    values['teacher_sentiment'] = float(teacher_sentiment)
+    return values
+
+def make_survey_features(survey_id: int, answers: dict, teacher_sentiment: float = 0.0) -> SurveyFeatures:
+    """Fila del feature store para una encuesta recién guardada."""
+    return SurveyFeatures(survey_id=survey_id, **feature_values(answers, teacher_sentiment))
+
+def feature_store_columns():
+    """Columnas de SurveyFeatures en el orden de FEATURE_COLUMNS (para select)."""
+    return [getattr(SurveyFeatures, col) for col in FEATURE_COLUMNS]
+
+# --- Teacher Context (as-of) ---
+# El sentimiento del profesor para una encuesta usa sus últimas SENTIMENT_WINDOW
+# observaciones anteriores a la fecha de la encuesta y dentro de SENTIMENT_LOOKBACK.
+# submit_survey y el entrenamiento usan este mismo código para que la feature signifique lo mismo.
+SENTIMENT_WINDOW = 5
+SENTIMENT_LOOKBACK = timedelta(days=90)
+
+class TeacherTimeline:
+    """Observaciones de un profesor ordenadas por fecha, con su score ya calculado (prefix sums)."""
+
+    def __init__(self, timestamps, scores):
+        self.timestamps = timestamps
+        self.scores = scores
+        self.prefix = [0.0]
+        for score in scores:
+            self.prefix.append(self.prefix[-1] + score)
+
+    def sentiment_as_of(self, as_of: datetime) -> float:
+        hi = bisect_right(self.timestamps, as_of)
+        lo = max(hi - SENTIMENT_WINDOW, bisect_left(self.timestamps, as_of - SENTIMENT_LOOKBACK))
+        if hi <= lo:
+            return 0.0
+        return min((self.prefix[hi] - self.prefix[lo]) / (hi - lo), 1.0)
+
+def load_teacher_timelines(db: Session, teacher_ids=None, until: datetime = None) -> dict:
+    """
+    {teacher_id: TeacherTimeline} con una sola consulta ordenada.
+    Cada observación se puntúa una única vez.
+    """
+    query = db.query(ClassObservation.teacher_id, ClassObservation.timestamp, ClassObservation.content)\
+        .filter(ClassObservation.timestamp.isnot(None))
+    if teacher_ids is not None:
+        query = query.filter(ClassObservation.teacher_id.in_(list(teacher_ids)))
+    if until is not None:
+        query = query.filter(
+            ClassObservation.timestamp <= until,
+            ClassObservation.timestamp >= until - SENTIMENT_LOOKBACK
+        )
+
+    rows = query.order_by(ClassObservation.teacher_id, ClassObservation.timestamp).all()
+    all_scores = score_observations(content for _, _, content in rows)
+
+    grouped = defaultdict(lambda: ([], []))
+    for (teacher_id, timestamp, _), score in zip(rows, all_scores):
+        timestamps, scores = grouped[teacher_id]
+        timestamps.append(timestamp)
+        scores.append(score)
+
+    return {tid: TeacherTimeline(ts, scores) for tid, (ts, scores) in grouped.items()}
+
+def _window_sentiment(entries, as_of: datetime) -> float:
+    """Media (con tope 1.0) de las entradas [(timestamp, score)] dentro del lookback."""
+    recent = [score for timestamp, score in entries if timestamp >= as_of - SENTIMENT_LOOKBACK]
+    if not recent:
+        return 0.0
+    return min(sum(recent) / len(recent), 1.0)
+
+def _record_entries(record: TeacherAtmosphere):
+    return [(datetime.fromisoformat(ts), score) for ts, score in json.loads(record.window or "[]")]
+
+def _store_entries(record: TeacherAtmosphere, entries):
+    record.window = json.dumps([[ts.isoformat(), score] for ts, score in entries])
+    record.score = _window_sentiment(entries, entries[-1][0]) if entries else 0.0
+    record.updated_at = datetime.utcnow()
+
+def record_observation(db: Session, observation: ClassObservation):
+    """
+    Actualiza la ventana móvil del profesor con una observación nueva (sin commit).
+    Se llama una vez al guardar la observación: el texto se puntúa aquí y no se vuelve a leer.
+    """
+    # La ventana es un JSON por profesor: se bloquea la fila hasta el commit para que dos
+    # partes de clase simultáneos no lean la misma ventana y el segundo pise al primero
+    # (SQLite ignora FOR UPDATE; allí el bloqueo de escritura ya serializa las transacciones).
+    already_stored = observation.id is not None # Antes del savepoint (hace flush de la sesión)
+    query = db.query(TeacherAtmosphere).filter(TeacherAtmosphere.teacher_id == observation.teacher_id)\
+        .with_for_update().populate_existing()
+    record = query.one_or_none()
+    if record is None:
+        # Primera vez (o tabla sin reconstruir): la ventana arranca con el histórico del profesor
+        timeline = load_teacher_timelines(db, [observation.teacher_id]).get(observation.teacher_id)
+        entries = list(zip(timeline.timestamps, timeline.scores))[-SENTIMENT_WINDOW:] if timeline else []
+        try:
+            # Savepoint: si otro parte crea la fila a la vez, se bloquea la suya y se actualiza
+            with db.begin_nested():
+                record = TeacherAtmosphere(teacher_id=observation.teacher_id)
+                _store_entries(record, entries)
+                db.add(record)
+        except IntegrityError:
+            record = query.one()
+            entries = _record_entries(record)
+        else:
+            if already_stored:
+                # Ya en la base de datos (flush previo): el histórico la incluye
+                return
+    else:
+        entries = _record_entries(record)
+    entries.append((observation.timestamp, score_observation(observation.content)))
+    entries.sort(key=lambda entry: entry[0])
+    _store_entries(record, entries[-SENTIMENT_WINDOW:])
+
+def teacher_sentiment_as_of(db: Session, teacher_id: int, as_of: datetime) -> float:
+    """
+    Sentimiento de un profesor en una fecha (ruta online de submit_survey).
+    Usa la ventana de teacher_atmosphere (una consulta por PK) y solo recurre al
+    histórico de observaciones si no hay registro o la fecha es anterior a la ventana.
+    """
+    if not teacher_id:
+        return 0.0
+    record = db.get(TeacherAtmosphere, teacher_id)
+    if record is not None:
+        entries = _record_entries(record)
+        if not entries or entries[-1][0] <= as_of:
+            return _window_sentiment(entries, as_of)
+    timeline = load_teacher_timelines(db, [teacher_id], until=as_of).get(teacher_id)
+    return timeline.sentiment_as_of(as_of) if timeline else 0.0
+
+def teacher_sentiments_as_of(db: Session, teacher_ids, as_of: datetime) -> dict:
+    """
+    Versión en bloque de teacher_sentiment_as_of: {teacher_id: sentimiento} con una consulta
+    a teacher_atmosphere y, para los profesores sin ventana válida, una al histórico.
+    """
+    missing = {tid for tid in teacher_ids if tid}
+    sentiments = {}
+    if not missing:
+        return sentiments
+    for record in db.query(TeacherAtmosphere).filter(TeacherAtmosphere.teacher_id.in_(list(missing))):
+        entries = _record_entries(record)
+        if not entries or entries[-1][0] <= as_of:
+            sentiments[record.teacher_id] = _window_sentiment(entries, as_of)
+            missing.discard(record.teacher_id)
+    if missing:
+        timelines = load_teacher_timelines(db, missing, until=as_of)
+        for tid in missing:
+            timeline = timelines.get(tid)
+            sentiments[tid] = timeline.sentiment_as_of(as_of) if timeline else 0.0
+    return sentiments
+
+FEATURE_LOOKUP_CHUNK = 900 # IDs por consulta IN (límite de variables de SQLite)
+
+def survey_feature_vectors(db: Session, surveys) -> dict:
+    """
+    {survey_id: (items, teacher_sentiment)} con el mismo vector con el que se entrena el modelo:
+    la fila del feature store (una consulta por bloque de IDs) o, para encuestas sin fila
+    (anteriores al backfill), raw_answers + sentimiento as-of la fecha de la encuesta.
+    Las encuestas sin vector posible (raw_answers vacío o inválido) no aparecen.
+    """
+    ids = [survey.id for survey in surveys]
+    vectors = {}
+    for start in range(0, len(ids), FEATURE_LOOKUP_CHUNK):
+        rows = db.query(SurveyFeatures.survey_id, *feature_store_columns())\
+            .filter(SurveyFeatures.survey_id.in_(ids[start:start + FEATURE_LOOKUP_CHUNK]))
+        for survey_id, *values in rows:
+            items = dict(zip(ITEM_COLUMNS, values))
+            vectors[survey_id] = (items, float(values[-1] or 0.0))
+
+    missing = [survey for survey in surveys if survey.id not in vectors and survey.raw_answers]
+    if missing:
+        teacher_of = {survey.id: survey.student.teacher_id if survey.student else None for survey in missing}
+        timelines = load_teacher_timelines(db, {tid for tid in teacher_of.values() if tid})
+        for survey in missing:
+            try:
+                answers = json.loads(survey.raw_answers)
+            except (ValueError, TypeError):
+                continue
+            if not isinstance(answers, dict):
+                continue
+            timeline = timelines.get(teacher_of[survey.id])
+            sentiment = timeline.sentiment_as_of(survey.date_submitted) if timeline and survey.date_submitted else 0.0
+            vectors[survey.id] = (answers, sentiment)
+    return vectors
+
+def rebuild_teacher_atmosphere(db: Session) -> int:
+    """Recalcula teacher_atmosphere desde class_observations (sin commit). Devuelve nº de profesores."""
+    rows = []
+    for teacher_id, timeline in load_teacher_timelines(db).items():
+        if teacher_id is None:
+            continue
+        record = TeacherAtmosphere(teacher_id=teacher_id)
+        _store_entries(record, list(zip(timeline.timestamps, timeline.scores))[-SENTIMENT_WINDOW:])
+        rows.append({
+            "teacher_id": teacher_id,
+            "score": record.score,
+            "window": record.window,
+            "updated_at": record.updated_at
+        })
+    db.execute(delete(TeacherAtmosphere))
+    if rows:
+        db.execute(insert(TeacherAtmosphere), rows)
+    return len(rows)
@@ -0,0 +1,36 @@
+import hashlib
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+from .models import IdempotencyKey
+
+# Claves de idempotencia para los envíos de encuestas.
+# La clave se guarda en la misma transacción que la encuesta: si el commit falla no queda
+# clave, y si dos reintentos llegan a la vez solo uno puede insertarla (PK user_id + key).
+IDEMPOTENCY_TTL = timedelta(hours=24)
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+def request_fingerprint(*parts: str) -> str:
+    """Hash de la petición para detectar una clave reutilizada con otro contenido."""
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+def find_key(db: Session, user_id: int, key: str):
+    """Clave vigente del usuario o None (las caducadas no cuentan)."""
+    record = db.get(IdempotencyKey, (user_id, key))
+    if record is None or record.expires_at <= datetime.utcnow():
+        return None
+    return record
+
+def remember_key(db: Session, user_id: int, key: str, fingerprint: str, response_json: str, survey_id: int = None):
+    """Añade la clave con su respuesta (sin commit) y purga las caducadas."""
+    now = datetime.utcnow()
+    # Índice sobre expires_at: borrado barato; también libera la PK si esta misma clave había caducado
+    db.query(IdempotencyKey).filter(IdempotencyKey.expires_at <= now).delete(synchronize_session=False)
+    db.add(IdempotencyKey(
+        user_id=user_id,
+        key=key,
+        request_hash=fingerprint,
+        response=response_json,
+        survey_id=survey_id,
+        created_at=now,
+        expires_at=now + IDEMPOTENCY_TTL
+    ))
@@ -1,4 +1,6 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.responses import RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from .database import init_db
@@ -15,7 +17,21 @@ load_dotenv(override=True)
 # Inicializar Base de Datos al arrancar
 init_db()
 
-app = FastAPI(title="Anti-Bullying Platform", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Índices RAG en segundo plano: el servidor acepta peticiones desde el primer momento
+    from .agents.rag_expert import rag_system
+    rag_system.start_background()
+    # Worker de envíos asíncronos: recupera las encuestas aceptadas (202) antes de un reinicio
+    from .submission_queue import submission_queue
+    submission_queue.start()
+    # Envío de las alertas del outbox (salvo que lo haga scripts/dispatch_notifications.py aparte)
+    from .notification_outbox import OUTBOX_DISPATCH_IN_PROCESS, start_background_dispatcher
+    if OUTBOX_DISPATCH_IN_PROCESS:
+        start_background_dispatcher()
+    yield
+
+app = FastAPI(title="Anti-Bullying Platform", version="1.0.0", lifespan=lifespan)
 
 # Register Limiter
 app.state.limiter = limiter
@@ -35,3 +51,20 @@ app.include_router(parents.router)
 @app.get("/")
 def read_root():
     return RedirectResponse(url="/auth/login")
+
+@app.get("/health/ready", tags=["health"])
+def readiness():
+    """
+    Readiness para el balanceador: 503 mientras algún índice RAG se está cargando;
+    200 al terminar ("degraded" si algún rol quedó sin índice). Sin autenticación.
+    """
+    from .agents.rag_expert import rag_system, WARMING_UP_STATES
+    roles = rag_system.readiness()
+    states = [info["state"] for info in roles.values()]
+    if any(state in WARMING_UP_STATES for state in states):
+        status = "warming_up"
+    elif all(state == "ready" for state in states):
+        status = "ready"
+    else:
+        status = "degraded"
+    return JSONResponse(status_code=503 if status == "warming_up" else 200, content={"status": status, "rag": roles})
@@ -1,69 +1,526 @@
 import json
+import os
+import hashlib
+import threading
+import tempfile
+import shutil
+import time
+from datetime import datetime
+from collections import OrderedDict
 import joblib
+import numpy as np
 import pandas as pd
-import shap
+from sqlalchemy import select, func, or_, and_
 from sqlalchemy.orm import Session
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
-from .models import SurveyResponse, AlertLevel, ClassObservation, User, Student
+from .models import SurveyResponse, SurveyFeatures, AlertLevel, ClassObservation, User, Student
+from .feature_store import FEATURE_COLUMNS, feature_store_columns, load_teacher_timelines
 from .database import engine
-from .utils.text_analysis import calculate_atmosphere_score
 
-MODEL_PATH = "model.pkl"
+MODEL_PATH = "model.pkl" # Artefacto heredado (anterior a los modelos versionados)
 
-def load_data(db: Session):
-    surveys = db.query(SurveyResponse).filter(SurveyResponse.raw_answers.isnot(None)).all()
-    data = []
-    
-    for s in surveys:
-        try:
-            answers = json.loads(s.raw_answers)
-            # Flatten features
-            row = {}
-            # Items 1-13
-            for i in range(1, 14):
-                row[f'p_item_{i}'] = int(answers.get(f'p_item_{i}', 0))
-                
-            # --- NEW: Teacher Context ---
-            # Find the teacher associated with the student AT THE TIME
-            # (Simplification: Use current teacher observations)
-            teacher_sentiment = 0.0
-            if s.student and s.student.teacher_id:
-                # Get observations from THAT teacher
-                # Ideal: Filter by date range near survey. Simplification: Last 5.
-                observations = db.query(ClassObservation)\
-                    .filter(ClassObservation.teacher_id == s.student.teacher_id)\
-                    .order_by(ClassObservation.timestamp.desc())\
-                    .limit(5).all()
-                    
-                teacher_sentiment = calculate_atmosphere_score(observations)
-            
-            row['teacher_sentiment'] = teacher_sentiment
-            # ----------------------------
-            
-            # Target Determination
-            # 1. Expert Label Overrides everything
-            if s.expert_label == "real_case":
-                target = 1
-            elif s.expert_label == "false_positive":
-                target = 0
-            elif s.expert_label == "false_negative":
-                target = 1 
-            else:
-                # 2. Heuristic fallback
-                if s.risk_level in [AlertLevel.HIGH, AlertLevel.CRITICAL]:
-                    target = 1
-                else:
-                    target = 0
-            
-            row['target'] = target
-            data.append(row)
-        except:
+# Modelos versionados: models/<version>/model.pkl + metadata.json, y models/CURRENT apunta al publicado
+MODELS_DIR = "models"
+MODEL_FILENAME = "model.pkl"
+METADATA_FILENAME = "metadata.json"
+CURRENT_POINTER = "CURRENT"
+MODEL_VERSIONS_KEEP = 5 # Versiones anteriores que se conservan (además de la publicada) para rollback
+
+ITEM_2_COL = FEATURE_COLUMNS.index('p_item_2')
+ITEM_5_COL = FEATURE_COLUMNS.index('p_item_5')
+SENTIMENT_COL = FEATURE_COLUMNS.index('teacher_sentiment')
+
+
+def read_current_version(models_dir: str = MODELS_DIR):
+    """Versión publicada en models/CURRENT, o None si todavía no hay ninguna."""
+    try:
+        with open(os.path.join(models_dir, CURRENT_POINTER)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def read_model_metadata(version: str, models_dir: str = MODELS_DIR):
+    """Metadatos (muestras, balance de clases, tiempo de entrenamiento) de una versión."""
+    try:
+        with open(os.path.join(models_dir, version, METADATA_FILENAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def publish_model(clf, metadata: dict, models_dir: str = MODELS_DIR):
+    """
+    Escribe models/<version>/ de forma atómica (directorio temporal + rename)
+    y después mueve el puntero CURRENT. Los workers siguen sirviendo la versión
+    anterior hasta que el puntero cambia.
+    """
+    os.makedirs(models_dir, exist_ok=True)
+    version = metadata["version"]
+
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=models_dir)
+    try:
+        joblib.dump(clf, os.path.join(tmp_dir, MODEL_FILENAME))
+        with open(os.path.join(tmp_dir, METADATA_FILENAME), "w") as f:
+            json.dump(metadata, f, indent=2)
+        os.replace(tmp_dir, os.path.join(models_dir, version))
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    pointer_tmp = os.path.join(models_dir, CURRENT_POINTER + ".tmp")
+    with open(pointer_tmp, "w") as f:
+        f.write(version)
+    os.replace(pointer_tmp, os.path.join(models_dir, CURRENT_POINTER))
+    prune_model_versions(models_dir)
+    return version
+
+def prune_model_versions(models_dir: str = MODELS_DIR, keep: int = MODEL_VERSIONS_KEEP):
+    """
+    Borra los directorios models/<version>/ más antiguos: conserva la versión publicada
+    y las `keep` más recientes. Se llama después de mover el puntero CURRENT.
+    """
+    current = read_current_version(models_dir)
+    versions = []
+    for name in os.listdir(models_dir):
+        path = os.path.join(models_dir, name)
+        if name == current or name.startswith(".") or not os.path.isdir(path):
             continue
-            
-    return pd.DataFrame(data)
+        versions.append((os.path.getmtime(path), name))
+    versions.sort(reverse=True)
+    for _, name in versions[keep:]:
+        shutil.rmtree(os.path.join(models_dir, name), ignore_errors=True)
+        print(f"Removed old model version {name}")
+
+
+class CompiledForest:
+    """
+    RandomForestClassifier aplanado en arrays NumPy contiguos.
+    Todos los árboles comparten los mismos arrays (feature, threshold, left, right, value)
+    y se recorren nivel a nivel de forma vectorizada, sin pasar por sklearn ni pandas.
+    """
+
+    def __init__(self, feature, threshold, left, right, value, roots, max_depth):
+        self.feature = feature       # int32: feature del nodo (0 en hojas)
+        self.threshold = threshold   # float64: umbral (x <= threshold -> izquierda)
+        self.left = left             # int32: hijo izquierdo global (la hoja apunta a sí misma)
+        self.right = right           # int32: hijo derecho global (la hoja apunta a sí misma)
+        self.value = value           # float64: probabilidad de clase 1 en el nodo
+        self.roots = roots           # int32: índice global de la raíz de cada árbol
+        self.max_depth = max_depth
+        # Hijos intercalados [izq0, der0, izq1, der1, ...] para elegir rama con un solo take
+        self.children = np.ascontiguousarray(np.stack([left, right], axis=1).ravel())
+
+    def predict_proba(self, X):
+        """Probabilidad de clase 1 para cada fila de X (n_rows x n_features)."""
+        # sklearn compara en float32: replicamos el redondeo para obtener las mismas ramas
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        n_rows, n_features = X.shape
+        flat_X = X.ravel()
+        row_base = (np.arange(n_rows, dtype=np.int64) * n_features)[:, None]
+
+        idx = np.broadcast_to(self.roots, (n_rows, len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            x = flat_X.take(row_base + self.feature.take(idx))
+            go_right = x > self.threshold.take(idx)
+            idx = self.children.take(idx * 2 + go_right)
+        return self.value.take(idx).mean(axis=1)
+
+def compile_forest(clf):
+    """
+    Exporta un RandomForestClassifier entrenado a CompiledForest.
+    Devuelve None si el modelo no distingue dos clases (se usa el fallback de sklearn).
+    """
+    classes = list(getattr(clf, "classes_", []))
+    if len(classes) < 2 or 1 not in classes:
+        return None
+    positive = classes.index(1)
+
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for est in clf.estimators_:
+        tree = est.tree_
+        n = tree.node_count
+        node_ids = np.arange(n, dtype=np.int32)
+        is_leaf = tree.children_left == -1
+
+        counts = tree.value[:, 0, :]
+        totals = counts.sum(axis=1)
+        totals[totals == 0] = 1.0
+
+        features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+        thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+        lefts.append(np.where(is_leaf, node_ids, tree.children_left).astype(np.int32) + offset)
+        rights.append(np.where(is_leaf, node_ids, tree.children_right).astype(np.int32) + offset)
+        values.append(counts[:, positive] / totals)
+        roots.append(offset)
+
+        offset += n
+        max_depth = max(max_depth, tree.max_depth)
+
+    return CompiledForest(
+        np.ascontiguousarray(np.concatenate(features)),
+        np.ascontiguousarray(np.concatenate(thresholds)),
+        np.ascontiguousarray(np.concatenate(lefts)),
+        np.ascontiguousarray(np.concatenate(rights)),
+        np.ascontiguousarray(np.concatenate(values)),
+        np.asarray(roots, dtype=np.int32),
+        max_depth
+    )
+
+def _compile_and_verify(clf, n_rows: int = 64):
+    """Compila el bosque y comprueba paridad con sklearn en filas aleatorias. None si no coincide."""
+    try:
+        compiled = compile_forest(clf)
+        if compiled is None:
+            return None
+        rng = np.random.default_rng(0)
+        X = rng.integers(0, 5, size=(n_rows, len(FEATURE_COLUMNS))).astype(np.float64)
+        X[:, SENTIMENT_COL] = rng.random(n_rows)
+        expected = _positive_proba(clf, X)
+        if not np.allclose(compiled.predict_proba(X), expected, atol=1e-9):
+            print("ML Registry: compiled forest mismatch, falling back to sklearn")
+            return None
+        return compiled
+    except Exception as e:
+        print(f"ML Registry: could not compile forest: {e}")
+        return None
+
+
+class LoadedModel:
+    """Modelo cargado en memoria junto con su explicador SHAP y su versión compilada."""
+
+    def __init__(self, version: str, clf, stamp, compiled=None):
+        self.version = version
+        self.clf = clf
+        self.stamp = stamp
+        self.compiled = compiled
+        self._explainer = None
+        self._explainer_lock = threading.Lock()
+
+    @property
+    def explainer(self):
+        """TreeExplainer creado en la primera explicación (importar shap cuesta ~2 s)."""
+        if self._explainer is None:
+            with self._explainer_lock:
+                if self._explainer is None:
+                    import shap
+                    self._explainer = shap.TreeExplainer(self.clf)
+        return self._explainer
+
+    def positive_proba(self, X):
+        """Probabilidad de clase 1: bosque compilado si está disponible, si no sklearn."""
+        if self.compiled is not None:
+            return self.compiled.predict_proba(X)
+        return _positive_proba(self.clf, X)
+
+
+class ModelRegistry:
+    """
+    Registro de modelo por proceso.
+    Carga el modelo una sola vez y mantiene el clasificador y su TreeExplainer en memoria.
+    Sigue el puntero models/CURRENT publicado por train_model; si no existe,
+    usa el model.pkl heredado (versión = hash del contenido).
+    Cuando se publica un artefacto nuevo se recarga y se sustituye de forma atómica.
+    """
+
+    def __init__(self, path: str = MODEL_PATH, models_dir: str = MODELS_DIR):
+        self.path = path
+        self.models_dir = models_dir
+        self._lock = threading.Lock()
+        self._current = None
+
+    def _stat_stamp(self):
+        stamp = []
+        for candidate in (os.path.join(self.models_dir, CURRENT_POINTER), self.path):
+            try:
+                st = os.stat(candidate)
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamp.append(None)
+        if stamp == [None, None]:
+            return None
+        return tuple(stamp)
+
+    def _resolve(self):
+        """Devuelve (version, path) del artefacto publicado. version es None para el model.pkl heredado."""
+        version = read_current_version(self.models_dir)
+        if version:
+            path = os.path.join(self.models_dir, version, MODEL_FILENAME)
+            if os.path.exists(path):
+                return version, path
+        return None, self.path
+
+    def get(self):
+        """Devuelve el LoadedModel vigente, recargando si se ha publicado otro. None si no hay modelo."""
+        stamp = self._stat_stamp()
+        current = self._current
+        if stamp is None:
+            return current
+        if current is not None and current.stamp == stamp:
+            return current
+
+        with self._lock:
+            # Otro hilo puede haber recargado mientras esperábamos
+            current = self._current
+            if current is not None and current.stamp == stamp:
+                return current
+
+            version, path = self._resolve()
+            if version is None:
+                try:
+                    with open(path, "rb") as f:
+                        version = hashlib.sha256(f.read()).hexdigest()[:12]
+                except OSError:
+                    return current
+
+            if current is not None and current.version == version:
+                # Mismo artefacto (ej: touch), solo actualizamos el sello
+                current.stamp = stamp
+                return current
+
+            try:
+                clf = joblib.load(path)
+            except Exception as e:
+                print(f"ML Registry: error loading {path}: {e}")
+                return current
+
+            self._current = LoadedModel(version, clf, stamp, _compile_and_verify(clf))
+            print(f"ML Registry: loaded model version {version}")
+            return self._current
+
+    @property
+    def version(self):
+        loaded = self.get()
+        return loaded.version if loaded else None
+
+
+model_registry = ModelRegistry()
+
+
+def get_model_version():
+    """Versión (hash corto) del modelo servido actualmente, o None si no hay modelo."""
+    return model_registry.version
+
+
+# Tamaño de bloque para leer encuestas en streaming durante el entrenamiento
+LOAD_CHUNK_SIZE = 1000
+
+def _targets_for_chunk(labels, levels):
+    """
+    Target Determination (vectorizado):
+    1. Expert Label Overrides everything
+    2. Heuristic fallback (HIGH/CRITICAL -> 1)
+    """
+    labels = np.asarray(labels, dtype=object)
+    heuristic = np.isin(np.asarray(levels, dtype=object), [AlertLevel.HIGH, AlertLevel.CRITICAL])
+    target = np.where(np.isin(labels, ["real_case", "false_negative"]), 1,
+             np.where(labels == "false_positive", 0, heuristic.astype(int)))
+    return target
+
+def _restrict(stmt, where=None, sample=None):
+    """Aplica un filtro opcional y, si se pide, una muestra aleatoria de como mucho `sample` filas."""
+    if where is not None:
+        stmt = stmt.filter(where)
+    if sample is not None:
+        stmt = stmt.order_by(func.random()).limit(sample)
+    return stmt
+
+def _load_stored_features(db: Session, where=None, sample=None):
+    """Encuestas con vector en el feature store: se leen directamente como matriz, sin JSON."""
+    stmt = select(
+        *feature_store_columns(),
+        SurveyResponse.expert_label,
+        SurveyResponse.risk_level
+    ).join(SurveyResponse, SurveyFeatures.survey_id == SurveyResponse.id)
+    stmt = _restrict(stmt, where, sample).execution_options(yield_per=LOAD_CHUNK_SIZE)
+
+    n_features = len(FEATURE_COLUMNS)
+    for chunk in db.execute(stmt).partitions():
+        X = np.array([row[:n_features] for row in chunk], dtype=np.float64)
+        labels = [row[n_features] for row in chunk]
+        levels = [row[n_features + 1] for row in chunk]
+        yield X, _targets_for_chunk(labels, levels)
+
+def _load_legacy_features(db: Session, where=None, sample=None):
+    """
+    Encuestas antiguas sin fila en el feature store (antes del backfill):
+    se decodifica raw_answers y el sentimiento se calcula as-of la fecha de cada encuesta.
+    """
+    # --- Teacher Context ---
+    timelines = None
+
+    stmt = select(
+        SurveyResponse.raw_answers,
+        SurveyResponse.expert_label,
+        SurveyResponse.risk_level,
+        SurveyResponse.date_submitted,
+        Student.teacher_id
+    ).outerjoin(Student, SurveyResponse.student_id == Student.id)\
+     .outerjoin(SurveyFeatures, SurveyFeatures.survey_id == SurveyResponse.id)\
+     .filter(SurveyResponse.raw_answers.isnot(None), SurveyFeatures.survey_id.is_(None))
+    stmt = _restrict(stmt, where, sample).execution_options(yield_per=LOAD_CHUNK_SIZE)
+
+    for chunk in db.execute(stmt).partitions():
+        if timelines is None:
+            timelines = load_teacher_timelines(db)
+
+        X = np.zeros((len(chunk), len(FEATURE_COLUMNS)), dtype=np.float64)
+        keep = np.ones(len(chunk), dtype=bool)
+        labels = []
+        levels = []
+        for row, (raw_answers, expert_label, risk_level, date_submitted, teacher_id) in enumerate(chunk):
+            labels.append(expert_label)
+            levels.append(risk_level)
+            try:
+                _fill_feature_row(X, row, json.loads(raw_answers))
+            except (ValueError, TypeError, AttributeError):
+                keep[row] = False
+                continue
+            timeline = timelines.get(teacher_id)
+            if timeline is not None and date_submitted is not None:
+                X[row, SENTIMENT_COL] = timeline.sentiment_as_of(date_submitted)
+
+        yield X[keep], _targets_for_chunk(labels, levels)[keep]
+
+def load_data(db: Session, where=None, sample=None):
+    """
+    Extrae la matriz de entrenamiento en streaming (yield_per).
+    Lee primero el feature store (survey_features) y solo decodifica JSON
+    para las encuestas que todavía no tienen vector guardado.
+    where: condición SQL opcional sobre SurveyResponse; sample: muestra aleatoria de como mucho N filas.
+    """
+    X_blocks = []
+    y_blocks = []
+    for source in (_load_stored_features(db, where, sample), _load_legacy_features(db, where, sample)):
+        for X, y in source:
+            X_blocks.append(X)
+            y_blocks.append(y)
+
+    if not X_blocks:
+        return pd.DataFrame(columns=FEATURE_COLUMNS + ['target'])
+
+    df = pd.DataFrame(np.vstack(X_blocks), columns=FEATURE_COLUMNS)
+    df['target'] = np.concatenate(y_blocks)
+    if sample is not None and len(df) > sample:
+        # Cada fuente muestrea por separado: recortamos al total pedido
+        df = df.sample(n=sample, random_state=42).reset_index(drop=True)
+    return df
+
+# --- Búsqueda de hiperparámetros (opcional) ---
+DEFAULT_N_ESTIMATORS = 100
+SEARCH_CV_FOLDS = 5
+SEARCH_PARAM_GRID = {
+    "n_estimators": [25, 50, 100, 200],
+    "max_depth": [None, 8, 16],
+    "min_samples_leaf": [1, 5],
+}
+# Presupuesto de latencia p99 de inferencia de una fila (ms). Sin variable = sin límite.
+INFERENCE_BUDGET_MS = float(os.getenv("ML_INFERENCE_BUDGET_MS")) if os.getenv("ML_INFERENCE_BUDGET_MS") else None
+LATENCY_SAMPLE_ROWS = 200
+
+def _fit_candidate(X, y, train_idx, test_idx, params, keep_model: bool = False):
+    """
+    Ajusta un candidato en un fold y mide precisión y tiempo de ajuste.
+    Se ejecuta en los workers de joblib; X e y se comparten entre todos los candidatos.
+    Con keep_model devuelve además el modelo tal y como se sirve (bosque compilado, o el
+    de sklearn si no se puede compilar) para medir su latencia después, fuera de los workers.
+    """
+    clf = RandomForestClassifier(random_state=42, n_jobs=1, **params)
+    started = time.perf_counter()
+    clf.fit(X[train_idx], y[train_idx])
+    fit_seconds = time.perf_counter() - started
+
+    accuracy = float((clf.predict(X[test_idx]) == y[test_idx]).mean())
+
+    result = {"accuracy": accuracy, "fit_seconds": fit_seconds}
+    if keep_model:
+        compiled = compile_forest(clf)
+        result["model"] = compiled if compiled is not None else clf
+    return result
+
+def _single_row_latency(model, rows):
+    """
+    (p50, p99) en ms de la inferencia de una fila, una a una. Se llama en el proceso padre
+    cuando ya no hay ajustes en marcha: con todos los núcleos ocupados la medida sería ruido.
+    """
+    if len(rows) == 0:
+        return 0.0, 0.0
+    if isinstance(model, CompiledForest):
+        predict = model.predict_proba
+    else:
+        predict = lambda row: model.predict_proba(row[None, :])
+    predict(rows[0]) # Calentamiento (cachés, primera asignación)
+    samples = []
+    for row in rows:
+        started = time.perf_counter()
+        predict(row)
+        samples.append((time.perf_counter() - started) * 1000)
+    return float(np.percentile(samples, 50)), float(np.percentile(samples, 99))
+
+def search_hyperparameters(X, y, param_grid=None, cv: int = SEARCH_CV_FOLDS, n_jobs: int = -1,
+                           inference_budget_ms=INFERENCE_BUDGET_MS):
+    """
+    Búsqueda con validación cruzada sobre parámetros del bosque usando todos los núcleos.
+    La matriz y los folds se calculan una sola vez y se comparten entre candidatos.
+    La latencia de una fila (p50/p99, la que decide inference_budget_ms) se mide al terminar
+    todos los ajustes, candidato a candidato, sobre el modelo compilado de su primer fold.
+    Devuelve (mejores_params, resultados_por_candidato) o (None, []) si no hay datos suficientes.
+    """
+    from joblib import Parallel, delayed
+    from sklearn.model_selection import StratifiedKFold, ParameterGrid
+
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    y = np.asarray(y)
+    min_class = int(np.bincount(y).min()) if len(np.unique(y)) > 1 else 0
+    n_splits = min(cv, min_class)
+    if n_splits < 2:
+        print("Not enough samples per class for cross-validation, skipping search.")
+        return None, []
+
+    folds = list(StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=42).split(X, y))
+    candidates = list(ParameterGrid(param_grid or SEARCH_PARAM_GRID))
 
-def train_model():
+    # Ajustes en paralelo; el modelo del primer fold de cada candidato se conserva para medir latencia
+    scores = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_candidate)(X, y, train_idx, test_idx, params, keep_model=(fold == 0))
+        for params in candidates
+        for fold, (train_idx, test_idx) in enumerate(folds)
+    )
+
+    # Latencia secuencial en el proceso padre, con los workers ya parados
+    latency_rows = X[folds[0][1][:LATENCY_SAMPLE_ROWS]]
+    results = []
+    for i, params in enumerate(candidates):
+        per_fold = scores[i * len(folds):(i + 1) * len(folds)]
+        p50_ms, p99_ms = _single_row_latency(per_fold[0].pop("model"), latency_rows)
+        results.append({
+            "params": params,
+            "accuracy": float(np.mean([f["accuracy"] for f in per_fold])),
+            "accuracy_std": float(np.std([f["accuracy"] for f in per_fold])),
+            "fit_seconds": float(np.mean([f["fit_seconds"] for f in per_fold])),
+            "p50_ms": p50_ms,
+            "p99_ms": p99_ms,
+        })
+        results[-1]["within_budget"] = inference_budget_ms is None or results[-1]["p99_ms"] <= inference_budget_ms
+
+    eligible = [r for r in results if r["within_budget"]] or results
+    # Mayor precisión; a igualdad, menor latencia
+    best = max(eligible, key=lambda r: (r["accuracy"], -r["p99_ms"]))
+    return best["params"], results
+
+def train_model(search: bool = False, n_jobs: int = -1):
+    """
+    Entrena el modelo y lo publica como una nueva versión en MODELS_DIR.
+    Con search=True ejecuta antes una búsqueda de hiperparámetros con validación cruzada.
+    Devuelve la versión publicada o False si no hay datos.
+    Pensado para ejecutarse fuera del proceso web (ver app.training_jobs).
+    """
+    started = time.time()
+    # Corte de datos: lo que llegue o se etiquete a partir de aquí es "nuevo" para el siguiente incremental
+    data_cutoff = datetime.utcnow()
     with Session(engine) as db:
         df = load_data(db)
     
@@ -73,58 +530,220 @@ def train_model():
 
     X = df.drop(columns=['target'])
     y = df['target']
+
+    params = {"n_estimators": DEFAULT_N_ESTIMATORS}
+    search_results = None
+    if search:
+        best_params, search_results = search_hyperparameters(X.values, y.values.astype(int), n_jobs=n_jobs)
+        if best_params:
+            params = best_params
+            print(f"Hyperparameter search selected {params}")
     
-    clf = RandomForestClassifier(n_estimators=100, random_state=42)
+    clf = RandomForestClassifier(random_state=42, **params)
     clf.fit(X, y)
-    
-    joblib.dump(clf, MODEL_PATH)
-    print(f"Model trained on {len(df)} samples.")
-    return True
 
-def predict_risk(answers_dict, teacher_sentiment=0.0):
+    trained_at = datetime.utcnow()
+    metadata = {
+        "version": trained_at.strftime("%Y%m%d%H%M%S") + "-" + os.urandom(3).hex(),
+        "trained_at": trained_at.isoformat(),
+        "data_cutoff": data_cutoff.isoformat(),
+        "n_samples": int(len(df)),
+        "class_balance": {str(k): int(v) for k, v in y.value_counts().sort_index().items()},
+        "n_estimators": clf.n_estimators,
+        "params": params,
+        "training_seconds": round(time.time() - started, 3)
+    }
+    if search_results is not None:
+        metadata["search"] = search_results
+    version = publish_model(clf, metadata)
+    print(f"Model {version} trained on {len(df)} samples.")
+    return version
+
+# --- Reentrenamiento incremental (warm start) ---
+INCREMENTAL_TREES = 20   # Árboles nuevos por reentrenamiento incremental
+MAX_FOREST_TREES = 200   # Tope: se retiran los árboles más antiguos
+REPLAY_RATIO = 1.0       # Filas antiguas muestreadas por cada fila nueva
+REPLAY_MIN = 200
+REPLAY_MAX = 5000
+
+def train_incremental(n_new_trees: int = INCREMENTAL_TREES, max_trees: int = MAX_FOREST_TREES):
     """
-    Returns (probability, explanation_text)
+    Hace crecer el bosque publicado con warm_start en lugar de reconstruirlo.
+    Los árboles nuevos se ajustan con las encuestas enviadas o etiquetadas desde el último
+    entrenamiento más una muestra (replay) de datos antiguos, y se retiran los árboles
+    más antiguos por encima de max_trees. El coste es proporcional a los datos nuevos.
+    Si no hay modelo versionado previo hace un train_model completo.
+    Devuelve la versión publicada o False si no hay datos nuevos.
     """
-    try:
-        clf = joblib.load(MODEL_PATH)
-    except:
-        return 0.0, "Model not trained yet."
-    
-    # Prepare features
-    features = {}
+    started = time.time()
+    parent_version = read_current_version()
+    parent_meta = read_model_metadata(parent_version) if parent_version else None
+    if not parent_meta or not parent_meta.get("trained_at"):
+        print("No versioned model to grow, running full training.")
+        return train_model()
+
+    clf = joblib.load(os.path.join(MODELS_DIR, parent_version, MODEL_FILENAME))
+    # Desde el inicio de la extracción del padre (no desde el fin del fit): lo enviado o etiquetado
+    # mientras entrenaba no lo vio. Los modelos anteriores a data_cutoff usan trained_at.
+    since = datetime.fromisoformat(parent_meta.get("data_cutoff") or parent_meta["trained_at"])
+    data_cutoff = datetime.utcnow()
+    # Sin NULLs en la condición: ~is_new debe incluir las encuestas nunca etiquetadas
+    is_new = or_(
+        and_(SurveyResponse.date_submitted > since, SurveyResponse.date_submitted <= data_cutoff),
+        and_(SurveyResponse.expert_label_at.isnot(None),
+             SurveyResponse.expert_label_at > since, SurveyResponse.expert_label_at <= data_cutoff)
+    )
+    # Replay: solo datos anteriores al corte (lo posterior será "nuevo" en el siguiente incremental)
+    is_replay = and_(~is_new, SurveyResponse.date_submitted <= data_cutoff)
+
+    with Session(engine) as db:
+        new_df = load_data(db, where=is_new)
+        if new_df.empty:
+            print("No new surveys or labels since last training.")
+            return False
+        replay_size = int(min(max(len(new_df) * REPLAY_RATIO, REPLAY_MIN), REPLAY_MAX))
+        replay_df = load_data(db, where=is_replay, sample=replay_size)
+
+    df = pd.concat([new_df, replay_df], ignore_index=True)
+    X = df.drop(columns=['target'])
+    y = df['target']
+
+    # warm_start exige las mismas clases que el bosque existente
+    if set(np.unique(y)) != set(clf.classes_):
+        print("Incremental batch does not cover all classes, running full training.")
+        return train_model()
+
+    # Retirar los árboles más antiguos para dejar hueco a los nuevos
+    keep = max(max_trees - n_new_trees, 0)
+    retired = max(len(clf.estimators_) - keep, 0)
+    if retired:
+        clf.estimators_ = clf.estimators_[retired:]
+
+    clf.set_params(warm_start=True, n_estimators=len(clf.estimators_) + n_new_trees)
+    clf.fit(X, y)
+    clf.set_params(warm_start=False)
+
+    trained_at = datetime.utcnow()
+    metadata = {
+        "version": trained_at.strftime("%Y%m%d%H%M%S") + "-" + os.urandom(3).hex(),
+        "trained_at": trained_at.isoformat(),
+        "data_cutoff": data_cutoff.isoformat(),
+        "mode": "incremental",
+        "parent_version": parent_version,
+        "n_samples": int(len(df)),
+        "n_new_samples": int(len(new_df)),
+        "n_replay_samples": int(len(replay_df)),
+        "class_balance": {str(k): int(v) for k, v in y.value_counts().sort_index().items()},
+        "n_estimators": clf.n_estimators,
+        "trees_added": n_new_trees,
+        "trees_retired": retired,
+        "params": parent_meta.get("params", {"n_estimators": parent_meta.get("n_estimators")}),
+        "training_seconds": round(time.time() - started, 3)
+    }
+    version = publish_model(clf, metadata)
+    print(f"Model {version} grown from {parent_version} with {len(new_df)} new + {len(replay_df)} replay samples.")
+    return version
+
+def _fill_feature_row(X, row, answers):
+    """Escribe los items p_item_1..13 de un raw_answers decodificado en la fila indicada."""
     for i in range(1, 14):
-        features[f'p_item_{i}'] = [int(answers_dict.get(f'p_item_{i}', 0))]
-        
-    # Add new feature
-    features['teacher_sentiment'] = [teacher_sentiment]
-    
-    X_new = pd.DataFrame(features)
-    
-    # Predict Proba Robustness
-    if hasattr(clf, "classes_") and len(clf.classes_) > 1:
-        prob = clf.predict_proba(X_new)[0][1] # Probability of Class 1
-    else:
-        # If model only knows one class
-        if hasattr(clf, "classes_") and clf.classes_[0] == 1:
-            prob = 1.0
-        else:
-            prob = 0.0
+        X[row, i - 1] = int(answers.get(f'p_item_{i}', 0) or 0)
+
+def build_feature_matrix(answers_list, teacher_sentiments=None):
+    """
+    Construye la matriz de features (n_surveys x 14) a partir de los raw_answers ya decodificados.
+    teacher_sentiments puede ser un escalar o una secuencia alineada con answers_list.
+    """
+    X = np.zeros((len(answers_list), len(FEATURE_COLUMNS)), dtype=np.float64)
+    for row, answers in enumerate(answers_list):
+        _fill_feature_row(X, row, answers)
+    if teacher_sentiments is not None:
+        X[:, SENTIMENT_COL] = teacher_sentiments
+    return X
+
+def _positive_proba(clf, X):
+    """Probabilidad de la clase 1 para cada fila de X (robusto a modelos con una sola clase)."""
+    classes = list(getattr(clf, "classes_", []))
+    if len(classes) > 1:
+        X_frame = pd.DataFrame(X, columns=FEATURE_COLUMNS, copy=False)
+        return clf.predict_proba(X_frame)[:, classes.index(1)]
+    if classes and classes[0] == 1:
+        return np.ones(len(X))
+    return np.zeros(len(X))
+
+def apply_safety_nets(X, probs):
+    """
+    Reglas de Oro vectorizadas:
+    Item 2 (Heridas) >= 3 -> 1.0, si no Item 5 (Coacción) >= 3 -> al menos 0.8
+    """
+    physical = X[:, ITEM_2_COL] >= 3
+    threats = ~physical & (X[:, ITEM_5_COL] >= 3)
+    probs = np.where(physical, 1.0, probs)
+    probs = np.where(threats, np.maximum(probs, 0.8), probs)
+    return probs
+
+def predict_risk_batch(answers_list, teacher_sentiments=0.0):
+    """
+    Puntúa muchas encuestas con una única llamada a predict_proba.
+    Devuelve un array de probabilidades (con las Reglas de Oro aplicadas),
+    o None si todavía no hay modelo entrenado. No calcula explicaciones SHAP.
+    """
+    loaded = model_registry.get()
+    if loaded is None:
+        return None
+    if not answers_list:
+        return np.zeros(0)
+
+    X = build_feature_matrix(answers_list, teacher_sentiments)
+    return apply_safety_nets(X, loaded.positive_proba(X))
+
+def predict_risk_proba(answers_dict, teacher_sentiment=0.0):
+    """
+    Probabilidad (con Reglas de Oro) de una sola encuesta, sin SHAP.
+    None si todavía no hay modelo entrenado.
+    """
+    loaded = model_registry.get()
+    if loaded is None:
+        return None
+    X = build_feature_matrix([answers_dict], teacher_sentiment)
+    return float(apply_safety_nets(X, loaded.positive_proba(X))[0])
+
+# Cache de explicaciones SHAP: (survey_id, model_version) -> texto
+EXPLANATION_CACHE_SIZE = 2048
+_explanation_cache = OrderedDict()
+_explanation_lock = threading.Lock()
+
+def explain_risk(answers_dict, teacher_sentiment=0.0, survey_id=None):
+    """
+    Returns (explanation_text, model_version).
+    Si se indica survey_id, el resultado se guarda en cache por (survey_id, versión del modelo)
+    y las siguientes llamadas no vuelven a ejecutar SHAP.
+    """
+    loaded = model_registry.get()
+    if loaded is None:
+        return "Model not trained yet.", None
+
+    cache_key = (survey_id, loaded.version) if survey_id is not None else None
+    if cache_key is not None:
+        with _explanation_lock:
+            if cache_key in _explanation_cache:
+                _explanation_cache.move_to_end(cache_key)
+                return _explanation_cache[cache_key], loaded.version
+
+    X = build_feature_matrix([answers_dict], teacher_sentiment)
+    X_new = pd.DataFrame(X, columns=FEATURE_COLUMNS)
     
     # SAFETY NETS (Reglas de Oro)
     # Item 2: Heridas o moratones (Physical violence) -> Force Critical
     # Item 5: Coacción o amenazas (Threats) -> Force High
-    
     explanation_prefix = ""
-    if features['p_item_2'][0] >= 3: # 3 or 4 means Often/Always
-        prob = 1.0
+    if X[0, ITEM_2_COL] >= 3: # 3 or 4 means Often/Always
         explanation_prefix = "[SAFETY NET] Physical violence detected (Item 2). Risk set to Critical. "
-    elif features['p_item_5'][0] >= 3:
-        if prob < 0.8: prob = 0.8 # Ensure at least High risk
+    elif X[0, ITEM_5_COL] >= 3:
         explanation_prefix = "[SAFETY NET] Severe threats detected (Item 5). Risk elevated. "
     
     # Explainability (SHAP)
-    explainer = shap.TreeExplainer(clf)
-    shap_values = explainer.shap_values(X_new)
+    shap_values = loaded.explainer.shap_values(X_new)
     
     # SHAP Robustness: Handle different return shapes
     # Binary classification: [array_class_0, array_class_1] or just array_class_1 depending on version
@@ -138,6 +757,9 @@ def predict_risk(answers_dict, teacher_sentiment=0.0):
          # Sometimes it returns a single array if binary
          if hasattr(shap_values, 'shape') and len(shap_values.shape) == 2:
              vals = shap_values[0] # (1, features)
+         elif hasattr(shap_values, 'shape') and len(shap_values.shape) == 3:
+             # Newer shap versions: (1, features, classes)
+             vals = shap_values[0, :, -1]
          else:
              # Fallback
              vals = [0] * len(X_new.columns)
@@ -153,5 +775,21 @@ def predict_risk(answers_dict, teacher_sentiment=0.0):
             top_reasons.append(f"{feature_names[i]} ({vals[i]:.2f})")
             
     explanation = explanation_prefix + ("Risk factors: " + ", ".join(top_reasons) if top_reasons else "Low risk factors detected.")
+
+    if cache_key is not None:
+        with _explanation_lock:
+            _explanation_cache[cache_key] = explanation
+            while len(_explanation_cache) > EXPLANATION_CACHE_SIZE:
+                _explanation_cache.popitem(last=False)
     
+    return explanation, loaded.version
+
+def predict_risk(answers_dict, teacher_sentiment=0.0):
+    """
+    Returns (probability, explanation_text)
+    """
+    prob = predict_risk_proba(answers_dict, teacher_sentiment)
+    if prob is None:
+        return 0.0, "Model not trained yet."
+    explanation, _ = explain_risk(answers_dict, teacher_sentiment)
     return prob, explanation
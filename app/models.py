@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text, Boolean, Enum, Float
+from sqlalchemy import Column, Integer, SmallInteger, String, ForeignKey, DateTime, Text, Boolean, Enum, Float
 from sqlalchemy.orm import relationship, DeclarativeBase
 from datetime import datetime
 import enum
@@ -93,7 +93,7 @@ class SurveyResponse(Base):
     
     # Quién rellenó la encuesta
     submitted_by_id = Column(Integer, ForeignKey("users.id"))
-    student_id = Column(Integer, ForeignKey("students.id"))
+    student_id = Column(Integer, ForeignKey("students.id"), index=True)
     
     # Datos crudos (JSON) y Análisis
     raw_answers = Column(Text) # JSON con las respuestas del formulario
@@ -106,9 +106,33 @@ class SurveyResponse(Base):
     # Feedback del Experto (Human-in-the-Loop)
     # Valores: "false_positive", "false_negative", "real_case", null
     expert_label = Column(String, nullable=True)
+    expert_label_at = Column(DateTime, nullable=True) # Cuándo se etiquetó (reentrenamiento incremental)
 
     student = relationship("Student", back_populates="surveys")
 
+class SurveyFeatures(Base):
+    """
+    Feature store: vector numérico de cada encuesta tal y como se calculó al enviarla.
+    Evita re-parsear raw_answers y recalcular el sentimiento al entrenar.
+    """
+    __tablename__ = "survey_features"
+    survey_id = Column(Integer, ForeignKey("survey_responses.id"), primary_key=True)
+    p_item_1 = Column(SmallInteger, default=0)
+    p_item_2 = Column(SmallInteger, default=0)
+    p_item_3 = Column(SmallInteger, default=0)
+    p_item_4 = Column(SmallInteger, default=0)
+    p_item_5 = Column(SmallInteger, default=0)
+    p_item_6 = Column(SmallInteger, default=0)
+    p_item_7 = Column(SmallInteger, default=0)
+    p_item_8 = Column(SmallInteger, default=0)
+    p_item_9 = Column(SmallInteger, default=0)
+    p_item_10 = Column(SmallInteger, default=0)
+    p_item_11 = Column(SmallInteger, default=0)
+    p_item_12 = Column(SmallInteger, default=0)
+    p_item_13 = Column(SmallInteger, default=0)
+    teacher_sentiment = Column(Float, default=0.0) # Sentimiento del profesor usado en ese momento
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
     id = Column(Integer, primary_key=True, index=True)
@@ -129,6 +153,101 @@ class ClassObservation(Base):
     content = Column(Text)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
+class TeacherAtmosphere(Base):
+    """
+    Ventana móvil del ambiente de clase de cada profesor (últimas observaciones puntuadas).
+    Se actualiza al registrar una observación para leer el sentimiento con una consulta por PK.
+    Se puede reconstruir desde class_observations con scripts/rebuild_teacher_atmosphere.py
+    """
+    __tablename__ = "teacher_atmosphere"
+    teacher_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    score = Column(Float, default=0.0) # Media de la ventana al actualizarla
+    window = Column(Text, default="[]") # JSON: [[timestamp ISO, score], ...] ordenado por fecha
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class ScoreHistogram(Base):
+    """
+    Histograma de puntuaciones heurísticas por colegio y tipo de cuestionario (parent / teacher).
+    Cada alumno cuenta una vez (su última encuesta). Se usa para simular cambios de umbrales.
+    """
+    __tablename__ = "score_histograms"
+    school_id = Column(Integer, ForeignKey("schools.id"), primary_key=True)
+    questionnaire = Column(String, primary_key=True) # "parent" | "teacher"
+    counts = Column(Text) # JSON: lista de MAX_SCORE + 1 contadores (índice = puntuación)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class IdempotencyKey(Base):
+    """
+    Claves de idempotencia de los envíos de encuestas (cabecera Idempotency-Key).
+    Un reintento con la misma clave devuelve la respuesta guardada sin volver a procesar.
+    """
+    __tablename__ = "idempotency_keys"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    key = Column(String, primary_key=True)
+    request_hash = Column(String) # sha256 de la petición original (detecta reutilización con otro contenido)
+    response = Column(Text) # JSON de la respuesta (RiskAnalysisResult)
+    survey_id = Column(Integer, ForeignKey("survey_responses.id"), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
+
+class IncidentPlan(Base):
+    """
+    Caché de planes de acción del agente de incidentes. El plan solo depende del nivel,
+    los indicadores y la recomendación: se guarda con un marcador en lugar del código del alumno.
+    """
+    __tablename__ = "incident_plans"
+    key = Column(String, primary_key=True) # sha256 de (versión del prompt, nivel, indicadores ordenados, recomendación)
+    prompt_version = Column(Integer)
+    risk_level = Column(String)
+    flags = Column(Text) # JSON, ordenados
+    recommendation = Column(Text)
+    plan = Column(Text)
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
+
+class NotificationOutbox(Base):
+    """
+    Outbox de notificaciones (alertas para el tutor). Se escribe en la misma transacción
+    que la encuesta; scripts/dispatch_notifications.py las reclama por lotes, genera el
+    plan con el agente de incidentes, envía el email y las marca como enviadas.
+    """
+    __tablename__ = "notification_outbox"
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, default="incident_alert")
+    recipient = Column(String, index=True) # Email del tutor
+    student_id = Column(Integer, ForeignKey("students.id"), nullable=True)
+    survey_id = Column(Integer, ForeignKey("survey_responses.id"), nullable=True)
+    payload = Column(Text) # JSON: internal_code + RiskAnalysisResult
+    status = Column(String, default="pending", index=True) # pending, sending, sent, failed
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    available_at = Column(DateTime, index=True) # No se envía antes (ventana de agrupación del tutor o reintento)
+    claimed_by = Column(String, nullable=True)
+    claimed_at = Column(DateTime, nullable=True)
+    sent_at = Column(DateTime, nullable=True)
+
+class PendingSubmission(Base):
+    """
+    Encuesta aceptada por /surveys/api/submit_async (202) y su estado. Se escribe antes de
+    responder, así que sobrevive a un reinicio y cualquier worker puede responder a status_url.
+    Se marca como "done" en la misma transacción que guarda la encuesta.
+    """
+    __tablename__ = "pending_submissions"
+    id = Column(String, primary_key=True) # submission_id (uuid hex)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    student_id = Column(Integer, ForeignKey("students.id"))
+    payload = Column(Text) # JSON del SurveyInput
+    status = Column(String, default="queued", index=True) # queued, done, failed
+    queued_at = Column(DateTime, default=datetime.utcnow)
+    claimed_by = Column(String, nullable=True) # Proceso que la tiene en su cola
+    claimed_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    survey_id = Column(Integer, ForeignKey("survey_responses.id"), nullable=True)
+    result = Column(Text, nullable=True) # JSON del RiskAnalysisResult
+    error = Column(Text, nullable=True)
+
 class AuditLog(Base):
     __tablename__ = "audit_logs"
     id = Column(Integer, primary_key=True, index=True)
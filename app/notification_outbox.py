@@ -0,0 +1,250 @@
+import os
+import json
+import uuid
+import time
+import socket
+import threading
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from sqlalchemy import select, update, insert, func, or_, and_
+from sqlalchemy.orm import Session
+from .database import SessionLocal
+from .models import NotificationOutbox, AuditLog
+from .schemas import RiskAnalysisResult
+
+# Outbox de alertas para el tutor. La petición web solo inserta filas (en la transacción
+# de la encuesta); el envío (LLM + SMTP) lo hace un proceso aparte: scripts/dispatch_notifications.py.
+# Las alertas de un mismo tutor se agrupan: la primera sale enseguida y las que llegan durante
+# la ventana siguiente comparten available_at, de modo que el dispatcher las envía en un único resumen.
+INCIDENT_COALESCE_SECONDS = float(os.getenv("INCIDENT_COALESCE_SECONDS", "900")) # Ventana por tutor
+INCIDENT_DIGEST_MAX = 20 # Alumnos por resumen (una llamada al LLM, un email)
+OUTBOX_BATCH_SIZE = 100 # Filas reclamadas por lote
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_BACKOFF = timedelta(minutes=1) # 1, 2, 4, 8 minutos
+OUTBOX_LEASE = timedelta(minutes=10) # Filas "sending" más antiguas se consideran abandonadas (dispatcher caído)
+# Dispatcher dentro del proceso web (despliegues de un solo contenedor: Docker, Render).
+# Con scripts/dispatch_notifications.py como proceso aparte se puede desactivar con "false".
+OUTBOX_DISPATCH_IN_PROCESS = os.getenv("OUTBOX_DISPATCH_IN_PROCESS", "true").lower() != "false"
+OUTBOX_DISPATCH_INTERVAL = float(os.getenv("OUTBOX_DISPATCH_INTERVAL", "10")) # Segundos de espera sin nada que enviar
+
+def _available_at(db: Session, recipient: str, now: datetime) -> datetime:
+    """Momento de envío que agrupa la alerta con las del mismo tutor."""
+    pending = db.scalar(
+        select(func.min(NotificationOutbox.available_at))
+        .filter(NotificationOutbox.recipient == recipient, NotificationOutbox.status == "pending")
+    )
+    if pending is not None:
+        return max(pending, now)
+    last_notified = db.scalar(
+        select(func.max(func.coalesce(NotificationOutbox.sent_at, NotificationOutbox.claimed_at)))
+        .filter(NotificationOutbox.recipient == recipient, NotificationOutbox.status.in_(["sent", "sending"]))
+    )
+    window = timedelta(seconds=INCIDENT_COALESCE_SECONDS)
+    if last_notified is not None and last_notified + window > now:
+        return last_notified + window
+    return now
+
+def stage_alerts(db: Session, alerts, user_id: int):
+    """
+    Añade a la transacción en curso (sin commit) una fila del outbox y otra de auditoría por alerta.
+    alerts: [(student_id, survey_id, internal_code, analysis, teacher_email)]
+    """
+    if not alerts:
+        return
+    now = datetime.utcnow()
+    available = {}
+    rows = []
+    audit = []
+    for student_id, survey_id, internal_code, analysis, teacher_email in alerts:
+        if teacher_email not in available:
+            available[teacher_email] = _available_at(db, teacher_email, now)
+        rows.append({
+            "kind": "incident_alert",
+            "recipient": teacher_email,
+            "student_id": student_id,
+            "survey_id": survey_id,
+            "payload": json.dumps({"internal_code": internal_code, "analysis": analysis.model_dump()}, ensure_ascii=False),
+            "status": "pending",
+            "attempts": 0,
+            "created_at": now,
+            "available_at": available[teacher_email]
+        })
+        audit.append({
+            "user_id": user_id,
+            "action": "INCIDENT_ALERT_QUEUED",
+            "target_id": str(survey_id),
+            "timestamp": now,
+            "details": f"{analysis.risk_level} alert for student {internal_code} -> {teacher_email}"
+        })
+    db.execute(insert(NotificationOutbox), rows)
+    db.execute(insert(AuditLog), audit)
+
+def stage_alert(db: Session, student, survey, analysis, teacher_email: str, user_id: int):
+    """Una alerta de una encuesta ya añadida a la sesión (necesita survey.id: flush previo)."""
+    stage_alerts(db, [(student.id, survey.id, student.internal_code, analysis, teacher_email)], user_id)
+
+def claim_batch(db: Session, worker_id: str, limit: int = OUTBOX_BATCH_SIZE):
+    """
+    Reclama (y hace commit) hasta `limit` filas listas para enviar: pendientes con available_at
+    vencido o "sending" abandonadas. Un único UPDATE: dos dispatchers no reclaman la misma fila.
+    """
+    now = datetime.utcnow()
+    claim = f"{worker_id}:{uuid.uuid4().hex}"
+    ready = (
+        select(NotificationOutbox.id)
+        .filter(or_(
+            and_(NotificationOutbox.status == "pending", NotificationOutbox.available_at <= now),
+            and_(NotificationOutbox.status == "sending", NotificationOutbox.claimed_at < now - OUTBOX_LEASE)
+        ))
+        .order_by(NotificationOutbox.available_at, NotificationOutbox.id)
+        .limit(limit)
+    )
+    db.execute(
+        update(NotificationOutbox)
+        .where(NotificationOutbox.id.in_(ready.scalar_subquery()))
+        .values(status="sending", claimed_by=claim, claimed_at=now, attempts=NotificationOutbox.attempts + 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return db.query(NotificationOutbox).filter(NotificationOutbox.claimed_by == claim)\
+        .order_by(NotificationOutbox.id).all()
+
+def _mark_sent(rows):
+    now = datetime.utcnow()
+    for row in rows:
+        row.status = "sent"
+        row.sent_at = now
+        row.last_error = None
+
+def _mark_failed(rows, error: str):
+    now = datetime.utcnow()
+    for row in rows:
+        row.last_error = error
+        if row.attempts >= OUTBOX_MAX_ATTEMPTS:
+            row.status = "failed"
+        else:
+            row.status = "pending"
+            row.available_at = now + OUTBOX_RETRY_BACKOFF * 2 ** (row.attempts - 1)
+
+def _renew_claim(db: Session, chunk, claim: str):
+    """
+    Renueva el lease de un grupo justo antes de enviarlo (y hace commit). Devuelve solo las filas
+    que siguen reclamadas por `claim`: si el lote ha tardado más que OUTBOX_LEASE, otro dispatcher
+    puede haberlas recuperado y no deben enviarse dos veces.
+    """
+    ids = [row.id for row in chunk]
+    mine = and_(NotificationOutbox.id.in_(ids), NotificationOutbox.claimed_by == claim,
+                NotificationOutbox.status == "sending")
+    db.execute(
+        update(NotificationOutbox).where(mine).values(claimed_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    kept = set(db.scalars(select(NotificationOutbox.id).where(mine)))
+    return [row for row in chunk if row.id in kept]
+
+_SEVERITY = {"critical": 2, "high": 1} # Solo high/critical llegan al outbox (alert_recipient)
+
+def _digest_alerts(rows):
+    """
+    [(student, risk_analysis)] con una alerta por alumno: si tiene varias encuestas en la
+    ventana, la más grave y, a igual gravedad, la más reciente.
+    """
+    best = {}
+    for row in rows:
+        payload = json.loads(row.payload)
+        analysis = RiskAnalysisResult.model_validate(payload["analysis"])
+        rank = (_SEVERITY.get(analysis.risk_level, 0), row.created_at or datetime.min, row.id)
+        key = row.student_id if row.student_id is not None else payload["internal_code"]
+        if key not in best or rank > best[key][0]:
+            best[key] = (rank, SimpleNamespace(internal_code=payload["internal_code"]), analysis)
+    return [(student, analysis) for _, student, analysis in best.values()]
+
+def dispatch_rows(db: Session, rows) -> dict:
+    """
+    Un resumen por tutor (y bloque de INCIDENT_DIGEST_MAX alumnos); commit tras cada email.
+    Todas las filas de un alumno van en el mismo resumen y se marcan juntas.
+    """
+    from .agents.incident_responder import incident_responder
+    stats = {"sent": 0, "retry": 0, "failed": 0, "reclaimed": 0}
+    if not rows:
+        return stats
+    claim = rows[0].claimed_by # claim_batch: un mismo token para todo el lote
+    groups = {}
+    for row in rows:
+        students = groups.setdefault(row.recipient, {})
+        students.setdefault(row.student_id if row.student_id is not None else ("row", row.id), []).append(row)
+
+    for recipient, students in groups.items():
+        student_rows = list(students.values())
+        for start in range(0, len(student_rows), INCIDENT_DIGEST_MAX):
+            chunk = [row for rows_of_student in student_rows[start:start + INCIDENT_DIGEST_MAX] for row in rows_of_student]
+            owned = _renew_claim(db, chunk, claim)
+            if len(owned) < len(chunk):
+                stats["reclaimed"] += len(chunk) - len(owned)
+                print(f"⚠️ [OUTBOX] {len(chunk) - len(owned)} alert(s) for {recipient} reclaimed by another dispatcher, skipping")
+            chunk = owned
+            if not chunk:
+                continue
+            try:
+                alerts = _digest_alerts(chunk)
+                content = incident_responder.compose(alerts)
+                if not incident_responder.deliver(recipient, content):
+                    raise RuntimeError("SMTP delivery failed")
+                _mark_sent(chunk)
+                stats["sent"] += len(chunk)
+                print(f"📨 [OUTBOX] {len(chunk)} alert(s) for {len(alerts)} student(s) delivered to {recipient}")
+            except Exception as e:
+                print(f"❌ [OUTBOX] Delivery to {recipient} failed: {e}")
+                _mark_failed(chunk, str(e))
+                for row in chunk:
+                    stats["failed" if row.status == "failed" else "retry"] += 1
+            db.commit()
+    return stats
+
+def outbox_counts(db: Session) -> dict:
+    """Filas por estado (para el dispatcher y diagnóstico)."""
+    return dict(db.query(NotificationOutbox.status, func.count(NotificationOutbox.id)).group_by(NotificationOutbox.status).all())
+
+def dispatch_pending(worker_id: str, batch_size: int = OUTBOX_BATCH_SIZE):
+    """Un ciclo del dispatcher: reclama un lote y lo envía. Devuelve (filas reclamadas, stats)."""
+    db = SessionLocal()
+    try:
+        rows = claim_batch(db, worker_id, batch_size)
+        if not rows:
+            return 0, None
+        return len(rows), dispatch_rows(db, rows)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+_dispatcher_thread = None
+_dispatcher_lock = threading.Lock()
+
+def _dispatch_loop(interval: float):
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-web"
+    print(f"Notification dispatcher {worker_id} started in-process (poll every {interval}s)")
+    while True:
+        try:
+            claimed, stats = dispatch_pending(worker_id)
+            if claimed:
+                print(f"📨 [OUTBOX] Dispatched {claimed} notifications: {stats}")
+        except Exception as e:
+            print(f"❌ [OUTBOX] Dispatcher error: {e}")
+            claimed = 0
+        if not claimed:
+            time.sleep(interval)
+
+def start_background_dispatcher(interval: float = OUTBOX_DISPATCH_INTERVAL):
+    """
+    Arranca (una vez por proceso) el hilo que vacía el outbox. Puede convivir con otros workers
+    y con scripts/dispatch_notifications.py: claim_batch reparte cada fila a un solo dispatcher.
+    """
+    global _dispatcher_thread
+    with _dispatcher_lock:
+        if _dispatcher_thread is None or not _dispatcher_thread.is_alive():
+            _dispatcher_thread = threading.Thread(target=_dispatch_loop, args=(interval,),
+                                                  name="notification-dispatcher", daemon=True)
+            _dispatcher_thread.start()
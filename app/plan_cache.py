@@ -0,0 +1,44 @@
+import json
+import hashlib
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+from .models import IncidentPlan
+
+# Caché persistente de planes del agente de incidentes (una llamada al LLM por patrón de alerta).
+# Clave: (versión del prompt, nivel, indicadores ordenados, recomendación). Al cambiar el prompt
+# se sube la versión y las entradas antiguas dejan de coincidir (y caducan por TTL).
+PLAN_CACHE_TTL = timedelta(days=30)
+STUDENT_PLACEHOLDER = "<<STUDENT_CODE>>" # Se sustituye por el código del alumno al leer el plan
+
+def normalize_alert(risk_level, flags, recommendation) -> tuple:
+    """(nivel, indicadores ordenados y sin duplicados, recomendación) normalizados."""
+    level = str(getattr(risk_level, "value", risk_level) or "").strip().lower()
+    return level, sorted({flag.strip() for flag in flags or [] if flag and flag.strip()}), (recommendation or "").strip()
+
+def plan_key(prompt_version: int, risk_level: str, flags: list, recommendation: str) -> str:
+    payload = json.dumps([prompt_version, risk_level, flags, recommendation], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def find_plan(db: Session, key: str):
+    """Plan vigente (con el marcador) o None. Cuenta el acierto (sin commit)."""
+    record = db.get(IncidentPlan, key)
+    if record is None or record.expires_at <= datetime.utcnow():
+        return None
+    record.hits = (record.hits or 0) + 1
+    return record.plan
+
+def store_plan(db: Session, key: str, prompt_version: int, risk_level: str, flags: list, recommendation: str, plan: str):
+    """Guarda (o reemplaza) el plan sin commit y purga los caducados."""
+    now = datetime.utcnow()
+    db.query(IncidentPlan).filter(IncidentPlan.expires_at <= now).delete(synchronize_session=False)
+    db.merge(IncidentPlan(
+        key=key,
+        prompt_version=prompt_version,
+        risk_level=risk_level,
+        flags=json.dumps(flags, ensure_ascii=False),
+        recommendation=recommendation,
+        plan=plan,
+        hits=0,
+        created_at=now,
+        expires_at=now + PLAN_CACHE_TTL
+    ))
@@ -53,6 +53,15 @@ def ask_expert(
     if current_user.role in [UserRole.TEACHER, UserRole.SCHOOL_ADMIN, UserRole.SUPER_ADMIN]:
         rag_role = "teachers"
 
+    # 1b. Índice del rol aún cargándose en segundo plano: respuesta clara en lugar de bloquear
+    if rag_system.is_warming_up(rag_role):
+        rag_system.start_background() # Por si la app no se arrancó con el hook de inicio
+        raise HTTPException(
+            status_code=503,
+            detail="El asistente se está iniciando (cargando la base de conocimiento). Inténtalo de nuevo en unos segundos.",
+            headers={"Retry-After": "10"}
+        )
+
     # 2. Recuperar Historial (Últimos 5 mensajes)
     last_messages = db.query(ChatMessage).filter(
         ChatMessage.user_id == current_user.id
@@ -92,6 +101,7 @@ def check_rag_status(current_user: User = Depends(get_current_user)):
          raise HTTPException(status_code=403, detail="Requiere privilegios de administración")
 
     import os
+    rag_system.start_background()
     
     api_key = os.environ.get("OPENAI_API_KEY")
     masked_key = f"{api_key[:5]}...{api_key[-4:]}" if api_key else "MISSING"
@@ -117,6 +127,7 @@ def check_rag_status(current_user: User = Depends(get_current_user)):
             "parents": "ACTIVE" if rag_system.chains.get("parents") else "INACTIVE",
             "teachers": "ACTIVE" if rag_system.chains.get("teachers") else "INACTIVE"
         },
+        "index_state": rag_system.readiness(),
         "file_system_check": docs_status,
         "current_working_directory": os.getcwd()
     }
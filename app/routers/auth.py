@@ -10,6 +10,9 @@ from ..security import verify_password, create_access_token, ACCESS_TOKEN_EXPIRE
 from ..limiter import limiter
 import os
 
+# URL pública de la aplicación (enlaces en los correos)
+APP_BASE_URL = os.getenv("APP_BASE_URL", "http://localhost:8000").rstrip("/")
+
 router = APIRouter(prefix="/auth", tags=["auth"])
 templates = Jinja2Templates(directory="app/templates")
 
@@ -222,8 +225,18 @@ async def forgot_password_action(email: str = Form(...), db: Session = Depends(g
         print(f"Asunto: Recuperación de Contraseña")
         print(f"Hola {user.full_name},")
         print(f"Tu clave de recuperación es: {recovery_token}")
-        print(f"Introduce esta clave en: http://localhost:8000/auth/reset-password")
+        print(f"Introduce esta clave en: {APP_BASE_URL}/auth/reset-password")
         print(f"==========================================")
+
+        # Envío real sin bloquear la petición (si hay credenciales SMTP configuradas)
+        from html import escape
+        from ..utils.email import enqueue_email
+        reset_url = escape(f"{APP_BASE_URL}/auth/reset-password")
+        enqueue_email(email, "Recuperación de Contraseña", f"""
+        <p>Hola {escape(user.full_name or "")},</p>
+        <p>Tu clave de recuperación es: <strong>{recovery_token}</strong></p>
+        <p>Introduce esta clave en: <a href="{reset_url}">{reset_url}</a></p>
+        """)
     
     # Redirigir a pantalla de "Introduce tu código" (Reset Password)
     # Para mejorar UX, redirigimos directos al formulario de reset
@@ -45,6 +45,33 @@ def get_latest_risks_bulk(db: Session, student_ids: list[int]) -> list[tuple[int
     
     return results
 
+def get_ml_probabilities_bulk(db: Session, surveys: list[SurveyResponse]) -> dict[int, float]:
+    """
+    Returns {survey_id: ML probability (%)} for the given surveys using a single
+    batched model call on the stored feature vectors (same features as training).
+    Empty dict if the model is not trained yet.
+    """
+    if not surveys:
+        return {}
+
+    from app.ml_engine import predict_risk_batch
+    from app.feature_store import survey_feature_vectors
+
+    vectors = survey_feature_vectors(db, surveys)
+    scored = [s.id for s in surveys if s.id in vectors]
+    answers_list = [vectors[sid][0] for sid in scored]
+    sentiments = [vectors[sid][1] for sid in scored]
+
+    try:
+        probs = predict_risk_batch(answers_list, sentiments)
+    except Exception as e:
+        print(f"ML Batch Error: {e}")
+        return {}
+    if probs is None:
+        return {}
+
+    return {sid: round(float(p) * 100, 1) for sid, p in zip(scored, probs)}
+
 @router.get("/teacher", response_class=HTMLResponse)
 def teacher_dashboard(request: Request, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     # Verificar rol
@@ -87,6 +114,9 @@ def teacher_dashboard(request: Request, current_user: User = Depends(get_current
     healthy_count = sum(1 for s in recent_activity if s.risk_level == AlertLevel.LOW)
     healthy_percentage = int((healthy_count / total_surveys * 100)) if total_surveys > 0 else 100
 
+    # 5. Probabilidad ML por fila (una sola llamada al modelo)
+    ml_probs = get_ml_probabilities_bulk(db, recent_activity)
+
     return templates.TemplateResponse("dashboard/teacher_view.html", {
         "request": request,
         "user": current_user, 
@@ -95,7 +125,8 @@ def teacher_dashboard(request: Request, current_user: User = Depends(get_current
         "critical_count": len(critical_alerts),
         "healthy_percentage": healthy_percentage,
         "alerts": critical_alerts,
-        "activity": recent_activity
+        "activity": recent_activity,
+        "ml_probs": ml_probs
     })
 
 @router.get("/school_admin", response_class=HTMLResponse)
@@ -269,11 +300,15 @@ def classroom_detail_view(request: Request, grade_class: str, school_id: int = N
     # Sort cases by date descending
     cases.sort(key=lambda x: x.date_submitted, reverse=True)
 
+    # 4. Probabilidad ML por caso (una sola llamada al modelo)
+    ml_probs = get_ml_probabilities_bulk(db, cases)
+
     return templates.TemplateResponse("dashboard/classroom_detail.html", {
         "request": request,
         "user": current_user,
         "grade_class": grade_class,
         "cases": cases,
+        "ml_probs": ml_probs,
         # New Dashboard Data
         "total_students": total_students,
         "active_alerts_count": active_alerts_count,
@@ -281,6 +316,16 @@ def classroom_detail_view(request: Request, grade_class: str, school_id: int = N
         "teacher_name": teacher_name
     })
 
+def can_view_case(current_user: User, survey: SurveyResponse) -> bool:
+    """Checks that the survey's student belongs to the user's context."""
+    if current_user.role == UserRole.TEACHER:
+        return survey.student.teacher_id == current_user.id
+    elif current_user.role == UserRole.SCHOOL_ADMIN:
+        return survey.student.school_id == current_user.school_id
+    elif current_user.role == UserRole.SUPER_ADMIN:
+        return True
+    return False
+
 @router.get("/case/{survey_id}", response_class=HTMLResponse)
 def view_case_details(request: Request, survey_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     # Validar rol
@@ -292,31 +337,25 @@ def view_case_details(request: Request, survey_id: int, current_user: User = Dep
         raise HTTPException(status_code=404, detail="Caso no encontrado")
         
     # Validar que el alumno pertenece al contexto del usuario
-    authorized = False
-    if current_user.role == UserRole.TEACHER:
-        if survey.student.teacher_id == current_user.id:
-            authorized = True
-    elif current_user.role == UserRole.SCHOOL_ADMIN:
-        if survey.student.school_id == current_user.school_id:
-            authorized = True
-    elif current_user.role == UserRole.SUPER_ADMIN:
-        authorized = True
-            
-    if not authorized:
+    if not can_view_case(current_user, survey):
          return templates.TemplateResponse("error.html", {"request": request, "error": "No tienes permiso para ver este caso."})
     
-    # ML Prediction
+    # ML Prediction (solo probabilidad; la explicación SHAP se pide aparte vía /explanation)
     ml_prob = 0.0
     ml_analysis = "No analysis available"
+    ml_version = None
     try:
-        import json
-        from app.ml_engine import predict_risk, MODEL_PATH
-        import os
-        
-        if os.path.exists(MODEL_PATH) and survey.raw_answers:
-             answers = json.loads(survey.raw_answers)
-             ml_prob, ml_analysis = predict_risk(answers)
-             ml_prob = round(ml_prob * 100, 1)
+        from app.ml_engine import predict_risk_proba, get_model_version
+        from app.feature_store import survey_feature_vectors
+
+        vector = survey_feature_vectors(db, [survey]).get(survey.id)
+        if vector:
+             answers, teacher_sentiment = vector
+             prob = predict_risk_proba(answers, teacher_sentiment)
+             if prob is not None:
+                 ml_prob = round(prob * 100, 1)
+                 ml_analysis = None
+                 ml_version = get_model_version()
     except Exception as e:
         print(f"ML Error: {e}")
         ml_analysis = f"Error generating analysis: {e}"
@@ -340,9 +379,42 @@ def view_case_details(request: Request, survey_id: int, current_user: User = Dep
         "user": current_user,
         "survey": survey,
         "ml_prob": ml_prob,
-        "ml_analysis": ml_analysis
+        "ml_analysis": ml_analysis,
+        "ml_version": ml_version
     })
 
+@router.get("/case/{survey_id}/explanation")
+def get_case_explanation(survey_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """
+    Explicación SHAP bajo demanda para un caso.
+    Se calcula la primera vez y se sirve desde cache por (survey_id, versión del modelo).
+    """
+    if current_user.role not in [UserRole.TEACHER, UserRole.SCHOOL_ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="No autorizado")
+
+    survey = db.query(SurveyResponse).filter(SurveyResponse.id == survey_id).first()
+    if not survey:
+        raise HTTPException(status_code=404, detail="Caso no encontrado")
+
+    if not can_view_case(current_user, survey):
+        raise HTTPException(status_code=403, detail="No tienes permiso para ver este caso.")
+
+    from app.feature_store import survey_feature_vectors
+    vector = survey_feature_vectors(db, [survey]).get(survey.id)
+    if not vector:
+        return JSONResponse(content={"explanation": "No analysis available", "model_version": None})
+
+    try:
+        from app.ml_engine import explain_risk
+
+        answers, teacher_sentiment = vector
+        explanation, version = explain_risk(answers, teacher_sentiment, survey_id=survey.id)
+    except Exception as e:
+        print(f"ML Explanation Error: {e}")
+        explanation, version = f"Error generating analysis: {e}", None
+
+    return JSONResponse(content={"explanation": explanation, "model_version": version})
+
 @router.post("/case/{survey_id}/derive")
 async def derive_case_to_expert(
     survey_id: int, 
@@ -364,17 +436,23 @@ async def derive_case_to_expert(
     # Save Classification (Feedback)
     classification = payload.get("classification")
     if classification:
+        from datetime import datetime
         survey.expert_label = classification
+        survey.expert_label_at = datetime.utcnow()
         db.commit()
 
+        # Reentrenamiento incremental fuera del proceso web (agrupando etiquetas seguidas)
+        from ..training_jobs import training_runner
+        training_runner.schedule(reason=f"expert_label:{survey.id}", mode="incremental")
+
     # SIMULATION LOGS
     print(f"\n======== [DERIVACIÓN A EXPERTO] ========")
     print(f"Enviando detalles del Caso #{survey.id}")
     print(f"Destinatario: {email}")
     print(f"Clasificación Experto: {classification if classification else 'No especificada'}")
     
-    # Send Email
-    from ..utils.email import send_email
+    # Send Email (encolado: lo envía el transporte SMTP en segundo plano)
+    from ..utils.email import enqueue_email
     
     subject = f"Derivación de Caso - Código Alumno: {survey.student.internal_code}"
     
@@ -395,19 +473,76 @@ async def derive_case_to_expert(
     <p><em>Este es un mensaje automático del sistema Anti-Bullying App.</em></p>
     """
     
-    success = send_email(email, subject, body)
+    success = enqueue_email(email, subject, body)
     
     msg = "El caso ha sido derivado correctamente."
     if success:
-        msg += " Se ha enviado un correo al experto."
-        print("✅ Correo enviado.")
+        msg += " Se enviará un correo al experto."
+        print("✅ Correo encolado.")
     else:
         msg += " (Nota: Fallo al enviar el correo, verifique credenciales)"
         print("❌ Fallo envio correo.")
 
     return JSONResponse(content={"message": msg})
 
+# --- ML TRAINING JOBS ---
+@router.post("/ml/retrain")
+def trigger_retrain(mode: str = "full", current_user: User = Depends(get_current_user)):
+    if current_user.role != UserRole.SUPER_ADMIN:
+        raise HTTPException(status_code=403, detail="Acceso denegado")
+
+    # mode: "full" (reconstrucción), "search" (búsqueda de hiperparámetros) o "incremental" (warm start)
+    from ..training_jobs import training_runner, TRAINING_MODES
+    if mode not in TRAINING_MODES:
+        raise HTTPException(status_code=400, detail=f"Modo no válido. Opciones: {', '.join(TRAINING_MODES)}")
+    job_id = training_runner.trigger(reason=f"manual:{current_user.email}", mode=mode)
+    return JSONResponse(status_code=202, content={"job_id": job_id})
+
+@router.get("/ml/status")
+def training_status(current_user: User = Depends(get_current_user)):
+    if current_user.role != UserRole.SUPER_ADMIN:
+        raise HTTPException(status_code=403, detail="Acceso denegado")
+
+    from ..training_jobs import training_runner
+    return JSONResponse(content=training_runner.status())
+
 # --- SUPER ADMIN DASHBOARD ---
+@router.get("/thresholds/simulate")
+def simulate_thresholds_view(
+    medium: int = None,
+    high: int = None,
+    critical: int = None,
+    school_id: int = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    What-if de umbrales: alumnos por nivel con los cortes actuales y con los propuestos
+    (score > corte), por tipo de cuestionario. Sale de los histogramas precalculados.
+    """
+    if current_user.role == UserRole.SCHOOL_ADMIN:
+        school_id = current_user.school_id
+    elif current_user.role != UserRole.SUPER_ADMIN:
+        raise HTTPException(status_code=403, detail="Acceso denegado")
+
+    from ..agents.predictor import heuristic_engine
+    from ..score_histograms import simulate_thresholds
+    current_cutoffs = heuristic_engine.LEVEL_CUTOFFS
+    cutoffs = (
+        current_cutoffs[0] if medium is None else medium,
+        current_cutoffs[1] if high is None else high,
+        current_cutoffs[2] if critical is None else critical
+    )
+    if not cutoffs[0] <= cutoffs[1] <= cutoffs[2]:
+        raise HTTPException(status_code=400, detail="Los umbrales deben cumplir medium <= high <= critical")
+
+    return {
+        "school_id": school_id,
+        "current_thresholds": list(current_cutoffs),
+        "thresholds": list(cutoffs),
+        "questionnaires": simulate_thresholds(db, cutoffs, current_cutoffs, school_id=school_id)
+    }
+
 @router.get("/super_admin", response_class=HTMLResponse)
 def super_admin_dashboard(request: Request, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     if current_user.role != UserRole.SUPER_ADMIN:
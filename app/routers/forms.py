@@ -1,13 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, Form
-from fastapi.responses import HTMLResponse
+from fastapi import APIRouter, Depends, HTTPException, Request, Form, Header
+from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from typing import Optional
 from ..database import get_db
 from ..schemas import SurveyInput, RiskAnalysisResult
-from ..agents.predictor import heuristic_engine
-from ..models import SurveyResponse, AlertLevel, User, Student
+from ..survey_ingest import stage_survey, alert_recipient
+from ..idempotency import find_key, remember_key, request_fingerprint, IDEMPOTENCY_KEY_MAX_LENGTH
+from ..models import User, Student
 from ..security import get_current_user
 import json
+from datetime import datetime
 
 router = APIRouter(prefix="/surveys", tags=["surveys"])
 templates = Jinja2Templates(directory="app/templates")
@@ -19,70 +23,161 @@ def get_parent_survey(request: Request, current_user: User = Depends(get_current
         "user": current_user
     })
 
-from fastapi import BackgroundTasks
-from ..agents.incident_responder import incident_responder
+from ..notification_outbox import stage_alert
+
+def _stored_submission(db: Session, user_id: int, key: str, fingerprint: str):
+    """RiskAnalysisResult guardado para la clave, o None. 422 si la clave se usó con otra encuesta."""
+    record = find_key(db, user_id, key)
+    if record is None:
+        return None
+    if record.request_hash != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key already used with a different request")
+    return RiskAnalysisResult.model_validate_json(record.response)
 
 @router.post("/api/submit", response_model=RiskAnalysisResult)
 def submit_survey(
     survey_data: SurveyInput, 
     student_id: int,
-    background_tasks: BackgroundTasks,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     user_id = current_user.id
+    # 0. Reintento con la misma Idempotency-Key: se devuelve la respuesta guardada
+    # sin volver a analizar, guardar ni avisar al agente de incidentes
+    if idempotency_key:
+        if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise HTTPException(status_code=400, detail="Idempotency-Key too long")
+        fingerprint = request_fingerprint(str(student_id), survey_data.model_dump_json(exclude_none=True))
+        stored = _stored_submission(db, user_id, idempotency_key, fingerprint)
+        if stored:
+            return stored
+
     # 1. Verificar existencia (Básico)
     student = db.query(Student).filter(Student.id == student_id).first()
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
 
-    # 2. Calcular Sentimiento del Profesor (Contexto)
-    teacher_sentiment = 0.0
-    if student.teacher_id:
-        from ..models import ClassObservation
-        from ..utils.text_analysis import calculate_atmosphere_score
-        
-        # Últimas 5 observaciones
-        observations = db.query(ClassObservation)\
-            .filter(ClassObservation.teacher_id == student.teacher_id)\
-            .order_by(ClassObservation.timestamp.desc())\
-            .limit(5).all()
-        
-        teacher_sentiment = calculate_atmosphere_score(observations)
-
-    # 3. Análisis del Agente
-    analysis = heuristic_engine.analyze(survey_data, teacher_sentiment)
-    
-    # 3. Persistencia en BD
-    db_survey = SurveyResponse(
-        submitted_by_id=user_id,
-        student_id=student_id,
-        raw_answers=survey_data.model_dump_json(exclude_none=True),
-        calculated_risk_score=analysis.total_score,
-        risk_level=AlertLevel(analysis.risk_level), # Convertir string a Enum
-        ai_summary=analysis.recommendation
-    )
-    
-    db.add(db_survey)
-    db.commit()
+    # 2. Sentimiento del profesor + análisis del agente + persistencia en BD
+    analysis, db_survey = stage_survey(db, survey_data, student, user_id)
+    # 3. Alerta para el tutor en el outbox, en la misma transacción (la envía el dispatcher)
+    teacher_email = alert_recipient(student, analysis)
+    if teacher_email:
+        stage_alert(db, student, db_survey, analysis, teacher_email, user_id)
+    if idempotency_key:
+        remember_key(db, user_id, idempotency_key, fingerprint, analysis.model_dump_json(), db_survey.id)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Otro reintento con la misma clave se ha guardado a la vez: gana el primero
+        db.rollback()
+        stored = _stored_submission(db, user_id, idempotency_key, fingerprint) if idempotency_key else None
+        if stored:
+            return stored
+        raise
     db.refresh(db_survey)
     
-    # 4. Invocación al Agente de Respuesta (Si es necesario)
-    if analysis.risk_level in ["high", "critical"] and student.teacher_id:
-        # Recuperar email del profesor
-        teacher_email = "profesor_demo@colegio.com"
-        if student.teacher and student.teacher.email:
-             teacher_email = student.teacher.email
-             
-        background_tasks.add_task(
-            incident_responder.handle_alert, 
-            student, 
-            analysis, 
-            teacher_email
-        )
-    
     return analysis
 
+@router.post("/api/submit_async", status_code=202)
+def submit_survey_async(
+    survey_data: SurveyInput,
+    student_id: int,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Envío asíncrono: el SurveyInput ya viene validado; se guarda como pendiente (pending_submissions),
+    se encola y se responde 202. El resultado (RiskAnalysisResult) se consulta en
+    /surveys/api/submissions/{id} desde cualquier worker, también tras un reinicio.
+    """
+    import queue
+    from ..submission_queue import submission_queue
+    try:
+        submission_id = submission_queue.submit(survey_data, student_id, current_user.id)
+    except queue.Full:
+        raise HTTPException(status_code=503, detail="Submission queue is full, retry later")
+
+    return JSONResponse(status_code=202, content={
+        "submission_id": submission_id,
+        "status": "queued",
+        "status_url": f"/surveys/api/submissions/{submission_id}"
+    })
+
+class _BodyTooLarge(Exception):
+    pass
+
+async def _body_lines(request: Request, max_bytes: int):
+    """Líneas (bytes) del cuerpo según llegan, sin leerlo entero. Lanza _BodyTooLarge al pasar de max_bytes."""
+    received = 0
+    buffer = b""
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_bytes:
+            raise _BodyTooLarge()
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+@router.post("/api/submit_batch")
+async def submit_survey_batch(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Carga masiva (encuestas en papel): cuerpo JSONL, una línea por encuesta con
+    {"student_id": ..., "survey": {...}}. Devuelve el resultado de cada línea.
+    El cuerpo se procesa según llega (bloques de INGEST_CHUNK_SIZE líneas, un commit por bloque)
+    y no puede superar BATCH_UPLOAD_MAX_BYTES (413).
+    """
+    from fastapi.concurrency import run_in_threadpool
+    from ..models import UserRole
+    from ..survey_ingest import JsonlIngest, INGEST_CHUNK_SIZE, BATCH_UPLOAD_MAX_BYTES
+    if current_user.role not in [UserRole.TEACHER, UserRole.SCHOOL_ADMIN, UserRole.SUPER_ADMIN]:
+        raise HTTPException(status_code=403, detail="Acceso restringido a personal del centro.")
+
+    too_large = f"Body exceeds {BATCH_UPLOAD_MAX_BYTES} bytes; split the file into smaller batches"
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > BATCH_UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=too_large)
+
+    # Fuera de SUPER_ADMIN, solo alumnos del propio colegio
+    school_id = None if current_user.role == UserRole.SUPER_ADMIN else current_user.school_id
+    ingest = JsonlIngest(db, current_user.id, school_id)
+    pending = []
+    try:
+        async for line in _body_lines(request, BATCH_UPLOAD_MAX_BYTES):
+            pending.append(line)
+            if len(pending) >= INGEST_CHUNK_SIZE:
+                await run_in_threadpool(ingest.feed, pending)
+                pending = []
+    except _BodyTooLarge:
+        # Sin Content-Length (chunked): los bloques ya guardados se devuelven para no reenviarlos
+        stored = await run_in_threadpool(ingest.finish)
+        return JSONResponse(status_code=413, content={
+            "detail": too_large,
+            "processed_lines": ingest.line_no,
+            "created": sum(1 for r in stored if r["status"] == "created"),
+            "results": stored
+        })
+    results = await run_in_threadpool(ingest.finish, pending)
+
+    created = sum(1 for r in results if r["status"] == "created")
+    return {"total": len(results), "created": created, "failed": len(results) - created, "results": results}
+
+@router.get("/api/submissions/{submission_id}")
+def get_submission_status(submission_id: str, current_user: User = Depends(get_current_user)):
+    from ..submission_queue import submission_queue
+    status = submission_queue.status(submission_id)
+    # Solo quien envió la encuesta puede consultar su estado
+    if not status or status["user_id"] != current_user.id:
+        raise HTTPException(status_code=404, detail="Submission not found")
+    status.pop("user_id")
+    return status
+
 # --- Teacher Routes ---
 
 @router.get("/teacher/student-report", response_class=HTMLResponse)
@@ -127,12 +222,16 @@ def teacher_class_report_submit(
     db: Session = Depends(get_db)
 ):
     from ..models import ClassObservation
+    from ..feature_store import record_observation
     
     observation = ClassObservation(
         teacher_id=current_user.id,
-        content=content
+        content=content,
+        timestamp=datetime.utcnow()
     )
     db.add(observation)
+    # Ventana móvil del profesor (misma transacción que la observación)
+    record_observation(db, observation)
     db.commit()
     
     return templates.TemplateResponse("forms/class_report.html", {
@@ -0,0 +1,176 @@
+import json
+from datetime import datetime
+import numpy as np
+from sqlalchemy import select, delete, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from .models import ScoreHistogram, SurveyResponse, Student
+
+# Histogramas de puntuación heurística por colegio y tipo de cuestionario, para simular
+# otros cortes de nivel (what-if) sin recorrer las encuestas.
+# Cada alumno cuenta una vez por tipo de cuestionario: con la puntuación de su última encuesta.
+QUESTIONNAIRES = ("parent", "teacher")
+MAX_SCORE = 62 # 52 (items) + 10 (ajuste por ambiente de clase); lo que pase se acumula aquí
+
+def questionnaire_type(answers: dict) -> str:
+    """Mismo criterio que HeuristicPredictor.analyze: cuestionario de profesor si trae t_vic_insults."""
+    return "teacher" if answers.get("t_vic_insults") is not None else "parent"
+
+def _bucket(score) -> int:
+    return min(max(int(score or 0), 0), MAX_SCORE)
+
+def _empty_counts() -> list:
+    return [0] * (MAX_SCORE + 1)
+
+def record_survey_scores(db: Session, entries, before_id: int):
+    """
+    Actualiza los histogramas con encuestas recién guardadas (sin commit).
+    entries: [(student_id, school_id, questionnaire, score)] en orden de alta; before_id es el
+    id de la primera encuesta nueva. Si el alumno ya tenía una encuesta de ese tipo, su
+    puntuación anterior sale del histograma.
+    """
+    student_ids = {student_id for student_id, school_id, _, _ in entries if school_id}
+    if not student_ids:
+        return
+
+    # Última puntuación por (alumno, tipo) antes de las encuestas nuevas
+    latest = {}
+    rows = db.query(SurveyResponse.student_id, SurveyResponse.raw_answers, SurveyResponse.calculated_risk_score)\
+        .filter(SurveyResponse.student_id.in_(list(student_ids)), SurveyResponse.id < before_id)\
+        .order_by(SurveyResponse.id)
+    for student_id, raw_answers, score in rows:
+        try:
+            latest[(student_id, questionnaire_type(json.loads(raw_answers)))] = score
+        except (TypeError, ValueError):
+            continue
+
+    deltas = {}
+    for student_id, school_id, questionnaire, score in entries:
+        if not school_id:
+            continue
+        delta = deltas.setdefault((school_id, questionnaire), _empty_counts())
+        previous = latest.get((student_id, questionnaire))
+        if previous is not None:
+            delta[_bucket(previous)] -= 1
+        delta[_bucket(score)] += 1
+        latest[(student_id, questionnaire)] = score
+
+    now = datetime.utcnow()
+    # Orden fijo de filas: dos transacciones que bloquean varias no se esperan en círculo
+    for (school_id, questionnaire), delta in sorted(deltas.items()):
+        histogram = _locked_histogram(db, school_id, questionnaire)
+        counts = json.loads(histogram.counts) if histogram.counts else _empty_counts()
+        histogram.counts = json.dumps([max(count + change, 0) for count, change in zip(counts, delta)])
+        histogram.updated_at = now
+
+def _locked_histogram(db: Session, school_id: int, questionnaire: str) -> ScoreHistogram:
+    """
+    Fila del histograma bloqueada (SELECT ... FOR UPDATE) hasta el commit, creándola si no existe.
+    El JSON de counts es compartido por todo el colegio: sin el bloqueo, dos envíos simultáneos
+    leerían los mismos counts y el segundo commit pisaría el delta del primero.
+    (SQLite ignora FOR UPDATE, pero allí el bloqueo de escritura ya serializa las transacciones.)
+    """
+    query = db.query(ScoreHistogram).filter(
+        ScoreHistogram.school_id == school_id, ScoreHistogram.questionnaire == questionnaire
+    ).with_for_update().populate_existing()
+    histogram = query.one_or_none()
+    if histogram is not None:
+        return histogram
+    try:
+        # Savepoint: si otra transacción crea la fila a la vez, se bloquea la suya
+        with db.begin_nested():
+            histogram = ScoreHistogram(school_id=school_id, questionnaire=questionnaire,
+                                       counts=json.dumps(_empty_counts()))
+            db.add(histogram)
+        return histogram
+    except IntegrityError:
+        return query.one()
+
+def record_survey_score(db: Session, survey: SurveyResponse, student: Student, answers: dict):
+    """Actualiza el histograma del colegio con una encuesta recién guardada (sin commit)."""
+    record_survey_scores(
+        db,
+        [(student.id, student.school_id, questionnaire_type(answers), survey.calculated_risk_score)],
+        before_id=survey.id
+    )
+
+def rebuild_histograms(db: Session, batch_size: int = 5000) -> int:
+    """Recalcula todos los histogramas desde survey_responses (sin commit). Devuelve nº de alumnos."""
+    latest = {} # (student_id, questionnaire) -> (school_id, score)
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(SurveyResponse.id, SurveyResponse.student_id, SurveyResponse.raw_answers,
+                   SurveyResponse.calculated_risk_score, Student.school_id)
+            .join(Student, SurveyResponse.student_id == Student.id)
+            .filter(SurveyResponse.id > last_id)
+            .order_by(SurveyResponse.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        for row in rows:
+            try:
+                questionnaire = questionnaire_type(json.loads(row.raw_answers))
+            except (TypeError, ValueError):
+                continue
+            latest[(row.student_id, questionnaire)] = (row.school_id, row.calculated_risk_score)
+
+    histograms = {}
+    for (_, questionnaire), (school_id, score) in latest.items():
+        if school_id is None:
+            continue
+        counts = histograms.setdefault((school_id, questionnaire), _empty_counts())
+        counts[_bucket(score)] += 1
+
+    db.execute(delete(ScoreHistogram))
+    if histograms:
+        now = datetime.utcnow()
+        db.execute(insert(ScoreHistogram), [
+            {"school_id": school_id, "questionnaire": questionnaire, "counts": json.dumps(counts), "updated_at": now}
+            for (school_id, questionnaire), counts in histograms.items()
+        ])
+    return len(latest)
+
+def level_counts(counts: np.ndarray, cutoffs) -> dict:
+    """Alumnos por nivel con los cortes (medium, high, critical): score > corte."""
+    medium, high, critical = (min(max(int(c), -1), MAX_SCORE) for c in cutoffs)
+    # tail[i] = alumnos con score >= i
+    tail = np.concatenate([np.cumsum(counts[::-1])[::-1], [0]])
+    above = lambda cutoff: int(tail[cutoff + 1])
+    return {
+        "low": int(tail[0]) - above(medium),
+        "medium": above(medium) - above(high),
+        "high": above(high) - above(critical),
+        "critical": above(critical)
+    }
+
+def simulate_thresholds(db: Session, cutoffs, current_cutoffs, school_id: int = None) -> dict:
+    """
+    Compara los alumnos por nivel con los cortes actuales y con `cutoffs`,
+    por tipo de cuestionario, sumando los histogramas (del colegio o de todos).
+    """
+    query = db.query(ScoreHistogram)
+    if school_id is not None:
+        query = query.filter(ScoreHistogram.school_id == school_id)
+
+    totals = {questionnaire: np.zeros(MAX_SCORE + 1, dtype=np.int64) for questionnaire in QUESTIONNAIRES}
+    for histogram in query:
+        totals[histogram.questionnaire] += np.asarray(json.loads(histogram.counts), dtype=np.int64)
+
+    result = {}
+    for questionnaire, counts in totals.items():
+        current = level_counts(counts, current_cutoffs)
+        simulated = level_counts(counts, cutoffs)
+        result[questionnaire] = {
+            "students": int(counts.sum()),
+            "current": current,
+            "simulated": simulated,
+            "delta": {level: simulated[level] - current[level] for level in current},
+            "high_or_critical": {
+                "current": current["high"] + current["critical"],
+                "simulated": simulated["high"] + simulated["critical"]
+            }
+        }
+    return result
@@ -0,0 +1,258 @@
+import os
+import json
+import queue
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import update, delete, or_, and_
+from .database import SessionLocal
+from .models import Student, PendingSubmission
+from .schemas import SurveyInput
+from .survey_ingest import stage_survey, alert_recipient
+from .notification_outbox import stage_alert
+
+# Envío asíncrono de encuestas: la petición valida el SurveyInput, lo guarda en pending_submissions
+# (un INSERT pequeño), lo encola y responde 202. Un hilo worker vacía la cola y guarda las encuestas
+# en grupos con un único commit por grupo, en lugar de una transacción SQLite completa por petición.
+# El estado vive en la BD: status_url funciona desde cualquier worker y lo aceptado sobrevive a un
+# reinicio (el worker recupera las filas "queued" cuyo proceso dejó de renovarlas).
+SUBMIT_QUEUE_MAX = 10000 # Encolados como máximo; si se llena, la petición recibe 503
+SUBMIT_BATCH_MAX = 100 # Encuestas por commit
+SUBMIT_LINGER_SECONDS = 0.05 # Espera máxima para completar un grupo
+SUBMISSION_LEASE = timedelta(minutes=10) # Filas "queued" más antiguas se consideran abandonadas (proceso caído)
+SUBMISSION_RECOVERY_INTERVAL = 60.0 # Segundos sin trabajo entre recuperaciones
+SUBMISSION_RETENTION = timedelta(days=7) # Estados terminados que se conservan para status_url
+
+class SubmissionQueue:
+    """
+    Cola en memoria + hilo worker (uno por proceso), respaldada por pending_submissions.
+    Cada fila la procesa el proceso que la reclamó (claimed_by); se marca "done" en la
+    misma transacción que la encuesta, así que no se guarda dos veces.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=SUBMIT_QUEUE_MAX)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @staticmethod
+    def _owner() -> str:
+        return f"{socket.gethostname()}-{os.getpid()}"
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="survey-submissions", daemon=True)
+                self._thread.start()
+
+    def start(self):
+        """Arranca el worker (al iniciar la app) para recuperar lo pendiente sin esperar a un envío."""
+        self._ensure_worker()
+
+    def submit(self, survey_data: SurveyInput, student_id: int, user_id: int) -> str:
+        """Guarda y encola una encuesta ya validada. Lanza queue.Full si la cola está llena."""
+        if self._queue.full():
+            raise queue.Full
+        self._ensure_worker()
+        submission_id = uuid.uuid4().hex
+        now = datetime.utcnow()
+        db = SessionLocal()
+        try:
+            db.add(PendingSubmission(
+                id=submission_id,
+                user_id=user_id,
+                student_id=student_id,
+                payload=survey_data.model_dump_json(),
+                status="queued",
+                queued_at=now,
+                claimed_by=self._owner(),
+                claimed_at=now
+            ))
+            db.commit()
+        finally:
+            db.close()
+        try:
+            self._queue.put_nowait((submission_id, survey_data, student_id, user_id, now))
+        except queue.Full:
+            self._discard(submission_id)
+            raise
+        return submission_id
+
+    def status(self, submission_id: str):
+        db = SessionLocal()
+        try:
+            row = db.get(PendingSubmission, submission_id)
+            if row is None:
+                return None
+            return {
+                "id": row.id,
+                "status": row.status,
+                "student_id": row.student_id,
+                "user_id": row.user_id,
+                "queued_at": row.queued_at.isoformat() if row.queued_at else None,
+                "survey_id": row.survey_id,
+                "result": json.loads(row.result) if row.result else None,
+                "error": row.error,
+                "finished_at": row.finished_at.isoformat() if row.finished_at else None
+            }
+        finally:
+            db.close()
+
+    def _discard(self, submission_id: str):
+        db = SessionLocal()
+        try:
+            db.execute(delete(PendingSubmission).where(PendingSubmission.id == submission_id))
+            db.commit()
+        finally:
+            db.close()
+
+    def _mark_failed(self, submission_id: str, error: str):
+        db = SessionLocal()
+        try:
+            db.execute(
+                update(PendingSubmission)
+                .where(PendingSubmission.id == submission_id, PendingSubmission.status == "queued")
+                .values(status="failed", error=error, finished_at=datetime.utcnow())
+            )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"❌ [SUBMISSIONS] Could not record failure of {submission_id}: {e}")
+        finally:
+            db.close()
+
+    def _recover(self):
+        """
+        Reclama las filas "queued" abandonadas (lease vencido: proceso caído o reiniciado),
+        las vuelve a encolar y purga los estados terminados antiguos.
+        """
+        now = datetime.utcnow()
+        owner = self._owner()
+        db = SessionLocal()
+        try:
+            db.execute(
+                delete(PendingSubmission)
+                .where(PendingSubmission.status.in_(["done", "failed"]),
+                       PendingSubmission.finished_at < now - SUBMISSION_RETENTION)
+            )
+            free = SUBMIT_QUEUE_MAX - self._queue.qsize()
+            if free <= 0:
+                db.commit()
+                return
+            stale = (
+                db.query(PendingSubmission.id)
+                .filter(PendingSubmission.status == "queued",
+                        or_(PendingSubmission.claimed_at.is_(None), PendingSubmission.claimed_at < now - SUBMISSION_LEASE))
+                .order_by(PendingSubmission.queued_at)
+                .limit(free)
+            )
+            db.execute(
+                update(PendingSubmission)
+                .where(PendingSubmission.id.in_(stale.scalar_subquery()))
+                .values(claimed_by=owner, claimed_at=now)
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+            rows = db.query(PendingSubmission).filter(
+                PendingSubmission.status == "queued",
+                PendingSubmission.claimed_by == owner,
+                PendingSubmission.claimed_at == now
+            ).order_by(PendingSubmission.queued_at).all()
+            items = [(row.id, row.payload, row.student_id, row.user_id, row.queued_at) for row in rows]
+        finally:
+            db.close()
+
+        if items:
+            print(f"🔁 [SUBMISSIONS] Recovered {len(items)} pending submission(s)")
+        for submission_id, payload, student_id, user_id, queued_at in items:
+            try:
+                survey_data = SurveyInput.model_validate_json(payload)
+            except Exception as e:
+                self._mark_failed(submission_id, f"Invalid payload: {e}")
+                continue
+            try:
+                self._queue.put_nowait((submission_id, survey_data, student_id, user_id, queued_at))
+            except queue.Full:
+                break # Siguen reclamadas: se recuperan cuando venza el lease
+
+    def _run(self):
+        try:
+            self._recover()
+        except Exception as e:
+            print(f"❌ [SUBMISSIONS] Recovery failed: {e}")
+        while True:
+            try:
+                first = self._queue.get(timeout=SUBMISSION_RECOVERY_INTERVAL)
+            except queue.Empty:
+                try:
+                    self._recover()
+                except Exception as e:
+                    print(f"❌ [SUBMISSIONS] Recovery failed: {e}")
+                continue
+            batch = [first]
+            # Agrupar lo que llegue en la ventana de espera (hasta SUBMIT_BATCH_MAX)
+            deadline = time.monotonic() + SUBMIT_LINGER_SECONDS
+            while len(batch) < SUBMIT_BATCH_MAX:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._process(batch)
+            except Exception as e:
+                print(f"❌ [SUBMISSIONS] Batch failed: {e}")
+                for item in batch:
+                    self._mark_failed(item[0], str(e))
+
+    def _process(self, batch):
+        try:
+            self._persist(batch)
+        except Exception as e:
+            # Un fallo en el grupo no debe perder el resto: se reintenta una a una
+            print(f"⚠️ [SUBMISSIONS] Group commit failed ({e}), retrying {len(batch)} individually")
+            for item in batch:
+                try:
+                    self._persist([item])
+                except Exception as item_error:
+                    self._mark_failed(item[0], str(item_error))
+
+    def _persist(self, batch):
+        """
+        Guarda un grupo de encuestas (sus alertas en el outbox y su estado "done") con un único commit.
+        Solo las que siguen "queued" y reclamadas por este proceso (otro pudo recuperarlas).
+        """
+        owner = self._owner()
+        db = SessionLocal()
+        try:
+            for submission_id, survey_data, student_id, user_id, submitted_at in batch:
+                mine = and_(PendingSubmission.id == submission_id,
+                            PendingSubmission.status == "queued",
+                            PendingSubmission.claimed_by == owner)
+                now = datetime.utcnow()
+                student = db.get(Student, student_id)
+                if not student:
+                    db.execute(update(PendingSubmission).where(mine)
+                               .values(status="failed", error="Student not found", finished_at=now))
+                    continue
+                if db.execute(update(PendingSubmission).where(mine).values(claimed_at=now)).rowcount == 0:
+                    continue
+                analysis, db_survey = stage_survey(db, survey_data, student, user_id, submitted_at)
+                teacher_email = alert_recipient(student, analysis)
+                if teacher_email:
+                    stage_alert(db, student, db_survey, analysis, teacher_email, user_id)
+                db.execute(update(PendingSubmission).where(mine).values(
+                    status="done", survey_id=db_survey.id, result=analysis.model_dump_json(), finished_at=now
+                ))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+submission_queue = SubmissionQueue()
@@ -0,0 +1,193 @@
+import os
+import json
+from datetime import datetime
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from .schemas import SurveyInput, RiskAnalysisResult
+from .models import SurveyResponse, SurveyFeatures, AlertLevel, Student
+from .agents.predictor import heuristic_engine
+from .feature_store import make_survey_features, feature_values, teacher_sentiment_as_of, teacher_sentiments_as_of
+from .score_histograms import record_survey_score, record_survey_scores, questionnaire_type
+from .notification_outbox import stage_alerts
+
+# Lógica común de alta de encuestas (envío síncrono, cola asíncrona y lotes)
+
+DEMO_TEACHER_EMAIL = "profesor_demo@colegio.com"
+INGEST_CHUNK_SIZE = 500 # Líneas por transacción en la carga masiva (JSONL)
+BATCH_UPLOAD_MAX_BYTES = int(os.getenv("BATCH_UPLOAD_MAX_BYTES", str(20 * 1024 * 1024))) # Cuerpo máximo de /surveys/api/submit_batch
+
+def stage_survey(db: Session, survey_data: SurveyInput, student: Student, user_id: int,
+                 submitted_at: datetime = None, teacher_sentiment: float = None):
+    """
+    Analiza la encuesta y añade a la sesión la SurveyResponse, su vector del feature store
+    y la actualización del histograma del colegio. No hace commit.
+    Devuelve (analysis, db_survey).
+    """
+    submitted_at = submitted_at or datetime.utcnow()
+    # Mismo cálculo as-of que usa el entrenamiento (últimas observaciones hasta ahora)
+    if teacher_sentiment is None:
+        teacher_sentiment = teacher_sentiment_as_of(db, student.teacher_id, submitted_at)
+
+    analysis = heuristic_engine.analyze(survey_data, teacher_sentiment)
+
+    db_survey = SurveyResponse(
+        date_submitted=submitted_at,
+        submitted_by_id=user_id,
+        student_id=student.id,
+        raw_answers=survey_data.model_dump_json(exclude_none=True),
+        calculated_risk_score=analysis.total_score,
+        risk_level=AlertLevel(analysis.risk_level), # Convertir string a Enum
+        ai_summary=analysis.recommendation
+    )
+    db.add(db_survey)
+    db.flush() # Necesitamos el id para el feature store
+
+    # Feature store: vector numérico con el sentimiento usado en este momento
+    answers = survey_data.model_dump(exclude_none=True)
+    db.add(make_survey_features(db_survey.id, answers, teacher_sentiment))
+    # Histograma de puntuaciones del colegio (simulador de umbrales)
+    record_survey_score(db, db_survey, student, answers)
+    return analysis, db_survey
+
+def alert_recipient(student: Student, analysis: RiskAnalysisResult):
+    """Email del tutor si la encuesta requiere el agente de respuesta a incidentes, si no None."""
+    if analysis.risk_level not in ["high", "critical"] or not student.teacher_id:
+        return None
+    if student.teacher and student.teacher.email:
+        return student.teacher.email
+    return DEMO_TEACHER_EMAIL
+
+# --- Carga masiva (JSONL) ---
+# Cada línea: {"student_id": 123, "survey": {...campos de SurveyInput...}}
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in error.errors())
+
+def parse_batch_line(line):
+    """(student_id, SurveyInput) de una línea JSONL. Lanza ValueError con un mensaje legible."""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        raise ValueError("Invalid JSON")
+    if not isinstance(record, dict):
+        raise ValueError("Each line must be a JSON object")
+    student_id = record.get("student_id")
+    if not isinstance(student_id, int) or isinstance(student_id, bool):
+        raise ValueError("student_id must be an integer")
+    try:
+        survey_data = SurveyInput.model_validate(record.get("survey") or {})
+    except ValidationError as e:
+        raise ValueError(_validation_message(e))
+    return student_id, survey_data
+
+def _ingest_chunk(db: Session, records, user_id: int, school_id, results: list, notify: bool = True):
+    """
+    Puntúa e inserta un bloque de líneas válidas con inserts masivos y un único commit
+    (encuestas, feature store, histogramas y, si notify, alertas en el outbox).
+    """
+    student_ids = {student_id for _, student_id, _ in records}
+    students = {s.id: s for s in db.query(Student).filter(Student.id.in_(list(student_ids)))}
+    submitted_at = datetime.utcnow()
+    sentiments = teacher_sentiments_as_of(db, {s.teacher_id for s in students.values()}, submitted_at)
+
+    rows = []
+    staged = []
+    for line_no, student_id, survey_data in records:
+        student = students.get(student_id)
+        if not student:
+            results.append({"line": line_no, "status": "error", "error": "Student not found"})
+            continue
+        if school_id is not None and student.school_id != school_id:
+            results.append({"line": line_no, "status": "error", "error": "Student does not belong to your school"})
+            continue
+        sentiment = sentiments.get(student.teacher_id, 0.0)
+        analysis = heuristic_engine.analyze(survey_data, sentiment)
+        rows.append({
+            "date_submitted": submitted_at,
+            "submitted_by_id": user_id,
+            "student_id": student.id,
+            "raw_answers": survey_data.model_dump_json(exclude_none=True),
+            "calculated_risk_score": analysis.total_score,
+            "risk_level": AlertLevel(analysis.risk_level),
+            "ai_summary": analysis.recommendation
+        })
+        teacher_email = alert_recipient(student, analysis)
+        staged.append((line_no, student, survey_data.model_dump(exclude_none=True), sentiment, analysis, teacher_email))
+    if not rows:
+        return
+
+    survey_ids = db.scalars(
+        insert(SurveyResponse).returning(SurveyResponse.id, sort_by_parameter_order=True), rows
+    ).all()
+    db.execute(insert(SurveyFeatures), [
+        dict(feature_values(answers, sentiment), survey_id=survey_id)
+        for survey_id, (_, _, answers, sentiment, _, _) in zip(survey_ids, staged)
+    ])
+    record_survey_scores(db, [
+        (student.id, student.school_id, questionnaire_type(answers), analysis.total_score)
+        for _, student, answers, _, analysis, _ in staged
+    ], before_id=min(survey_ids))
+    if notify:
+        stage_alerts(db, [
+            (student.id, survey_id, student.internal_code, analysis, teacher_email)
+            for survey_id, (_, student, _, _, analysis, teacher_email) in zip(survey_ids, staged) if teacher_email
+        ], user_id)
+    db.commit()
+
+    for survey_id, (line_no, _, _, _, analysis, _) in zip(survey_ids, staged):
+        results.append({"line": line_no, "status": "created", "survey_id": survey_id, "result": analysis.model_dump()})
+
+class JsonlIngest:
+    """
+    Carga masiva incremental: recibe las líneas por tandas (feed) y persiste por bloques de
+    chunk_size, sin tener el fichero entero en memoria. Si school_id no es None, solo admite
+    alumnos de ese colegio. Con notify, las alertas quedan en el outbox de notificaciones.
+    """
+
+    def __init__(self, db: Session, user_id: int, school_id: int = None, chunk_size: int = INGEST_CHUNK_SIZE,
+                 notify: bool = True):
+        self.db = db
+        self.user_id = user_id
+        self.school_id = school_id
+        self.chunk_size = chunk_size
+        self.notify = notify
+        self.results = []
+        self.line_no = 0
+        self._records = []
+
+    def feed(self, lines):
+        """Valida las líneas (str o bytes) y persiste cada bloque completo."""
+        for line in lines:
+            self.line_no += 1
+            if not line.strip():
+                continue
+            try:
+                student_id, survey_data = parse_batch_line(line)
+            except ValueError as e:
+                self.results.append({"line": self.line_no, "status": "error", "error": str(e)})
+                continue
+            self._records.append((self.line_no, student_id, survey_data))
+            if len(self._records) >= self.chunk_size:
+                self._flush()
+
+    def _flush(self):
+        if self._records:
+            _ingest_chunk(self.db, self._records, self.user_id, self.school_id, self.results, self.notify)
+            self._records = []
+
+    def finish(self, lines=()):
+        """Últimas líneas y bloque pendiente. Devuelve los resultados por línea, ordenados."""
+        self.feed(lines)
+        self._flush()
+        self.results.sort(key=lambda r: r["line"])
+        return self.results
+
+def ingest_jsonl(db: Session, lines, user_id: int, school_id: int = None, chunk_size: int = INGEST_CHUNK_SIZE,
+                 notify: bool = True):
+    """
+    Carga masiva de encuestas desde líneas JSONL (str o bytes, p. ej. un fichero abierto).
+    Valida línea a línea y persiste por bloques de chunk_size (ver JsonlIngest).
+    Devuelve los resultados por línea, ordenados.
+    """
+    return JsonlIngest(db, user_id, school_id, chunk_size, notify).finish(lines)
@@ -0,0 +1,132 @@
+import threading
+import uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+# Segundos de espera tras la última etiqueta de experto antes de reentrenar.
+# Varias etiquetas seguidas se agrupan en un único reentrenamiento.
+RETRAIN_DEBOUNCE_SECONDS = 300
+
+# Modos de entrenamiento, de menor a mayor coste
+TRAINING_MODES = ["incremental", "full", "search"]
+
+def _run_training(mode: str = "full"):
+    """Se ejecuta en el proceso hijo: importa ml_engine allí para no compartir estado con el worker web."""
+    from app.ml_engine import train_model, train_incremental
+    if mode == "incremental":
+        return train_incremental()
+    return train_model(search=(mode == "search"))
+
+class TrainingJobRunner:
+    """
+    Ejecuta train_model / train_incremental en un proceso separado (un entrenamiento a la vez).
+    El worker web nunca se bloquea: sigue sirviendo la versión publicada hasta que
+    el proceso hijo mueve el puntero models/CURRENT y el ModelRegistry la recarga.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._jobs = {} # job_id -> dict de estado
+        self._running_id = None
+        self._pending_reason = None
+        self._pending_mode = None
+        self._timer = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            # "spawn" evita heredar conexiones SQLite y hilos del worker web
+            self._executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def trigger(self, reason: str = "manual", mode: str = "full") -> str:
+        """
+        Lanza un entrenamiento en el modo indicado (incremental, full o search).
+        Si ya hay uno en curso, queda uno pendiente (como mucho) que arrancará al terminar;
+        si se acumulan peticiones de distinto modo, el pendiente usa el más completo.
+        Devuelve el id del job.
+        """
+        if mode not in TRAINING_MODES:
+            raise ValueError(f"Unknown training mode: {mode}")
+        with self._lock:
+            if self._running_id is not None:
+                self._pending_reason = reason
+                if self._pending_mode is None or TRAINING_MODES.index(mode) > TRAINING_MODES.index(self._pending_mode):
+                    self._pending_mode = mode
+                return self._running_id
+            return self._start_locked(reason, mode)
+
+    def _start_locked(self, reason: str, mode: str = "full") -> str:
+        job_id = uuid.uuid4().hex[:12]
+        self._jobs[job_id] = {
+            "id": job_id,
+            "reason": reason,
+            "mode": mode,
+            "status": "running",
+            "started_at": datetime.utcnow().isoformat(),
+            "finished_at": None,
+            "version": None,
+            "error": None
+        }
+        self._running_id = job_id
+        try:
+            future = self._get_executor().submit(_run_training, mode)
+        except BrokenProcessPool:
+            # El proceso hijo murió en un job anterior: recreamos el pool
+            self._executor = None
+            future = self._get_executor().submit(_run_training, mode)
+        future.add_done_callback(lambda f, job_id=job_id: self._on_done(job_id, f))
+        print(f"🧠 [TRAINING] Job {job_id} started ({mode}, {reason})")
+        return job_id
+
+    def _on_done(self, job_id: str, future):
+        with self._lock:
+            job = self._jobs[job_id]
+            job["finished_at"] = datetime.utcnow().isoformat()
+            try:
+                version = future.result()
+                job["status"] = "published" if version else "skipped"
+                job["version"] = version or None
+            except Exception as e:
+                job["status"] = "failed"
+                job["error"] = str(e)
+                if isinstance(e, BrokenProcessPool):
+                    self._executor = None
+            print(f"🧠 [TRAINING] Job {job_id} {job['status']} {job['version'] or ''}")
+
+            self._running_id = None
+            if self._pending_reason is not None:
+                reason, self._pending_reason = self._pending_reason, None
+                mode, self._pending_mode = self._pending_mode, None
+                self._start_locked(reason, mode)
+
+    def schedule(self, reason: str = "expert_label", mode: str = "incremental", delay: float = RETRAIN_DEBOUNCE_SECONDS):
+        """Programa un reentrenamiento con debounce: cada llamada reinicia la cuenta atrás."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(delay, self.trigger, args=(reason, mode))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def status(self) -> dict:
+        from app.ml_engine import get_model_version, read_current_version, read_model_metadata
+
+        with self._lock:
+            jobs = sorted(self._jobs.values(), key=lambda j: j["started_at"], reverse=True)
+            scheduled = self._timer is not None and self._timer.is_alive()
+            pending = self._pending_reason is not None
+
+        published = read_current_version()
+        return {
+            "serving_version": get_model_version(),
+            "published_version": published,
+            "published_metadata": read_model_metadata(published) if published else None,
+            "retrain_scheduled": scheduled,
+            "retrain_pending": pending,
+            "jobs": [dict(j) for j in jobs[:20]]
+        }
+
+training_runner = TrainingJobRunner()
@@ -1,4 +1,8 @@
 import smtplib
+import queue
+import threading
+import time
+import atexit
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
@@ -8,31 +12,300 @@ load_dotenv()
 
 EMAIL_USER = os.getenv("EMAIL_USER")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
-SMTP_SERVER = "smtp.gmail.com"
-SMTP_PORT = 587
+SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() != "false" # false para un servidor local de pruebas
+SMTP_TIMEOUT_SECONDS = 30
+
+# Transporte de correo: conexiones SMTP persistentes (STARTTLS + login una vez por conexión)
+# y una cola en memoria que vacían hilos de envío, varios mensajes por sesión.
+MAIL_POOL_SIZE = 2 # Conexiones simultáneas (= hilos de envío)
+MAIL_QUEUE_MAX = 1000 # Si se llena, enqueue_email devuelve False
+MAIL_BATCH_MAX = 20 # Mensajes por sesión antes de devolver la conexión al pool
+MAIL_LINGER_SECONDS = 0.2 # Espera máxima para completar un lote
+MAIL_IDLE_SECONDS = 60 # Una conexión sin uso más tiempo se cierra en lugar de reutilizarse
+MAIL_MAX_ATTEMPTS = 4
+MAIL_RETRY_BACKOFF_SECONDS = 2.0 # Reintentos a los 2, 4 y 8 segundos
+MAIL_FLUSH_TIMEOUT_SECONDS = 30 # Espera al salir del proceso para vaciar la cola
+
+def build_message(sender: str, to_email: str, subject: str, body: str) -> MIMEMultipart:
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = to_email
+    msg['Subject'] = subject
+
+    msg.attach(MIMEText(body, 'html'))
+    return msg
+
+# Sesión reutilizada que el servidor cerró mientras estaba ociosa en el pool
+_DISCONNECTED_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError)
+
+def _is_permanent(error: Exception) -> bool:
+    """Errores 5xx del servidor (destinatario rechazado, etc.): no tiene sentido reintentar."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+class SMTPConnectionPool:
+    """
+    Conexiones SMTP reutilizables. Una conexión rota se descarta (release(broken=True))
+    y la siguiente acquire abre otra. server.pool_reused indica si la conexión venía del pool:
+    el servidor puede haberla cerrado mientras estaba ociosa.
+    """
+
+    def __init__(self, host: str, port: int, username: str = None, password: str = None,
+                 starttls: bool = True, size: int = MAIL_POOL_SIZE, timeout: float = SMTP_TIMEOUT_SECONDS):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.sessions_opened = 0
+        self._idle = queue.LifoQueue() # (conexión, último uso)
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                server.starttls()
+            if self.password:
+                server.login(self.username, self.password)
+        except Exception:
+            self._close(server)
+            raise
+        self.sessions_opened += 1
+        server.pool_reused = False
+        return server
+
+    def _close(self, server):
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def acquire(self, fresh: bool = False):
+        """
+        Conexión lista para enviar (reutilizada o nueva). Bloquea si todas están en uso.
+        Con fresh=True abre siempre una nueva (reintento tras una sesión reutilizada caída).
+        """
+        self._slots.acquire()
+        try:
+            while not fresh:
+                try:
+                    server, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                if time.monotonic() - last_used <= MAIL_IDLE_SECONDS:
+                    server.pool_reused = True
+                    return server
+                self._close(server)
+            return self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, server, broken: bool = False):
+        if broken:
+            self._close(server)
+        else:
+            self._idle.put((server, time.monotonic()))
+        self._slots.release()
+
+    def close_all(self):
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(server)
+
+class MailQueue:
+    """
+    Cola de envío en memoria del proceso. enqueue no bloquea; los hilos de envío agrupan
+    mensajes por sesión y reintentan con espera exponencial los errores transitorios.
+    """
+
+    def __init__(self, pool: SMTPConnectionPool, sender: str, workers: int = MAIL_POOL_SIZE,
+                 max_attempts: int = MAIL_MAX_ATTEMPTS, backoff_seconds: float = MAIL_RETRY_BACKOFF_SECONDS):
+        self.pool = pool
+        self.sender = sender
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.stats = {"sent": 0, "failed": 0, "retried": 0}
+        self._queue = queue.Queue(maxsize=MAIL_QUEUE_MAX)
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._in_flight = 0 # Encolados y aún no enviados ni descartados (incluye reintentos en espera)
+        self._threads = []
+        self._atexit_registered = False
+
+    def _ensure_workers(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        if not self._atexit_registered:
+            # Al salir (uvicorn, scripts) se da un margen para vaciar la cola
+            atexit.register(self.flush)
+            self._atexit_registered = True
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, name=f"mail-sender-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def enqueue(self, to_email: str, subject: str, body: str) -> bool:
+        """Encola un email HTML. Devuelve False si la cola está llena."""
+        msg = build_message(self.sender, to_email, subject, body)
+        with self._lock:
+            self._ensure_workers()
+            try:
+                self._queue.put_nowait((to_email, msg, 1))
+            except queue.Full:
+                print(f"Failed to queue email to {to_email}: mail queue is full")
+                return False
+            self._in_flight += 1
+        return True
+
+    def flush(self, timeout: float = MAIL_FLUSH_TIMEOUT_SECONDS) -> bool:
+        """Espera a que se envíe (o descarte) todo lo encolado. False si vence el timeout."""
+        deadline = time.monotonic() + timeout
+        with self._done:
+            while self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._done.wait(remaining)
+        return True
+
+    def _finish(self, outcome: str):
+        with self._done:
+            self.stats[outcome] += 1
+            self._in_flight -= 1
+            self._done.notify_all()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + MAIL_LINGER_SECONDS
+            while len(batch) < MAIL_BATCH_MAX:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._send_batch(batch)
+            except Exception as e:
+                print(f"❌ [MAIL] Unexpected error in sender: {e}")
+
+    def _send_batch(self, batch, fresh: bool = False):
+        try:
+            server = self.pool.acquire(fresh)
+        except Exception as e:
+            print(f"⚠️ [MAIL] SMTP connection failed: {e}")
+            for item in batch:
+                self._retry(item, e)
+            return
+
+        broken = False
+        retry_fresh = False
+        try:
+            for index, (to_email, msg, attempt) in enumerate(batch):
+                try:
+                    server.sendmail(self.sender, to_email, msg.as_string())
+                    print(f"Email sent successfully to {to_email}")
+                    self._finish("sent")
+                except Exception as e:
+                    if _is_permanent(e):
+                        print(f"Failed to send email to {to_email}: {e}")
+                        self._finish("failed")
+                        continue
+                    if index == 0 and server.pool_reused and isinstance(e, _DISCONNECTED_ERRORS):
+                        # El servidor cerró la sesión ociosa: el lote entero, en seguida y por una conexión nueva
+                        broken = True
+                        retry_fresh = True
+                        break
+                    if isinstance(e, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)):
+                        # 4xx del servidor: solo se reintenta este mensaje, la conexión sigue sirviendo
+                        self._retry(batch[index], e)
+                        continue
+                    # Conexión caída a mitad de lote: el resto vuelve a la cola con espera
+                    broken = True
+                    for item in batch[index:]:
+                        self._retry(item, e)
+                    break
+        finally:
+            self.pool.release(server, broken)
+        if retry_fresh:
+            self._send_batch(batch, fresh=True)
+
+    def _retry(self, item, error: Exception):
+        to_email, msg, attempt = item
+        if attempt >= self.max_attempts:
+            print(f"Failed to send email to {to_email} after {attempt} attempts: {error}")
+            self._finish("failed")
+            return
+        delay = self.backoff_seconds * 2 ** (attempt - 1)
+        with self._lock:
+            self.stats["retried"] += 1
+        timer = threading.Timer(delay, self._queue.put, args=((to_email, msg, attempt + 1),))
+        timer.daemon = True
+        timer.start()
+
+smtp_pool = SMTPConnectionPool(SMTP_SERVER, SMTP_PORT, EMAIL_USER, EMAIL_PASSWORD, starttls=SMTP_STARTTLS)
+mail_queue = MailQueue(smtp_pool, EMAIL_USER)
+
+def enqueue_email(to_email: str, subject: str, body: str) -> bool:
+    """
+    Encola un email (no bloquea la petición). True si se ha encolado;
+    el envío, con reintentos, lo hacen los hilos de mail_queue.
+    """
+    if not EMAIL_USER or not EMAIL_PASSWORD:
+        print("Error: Email credentials not found in environment variables.")
+        return False
+    return mail_queue.enqueue(to_email, subject, body)
+
+def send_message(pool: SMTPConnectionPool, sender: str, to_email: str, msg) -> None:
+    """
+    Envío síncrono de un mensaje ya construido por una conexión del pool. Si una sesión
+    reutilizada resulta estar cerrada por el servidor, se descarta y se reintenta una vez
+    con una conexión nueva. Lanza la excepción si el envío falla.
+    """
+    fresh = False
+    while True:
+        server = pool.acquire(fresh)
+        broken = False
+        try:
+            server.sendmail(sender, to_email, msg.as_string())
+            return
+        except _DISCONNECTED_ERRORS as e:
+            broken = True
+            if fresh or not server.pool_reused:
+                raise
+            print(f"⚠️ [MAIL] Pooled SMTP session was closed by the server ({e}), retrying on a new connection")
+            fresh = True
+        except Exception as e:
+            broken = not _is_permanent(e)
+            raise
+        finally:
+            pool.release(server, broken)
 
 def send_email(to_email: str, subject: str, body: str):
     """
-    Sends an email using Gmail SMTP.
+    Sends an email synchronously, reusing a pooled SMTP connection.
     """
     if not EMAIL_USER or not EMAIL_PASSWORD:
         print("Error: Email credentials not found in environment variables.")
         return False
 
     try:
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_USER
-        msg['To'] = to_email
-        msg['Subject'] = subject
-
-        msg.attach(MIMEText(body, 'html'))
-
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(EMAIL_USER, EMAIL_PASSWORD)
-        text = msg.as_string()
-        server.sendmail(EMAIL_USER, to_email, text)
-        server.quit()
+        msg = build_message(EMAIL_USER, to_email, subject, body)
+        send_message(smtp_pool, EMAIL_USER, to_email, msg)
         print(f"Email sent successfully to {to_email}")
         return True
     except Exception as e:
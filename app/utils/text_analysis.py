@@ -1,10 +1,136 @@
-
-from typing import List
+import re
+import unicodedata
+from typing import Iterable, List
 from ..models import ClassObservation
 
 POSITIVE_KEYWORDS = ["normal", "bien", "tranquilo", "positivo", "mejora", "adecuado", "colaborativo"]
 NEGATIVE_KEYWORDS = ["conflicto", "agresión", "pelea", "insulto", "rumor", "amenaza", "bullying", "acoso", "golpe", "llanto", "miedo", "aislado"]
 
+# --- Compiled matcher ---
+# Todas las palabras clave se compilan en una única regex en forma de trie (prefijos comunes
+# factorizados), así que el coste por texto apenas crece con el número de keywords.
+# Cada keyword se compila como raíz + sufijo (pelea -> peleas, peleando; aislado -> aislada,
+# aislados; agresión -> agresion, agresiones), anclada al inicio de palabra (evita que
+# "también" cuente como "bien"), salvo tras un prefijo conocido ("ciberacoso", "ciberbullying").
+# Las vocales aceptan sus variantes con tilde.
+
+# Prefijos que pueden preceder a una keyword dentro de la misma palabra
+KEYWORD_PREFIXES = ["ciber"]
+
+# Keywords cuya vocal final no se quita: la raíz corta coincide con palabras comunes
+# (acos- -> "acostumbrados", "acostaron"; mejor- -> "mejor"; llant- -> "llanta")
+NEVER_CUT_STEMS = {"acoso", "mejora", "llanto"}
+
+_ACCENT_VARIANTS = {
+    'a': '[aáàâä]', 'e': '[eéèêë]', 'i': '[iíìîï]', 'o': '[oóòôö]', 'u': '[uúùûü]', 'n': '[nñ]'
+}
+
+# Tabla de traducción á->a, ü->u, ñ->n... para el rango Latin-1 / Latin Extended-A
+_ACCENT_TABLE = {
+    code: unicodedata.normalize("NFKD", chr(code))[0]
+    for code in range(0xC0, 0x180)
+    if unicodedata.normalize("NFKD", chr(code))[0].isascii()
+}
+
+def normalize_text(text: str) -> str:
+    """Minúsculas y sin tildes/diacríticos."""
+    return (text or "").lower().translate(_ACCENT_TABLE)
+
+def _keyword_stem(keyword: str) -> str:
+    """Raíz para flexiones de género y número: se quita la vocal final o/a y las tildes."""
+    stem = normalize_text(keyword)
+    if len(stem) > 4 and stem[-1] in "oa" and stem not in NEVER_CUT_STEMS:
+        stem = stem[:-1]
+    return stem
+
+def _trie_pattern(stems) -> str:
+    """Alternancia de las raíces factorizada por prefijos comunes."""
+    trie = {}
+    for stem in stems:
+        node = trie
+        for ch in stem:
+            node = node.setdefault(ch, {})
+        node[''] = True
+
+    def build(node):
+        branches = [_ACCENT_VARIANTS.get(ch, re.escape(ch)) + build(child)
+                    for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # Una raíz que es prefijo de otra: la rama larga es opcional (greedy, gana si encaja)
+        return f'(?:{body})?' if '' in node else body
+
+    return build(trie)
+
+class KeywordMatcher:
+    """
+    Matcher de una sola pasada sobre el texto.
+    Devuelve cuántas keywords distintas de cada lista aparecen en un texto
+    (una vez por keyword, como el antiguo `k in content`).
+    """
+
+    def __init__(self, negative: List[str], positive: List[str], prefixes: List[str] = KEYWORD_PREFIXES):
+        # raíz -> es negativa (si una raíz aparece en ambas listas, cuenta como negativa)
+        self.stems = {_keyword_stem(k): False for k in positive}
+        self.stems.update({_keyword_stem(k): True for k in negative})
+        prefix = f"(?:{_trie_pattern(normalize_text(p) for p in prefixes)})?" if prefixes else ""
+        self.pattern = re.compile(rf"\b{prefix}({_trie_pattern(self.stems)})\w*")
+        self._stem_cache = {} # texto encontrado (con tildes) -> raíz
+
+    def _stem(self, found: str) -> str:
+        stem = self._stem_cache.get(found)
+        if stem is None:
+            stem = self._stem_cache[found] = normalize_text(found)
+        return stem
+
+    def _counts(self, matched: set) -> tuple:
+        neg_count = sum(1 for stem in matched if self.stems[stem])
+        return neg_count, len(matched) - neg_count
+
+    def count(self, content: str) -> tuple:
+        """(neg_count, pos_count) de un texto."""
+        matched = {self._stem(found) for found in self.pattern.findall((content or "").lower())}
+        return self._counts(matched)
+
+    def count_many(self, contents: Iterable[str]) -> List[tuple]:
+        """
+        (neg_count, pos_count) por texto.
+        Nota: findall por texto resulta más rápido que unir todos los textos en una sola
+        cadena y repartir los matches por offset (evita crear un objeto Match por acierto).
+        """
+        pattern, stem = self.pattern, self._stem
+        return [self._counts({stem(found) for found in pattern.findall((content or "").lower())})
+                for content in contents]
+
+_matcher = KeywordMatcher(NEGATIVE_KEYWORDS, POSITIVE_KEYWORDS)
+
+def _score_from_counts(neg_count: int, pos_count: int) -> float:
+    # Row score: -1 (Good) to +N (Bad)
+    # We want to normalize to 0..1 eventually for the whole set
+
+    # Heuristic:
+    # If neg > 0 -> Risk increases
+    # If pos > neg -> Risk decreases (or stays 0)
+
+    if neg_count > 0:
+        return 0.2 + (neg_count * 0.1) # Base risk + severity
+    elif pos_count > 0:
+        return 0.0
+    else:
+        return 0.05 # Uncertainty / Neutral
+
+def score_observation(content: str) -> float:
+    """
+    Risk score of a single observation text.
+    -> 0.2 + 0.1 per negative keyword, 0.0 if only positive, 0.05 if neutral.
+    """
+    return _score_from_counts(*_matcher.count(content))
+
+def score_observations(contents: Iterable[str]) -> List[float]:
+    """Batch version of score_observation (same compiled matcher, no per-call setup)."""
+    return [_score_from_counts(neg, pos) for neg, pos in _matcher.count_many(contents)]
+
 def calculate_atmosphere_score(observations: List[ClassObservation]) -> float:
     """
     Calculates a 'Negative Atmosphere Score' from 0.0 (Good) to 1.0 (Bad).
@@ -12,36 +138,9 @@ def calculate_atmosphere_score(observations: List[ClassObservation]) -> float:
     """
     if not observations:
         return 0.0
-    
-    total_score = 0
-    count = 0
-    
-    for obs in observations:
-        content = obs.content.lower()
-        
-        # Simple negative keyword count
-        neg_count = sum(1 for k in NEGATIVE_KEYWORDS if k in content)
-        pos_count = sum(1 for k in POSITIVE_KEYWORDS if k in content)
-        
-        # Row score: -1 (Good) to +N (Bad)
-        # We want to normalize to 0..1 eventually for the whole set
-        
-        # Heuristic: 
-        # If neg > 0 -> Risk increases
-        # If pos > neg -> Risk decreases (or stays 0)
-        
-        row_risk = 0.0
-        if neg_count > 0:
-            row_risk = 0.2 + (neg_count * 0.1) # Base risk + severity
-        elif pos_count > 0:
-            row_risk = 0.0
-        else:
-            row_risk = 0.05 # Uncertainty / Neutral
-            
-        total_score += row_risk
-        count += 1
-        
-    avg_score = total_score / count
-    
+
+    scores = score_observations(obs.content for obs in observations)
+    avg_score = sum(scores) / len(scores)
+
     # Cap at 1.0
     return min(avg_score, 1.0)
@@ -0,0 +1,88 @@
+"""
+Paridad y benchmark del bosque compilado (ml_engine.CompiledForest) frente a sklearn.
+
+Entrena un RandomForestClassifier sobre datos sintéticos con las mismas features que
+el modelo real, comprueba que las probabilidades coinciden y mide la latencia de
+inferencia de una fila y de un lote.
+
+Uso (desde la raíz del proyecto):
+    python dev_utils/benchmark_compiled_forest.py [--n-estimators 100] [--batch 1000]
+
+Sale con código 1 si la paridad falla.
+"""
+import sys
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+# Add parent dir to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sklearn.ensemble import RandomForestClassifier
+from app.feature_store import FEATURE_COLUMNS
+from app.ml_engine import compile_forest
+
+def synthetic_data(n_rows: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    X = rng.integers(0, 5, size=(n_rows, len(FEATURE_COLUMNS))).astype(np.float64)
+    X[:, -1] = rng.random(n_rows)
+    noise = rng.normal(0, 3, n_rows)
+    y = ((X[:, :-1].sum(axis=1) + 10 * X[:, -1] + noise) > 30).astype(int)
+    return X, y
+
+def best_of(fn, repeat: int):
+    """Mejor tiempo (segundos) de `repeat` ejecuciones."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-estimators", type=int, default=100)
+    parser.add_argument("--train-rows", type=int, default=5000)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    X_train, y_train = synthetic_data(args.train_rows)
+    clf = RandomForestClassifier(n_estimators=args.n_estimators, random_state=42)
+    clf.fit(pd.DataFrame(X_train, columns=FEATURE_COLUMNS), y_train)
+    compiled = compile_forest(clf)
+
+    # --- Paridad ---
+    X_test, _ = synthetic_data(args.batch, seed=1)
+    expected = clf.predict_proba(pd.DataFrame(X_test, columns=FEATURE_COLUMNS))[:, 1]
+    got = compiled.predict_proba(X_test)
+    max_diff = float(np.max(np.abs(expected - got)))
+    print(f"Parity: max |sklearn - compiled| = {max_diff:.2e} over {len(X_test)} rows")
+    if not np.allclose(expected, got, atol=1e-9):
+        print("❌ Parity check FAILED")
+        sys.exit(1)
+    print("✅ Parity check passed")
+
+    # --- Latencia ---
+    row = X_test[:1]
+    row_frame = pd.DataFrame(row, columns=FEATURE_COLUMNS)
+    batch_frame = pd.DataFrame(X_test, columns=FEATURE_COLUMNS)
+
+    results = {
+        "single_sklearn_dataframe": best_of(lambda: clf.predict_proba(pd.DataFrame(row, columns=FEATURE_COLUMNS)), args.repeat),
+        "single_sklearn": best_of(lambda: clf.predict_proba(row_frame), args.repeat),
+        "single_compiled": best_of(lambda: compiled.predict_proba(row), args.repeat),
+        "batch_sklearn": best_of(lambda: clf.predict_proba(batch_frame), max(3, args.repeat // 10)),
+        "batch_compiled": best_of(lambda: compiled.predict_proba(X_test), max(3, args.repeat // 10)),
+    }
+
+    print(f"\nn_estimators={args.n_estimators}, max_depth={compiled.max_depth}, nodes={len(compiled.feature)}")
+    for name, seconds in results.items():
+        print(f"  {name:<26} {seconds * 1000:9.3f} ms")
+    print(f"\nSingle-row speedup: {results['single_sklearn_dataframe'] / results['single_compiled']:.1f}x")
+    print(f"Batch ({args.batch} rows) speedup: {results['batch_sklearn'] / results['batch_compiled']:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Benchmark reproducible de las rutas de entrenamiento e inferencia ML.
+
+Crea una base de datos SQLite temporal con colegios, alumnos, encuestas y observaciones
+sintéticas (semilla fija) y mide:
+  - extracción (load_data) por la ruta heredada (JSON) y por el feature store
+  - entrenamiento variando n_estimators
+  - inferencia de una fila (bosque compilado y sklearn) y por lotes
+  - explicación SHAP
+
+Uso (desde la raíz del proyecto):
+    python dev_utils/benchmark_ml.py --surveys 20000 --output bench_ml.json
+
+El resultado es JSON para poder comparar ejecuciones.
+"""
+import sys
+import os
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import shutil
+from datetime import datetime, timedelta
+
+import numpy as np
+import sklearn
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+# Add parent dir to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sklearn.ensemble import RandomForestClassifier
+from app.models import Base, School, User, UserRole, Student, SurveyResponse, SurveyFeatures, ClassObservation, AlertLevel
+from app.feature_store import feature_values, load_teacher_timelines
+from app import ml_engine
+
+OBSERVATION_TEXTS = [
+    "Clase tranquila, todo normal.",
+    "Conflicto en el patio, pelea entre dos alumnos.",
+    "Se detecta un insulto y un rumor en el grupo.",
+    "Buen ambiente colaborativo.",
+    "Alumno aislado durante el recreo, llanto.",
+    "Sin incidencias.",
+]
+
+def seed_database(engine, n_schools, n_students, n_surveys, n_observations, seed=42):
+    """Inserta datos sintéticos con executemany (inserts masivos)."""
+    rng = random.Random(seed)
+    Base.metadata.create_all(bind=engine)
+    start = datetime(2025, 1, 1)
+
+    with Session(engine) as db:
+        db.execute(insert(School), [{"id": i, "name": f"Colegio {i}"} for i in range(1, n_schools + 1)])
+
+        n_teachers = max(1, n_students // 25)
+        db.execute(insert(User), [
+            {"id": i, "email": f"teacher{i}@bench.local", "role": UserRole.TEACHER,
+             "school_id": rng.randint(1, n_schools)}
+            for i in range(1, n_teachers + 1)
+        ])
+        db.execute(insert(Student), [
+            {"id": i, "internal_code": f"STU{i:07d}", "school_id": rng.randint(1, n_schools),
+             "teacher_id": rng.randint(1, n_teachers), "grade_class": f"{rng.randint(1, 6)}A"}
+            for i in range(1, n_students + 1)
+        ])
+        db.execute(insert(ClassObservation), [
+            {"teacher_id": rng.randint(1, n_teachers), "content": rng.choice(OBSERVATION_TEXTS),
+             "timestamp": start + timedelta(minutes=rng.randint(0, 365 * 24 * 60))}
+            for _ in range(n_observations)
+        ])
+
+        levels = list(AlertLevel)
+        labels = [None] * 8 + ["real_case", "false_positive", "false_negative"]
+        rows = []
+        for i in range(1, n_surveys + 1):
+            answers = {f"p_item_{k}": rng.randint(0, 4) for k in range(1, 14)}
+            rows.append({
+                "id": i,
+                "student_id": rng.randint(1, n_students),
+                "submitted_by_id": 1,
+                "raw_answers": json.dumps(answers),
+                "calculated_risk_score": sum(answers.values()),
+                "risk_level": rng.choice(levels),
+                "expert_label": rng.choice(labels),
+                "date_submitted": start + timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+            })
+            if len(rows) >= 5000:
+                db.execute(insert(SurveyResponse), rows)
+                rows = []
+        if rows:
+            db.execute(insert(SurveyResponse), rows)
+        db.commit()
+
+def populate_feature_store(engine):
+    """Equivalente al backfill: rellena survey_features para todas las encuestas."""
+    with Session(engine) as db:
+        timelines = load_teacher_timelines(db)
+        rows = db.query(SurveyResponse.id, SurveyResponse.raw_answers, SurveyResponse.date_submitted, Student.teacher_id)\
+            .outerjoin(Student, SurveyResponse.student_id == Student.id).all()
+        batch = []
+        for survey_id, raw_answers, date_submitted, teacher_id in rows:
+            timeline = timelines.get(teacher_id)
+            values = feature_values(json.loads(raw_answers), timeline.sentiment_as_of(date_submitted) if timeline else 0.0)
+            values["survey_id"] = survey_id
+            batch.append(values)
+        db.execute(insert(SurveyFeatures), batch)
+        db.commit()
+
+def timed(fn, repeat=1):
+    """(mejor tiempo en segundos, último resultado)"""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def percentiles(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    samples = np.array(samples) * 1000
+    return {"p50_ms": float(np.percentile(samples, 50)), "p99_ms": float(np.percentile(samples, 99)), "n": repeat}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de las rutas ML (extracción, entrenamiento, inferencia, SHAP).")
+    parser.add_argument("--schools", type=int, default=20)
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--surveys", type=int, default=10000)
+    parser.add_argument("--observations", type=int, default=3000)
+    parser.add_argument("--estimators", type=str, default="25,50,100,200", help="Lista separada por comas")
+    parser.add_argument("--batch-sizes", type=str, default="10,100,1000")
+    parser.add_argument("--repeat", type=int, default=100, help="Repeticiones para latencias de inferencia")
+    parser.add_argument("--output", type=str, default=None, help="Fichero JSON de salida (por defecto stdout)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_ml_")
+    engine = create_engine(f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+
+    results = {
+        "timestamp": datetime.utcnow().isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "sklearn": sklearn.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+        },
+        "config": {
+            "schools": args.schools, "students": args.students,
+            "surveys": args.surveys, "observations": args.observations,
+        },
+    }
+
+    print(f"Seeding {args.surveys} surveys in {workdir}...", file=sys.stderr)
+    results["seed_seconds"], _ = timed(lambda: seed_database(engine, args.schools, args.students, args.surveys, args.observations))
+
+    # --- Extracción ---
+    with Session(engine) as db:
+        legacy_seconds, df = timed(lambda: ml_engine.load_data(db))
+    results["populate_feature_store_seconds"], _ = timed(lambda: populate_feature_store(engine))
+    with Session(engine) as db:
+        store_seconds, df_store = timed(lambda: ml_engine.load_data(db), repeat=3)
+    results["extraction"] = {
+        "rows": int(len(df)),
+        "legacy_json_seconds": legacy_seconds,
+        "feature_store_seconds": store_seconds,
+    }
+
+    X = df_store.drop(columns=["target"])
+    y = df_store["target"]
+
+    # --- Entrenamiento ---
+    training = []
+    clf = None
+    for n_estimators in [int(n) for n in args.estimators.split(",")]:
+        model = RandomForestClassifier(n_estimators=n_estimators, random_state=42)
+        seconds, _ = timed(lambda: model.fit(X, y))
+        training.append({"n_estimators": n_estimators, "fit_seconds": seconds})
+        if clf is None or n_estimators == 100:
+            clf = model
+    results["training"] = training
+
+    # --- Inferencia ---
+    # Registro apuntando a un directorio temporal para no tocar models/ del proyecto
+    models_dir = os.path.join(workdir, "models")
+    ml_engine.publish_model(clf, {"version": "bench"}, models_dir=models_dir)
+    ml_engine.model_registry = ml_engine.ModelRegistry(path=os.path.join(workdir, "model.pkl"), models_dir=models_dir)
+    loaded = ml_engine.model_registry.get()
+
+    rng = random.Random(7)
+    answers = [{f"p_item_{k}": rng.randint(0, 4) for k in range(1, 14)} for _ in range(max(int(b) for b in args.batch_sizes.split(",")))]
+    single = answers[0]
+    X_single = ml_engine.build_feature_matrix([single], 0.2)
+
+    inference = {
+        "n_estimators": clf.n_estimators,
+        "compiled_available": loaded.compiled is not None,
+        "single_predict_risk_proba": percentiles(lambda: ml_engine.predict_risk_proba(single, 0.2), args.repeat),
+        "single_sklearn_predict_proba": percentiles(lambda: ml_engine._positive_proba(loaded.clf, X_single), args.repeat),
+        "batch": [],
+    }
+    for size in [int(b) for b in args.batch_sizes.split(",")]:
+        seconds, _ = timed(lambda: ml_engine.predict_risk_batch(answers[:size], 0.2), repeat=5)
+        inference["batch"].append({"size": size, "seconds": seconds, "per_row_ms": seconds * 1000 / size})
+    results["inference"] = inference
+
+    # --- SHAP (sin cache) ---
+    results["shap_explanation"] = percentiles(lambda: ml_engine.explain_risk(single, 0.2), max(5, args.repeat // 10))
+
+    engine.dispose()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Microbenchmarks de las funciones que se ejecutan en cada petición, con control de regresiones.
+
+Mide, sobre bases de datos SQLite sintéticas de tamaño creciente:
+  - HeuristicPredictor.analyze (cuestionario de padres y de profesor)
+  - calculate_atmosphere_score (5 y 50 observaciones)
+  - get_latest_risks_bulk (una clase y un colegio)
+  - security.get_current_user (decodificación del token + consulta del usuario)
+  - SurveyInput: validación desde JSON y serialización a JSON
+
+Compara cada medida con una línea base guardada y sale con código 1 si alguna es más
+lenta que baseline * tolerancia (y la diferencia supera un mínimo absoluto, para no
+fallar por ruido en funciones de microsegundos).
+
+Uso (desde la raíz del proyecto):
+    python dev_utils/benchmark_request_path.py                    # compara con la línea base
+    python dev_utils/benchmark_request_path.py --save-baseline    # guarda una nueva línea base
+    python dev_utils/benchmark_request_path.py --sizes 1000,100000 --tolerance 1.3
+
+La línea base depende de la máquina: regenerarla al cambiar de entorno.
+"""
+import sys
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import shutil
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+# Add parent dir to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models import Student, ClassObservation
+from app.schemas import SurveyInput
+from app.agents.predictor import heuristic_engine, TEACHER_ITEMS
+from app.utils.text_analysis import calculate_atmosphere_score
+from app.routers.dashboard import get_latest_risks_bulk
+from app.security import get_current_user, create_access_token
+from benchmark_ml import seed_database
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+DEFAULT_SIZES = "1000,10000,50000"
+
+def per_call_us(fn, number: int, repeat: int = 5) -> float:
+    """Mejor media por llamada (microsegundos) de `repeat` tandas de `number` llamadas."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best * 1e6
+
+def bench_in_memory(number: int) -> dict:
+    """Funciones que no dependen del tamaño de la base de datos."""
+    rng = random.Random(1)
+    parent = SurveyInput(**{f"p_item_{i}": rng.randint(0, 4) for i in range(1, 14)}, p_observations="Llega triste a casa.")
+    teacher = SurveyInput(**{col: rng.randint(0, 4) for col in TEACHER_ITEMS})
+    parent_json = parent.model_dump_json(exclude_none=True)
+
+    texts = ["Clase tranquila, todo normal.", "Conflicto en el patio, pelea entre dos alumnos.",
+             "Se detecta un insulto y un rumor en el grupo.", "Alumno aislado durante el recreo."]
+    obs_5 = [ClassObservation(content=rng.choice(texts)) for _ in range(5)]
+    obs_50 = [ClassObservation(content=rng.choice(texts)) for _ in range(50)]
+
+    return {
+        "analyze_parent": per_call_us(lambda: heuristic_engine.analyze(parent, 0.5), number),
+        "analyze_teacher": per_call_us(lambda: heuristic_engine.analyze(teacher, 0.0), number),
+        "atmosphere_score_5": per_call_us(lambda: calculate_atmosphere_score(obs_5), number),
+        "atmosphere_score_50": per_call_us(lambda: calculate_atmosphere_score(obs_50), number // 10),
+        "survey_input_from_json": per_call_us(lambda: SurveyInput.model_validate_json(parent_json), number),
+        "survey_input_to_json": per_call_us(lambda: parent.model_dump_json(exclude_none=True), number),
+    }
+
+def bench_database(n_surveys: int, number: int) -> dict:
+    """Funciones con acceso a BD sobre una base sintética de n_surveys encuestas."""
+    workdir = tempfile.mkdtemp(prefix="bench_request_")
+    engine = create_engine(f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    try:
+        n_students = max(100, n_surveys // 5)
+        seed_database(engine, n_schools=max(1, n_students // 500), n_students=n_students,
+                      n_surveys=n_surveys, n_observations=max(100, n_surveys // 10))
+        token = create_access_token({"sub": "teacher1@bench.local"})
+        loop = asyncio.new_event_loop()
+
+        with Session(engine) as db:
+            # Una clase (alumnos del mismo profesor) y un colegio completo
+            class_ids = [sid for (sid,) in db.query(Student.id).filter(Student.teacher_id == 1).limit(25)]
+            school_ids = [sid for (sid,) in db.query(Student.id).filter(Student.school_id == 1).limit(500)]
+
+            results = {
+                "latest_risks_class": per_call_us(lambda: get_latest_risks_bulk(db, class_ids), number // 10),
+                "latest_risks_school": per_call_us(lambda: get_latest_risks_bulk(db, school_ids), max(5, number // 100)),
+                "get_current_user": per_call_us(
+                    lambda: loop.run_until_complete(get_current_user(None, token, db)), number // 10
+                ),
+            }
+        loop.close()
+        return results
+    finally:
+        engine.dispose()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def compare(results: dict, baseline: dict, tolerance: float, min_delta_us: float) -> list:
+    """Lista de (nombre, baseline_us, actual_us) que superan la tolerancia."""
+    regressions = []
+    for name, current in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        if current > reference * tolerance and current - reference > min_delta_us:
+            regressions.append((name, reference, current))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks de la ruta de petición con control de regresiones.")
+    parser.add_argument("--sizes", type=str, default=DEFAULT_SIZES, help="Tamaños de BD (nº encuestas), separados por comas")
+    parser.add_argument("--number", type=int, default=1000, help="Llamadas por tanda (las funciones lentas usan menos)")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="Factor máximo permitido sobre la línea base")
+    parser.add_argument("--min-delta-us", type=float, default=20.0, help="Diferencia mínima (µs) para contar como regresión")
+    parser.add_argument("--baseline", type=str, default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Guarda los resultados como nueva línea base")
+    args = parser.parse_args()
+
+    results = {}
+    print("Benchmarking in-memory functions...", file=sys.stderr)
+    results.update(bench_in_memory(args.number))
+    for size in [int(s) for s in args.sizes.split(",")]:
+        print(f"Benchmarking database functions with {size} surveys...", file=sys.stderr)
+        for name, value in bench_database(size, args.number).items():
+            results[f"{name}@{size}"] = value
+
+    for name, value in results.items():
+        print(f"  {name:<32} {value:10.1f} µs")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "created_at": datetime.utcnow().isoformat(),
+                "environment": {"python": platform.python_version(), "machine": platform.machine()},
+                "results_us": {name: round(value, 2) for name, value in results.items()}
+            }, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline first.")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline["results_us"], args.tolerance, args.min_delta_us)
+    if regressions:
+        print(f"\n❌ {len(regressions)} regression(s) over {args.tolerance}x baseline:")
+        for name, reference, current in regressions:
+            print(f"  {name}: {reference:.1f} µs -> {current:.1f} µs ({current / reference:.2f}x)")
+        sys.exit(1)
+    print(f"\n✅ No regressions over {args.tolerance}x baseline ({len(results)} benchmarks)")
+
+if __name__ == "__main__":
+    main()
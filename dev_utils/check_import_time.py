@@ -0,0 +1,85 @@
+"""
+Control del tiempo de importación de app.main (arranque de cada worker de uvicorn).
+
+Importa app.main en procesos nuevos (sin caché de módulos) y falla (código 1) si:
+  - el mejor tiempo de `--runs` importaciones supera `--budget` segundos, o
+  - se ha cargado alguno de los módulos pesados que deben importarse en el primer uso
+    (langchain, OpenAI, FAISS, SHAP, scikit-learn, pandas).
+
+Con --profile muestra además los módulos que más tardan (python -X importtime).
+
+Uso (desde la raíz del proyecto, como uvicorn):
+    python dev_utils/check_import_time.py
+    python dev_utils/check_import_time.py --budget 1.0 --runs 5 --profile
+
+El presupuesto depende de la máquina; el valor por defecto deja margen sobre ~1 s medido en desarrollo.
+"""
+import sys
+import os
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Se importan bajo demanda (RAG, agente de incidentes, ml_engine): no deben cargarse con app.main
+HEAVY_MODULES = ("langchain", "langchain_core", "langchain_openai", "langchain_community",
+                 "openai", "faiss", "shap", "sklearn", "pandas")
+
+CHILD_CODE = f"""
+import sys, time, json
+sys.path.insert(0, {ROOT!r})
+start = time.perf_counter()
+import app.main
+elapsed = time.perf_counter() - start
+heavy = sorted({{name.split('.')[0] for name in sys.modules}} & set({list(HEAVY_MODULES)!r}))
+print(json.dumps({{"seconds": elapsed, "heavy": heavy}}))
+"""
+
+def measure_once() -> dict:
+    result = subprocess.run([sys.executable, "-c", CHILD_CODE], capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr)
+        raise RuntimeError("import app.main failed")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def profile(top: int = 15):
+    """Módulos con mayor tiempo acumulado según -X importtime."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, {ROOT!r}); import app.main"],
+                            capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name.rstrip()))
+    print(f"\nTop {top} modules by cumulative import time:")
+    for cumulative, name in sorted(rows, reverse=True)[:top]:
+        print(f"  {cumulative / 1000:8.1f} ms {name}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Presupuesto de tiempo de importación de app.main.")
+    parser.add_argument("--budget", type=float, default=1.5, help="Segundos máximos (mejor de --runs)")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--profile", action="store_true", help="Muestra los módulos más lentos")
+    args = parser.parse_args()
+
+    runs = [measure_once() for _ in range(args.runs)]
+    best = min(run["seconds"] for run in runs)
+    heavy = sorted({name for run in runs for name in run["heavy"]})
+    print(f"import app.main: best {best:.3f}s of {args.runs} runs (budget {args.budget:.2f}s)")
+    if args.profile:
+        profile()
+
+    failed = False
+    if best > args.budget:
+        print(f"❌ Import time over budget: {best:.3f}s > {args.budget:.2f}s")
+        failed = True
+    if heavy:
+        print(f"❌ Heavy modules imported at startup: {', '.join(heavy)}")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("✅ Import time within budget")
+
+if __name__ == "__main__":
+    main()
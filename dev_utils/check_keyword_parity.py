@@ -0,0 +1,102 @@
+"""
+Paridad del matcher de keywords (app/utils/text_analysis.py) con el scorer original por subcadena
+(`k in content` sobre el texto en minúsculas).
+
+Sobre un conjunto fijo de observaciones de ejemplo comprueba que:
+  - en PARITY_SAMPLES la puntuación coincide con la del scorer original,
+  - en EXPECTED_DIFFERENCES (diferencias intencionadas: tildes, género, "tambien" != "bien")
+    la puntuación es la esperada y no la del scorer original.
+
+Sale con código 1 si algún texto no cumple. Al tocar las keywords, los prefijos o NEVER_CUT_STEMS,
+añadir aquí los casos nuevos.
+
+Uso (desde la raíz del proyecto):
+    python dev_utils/check_keyword_parity.py
+"""
+import sys
+import os
+
+# Add parent dir to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.text_analysis import NEGATIVE_KEYWORDS, POSITIVE_KEYWORDS, score_observation, score_observations
+
+def legacy_score(content: str) -> float:
+    """Scorer original (antes del matcher compilado)."""
+    content = (content or "").lower()
+    neg_count = sum(1 for k in NEGATIVE_KEYWORDS if k in content)
+    pos_count = sum(1 for k in POSITIVE_KEYWORDS if k in content)
+    if neg_count > 0:
+        return 0.2 + (neg_count * 0.1)
+    elif pos_count > 0:
+        return 0.0
+    else:
+        return 0.05
+
+# Mismo resultado que el scorer original
+PARITY_SAMPLES = [
+    "",
+    "Clase normal, sin incidencias.",
+    "El grupo ha trabajado bien y de forma colaborativa.",
+    "Ambiente tranquilo durante la sesión.",
+    "Se observa una mejora en la convivencia.",
+    "Comportamiento adecuado y positivo.",
+    "Hubo una pelea en el recreo.",
+    "Dos peleas en el patio y varios insultos.",
+    "Un alumno recibió amenazas por WhatsApp.",
+    "Posible caso de bullying en 2ºB.",
+    "Sospecha de acoso a una alumna.",
+    "Posible ciberacoso a través de redes sociales.",
+    "Se ha detectado ciberbullying en el grupo de clase.",
+    "CIBERACOSO denunciado por la familia.",
+    "Están acostumbrados a trabajar en grupo.",
+    "Dicen que se acostaron tarde y llegaron cansados.",
+    "Es el mejor alumno de la clase.",
+    "Han mejorado mucho.",
+    "Una alumna rompió a llorar; llanto prolongado.",
+    "Corre un rumor sobre un compañero.",
+    "Un golpe accidental en educación física.",
+    "El alumno tiene miedo de ir al baño.",
+    "Un alumno permanece aislado en el recreo.",
+    "Conflicto entre dos alumnos, se resolvió bien.",
+    "Agresión verbal en el pasillo.",
+    "Hablamos de la rumorología del pueblo.",
+    "Sin observaciones.",
+]
+
+# Diferencias intencionadas: (texto, puntuación esperada, motivo)
+EXPECTED_DIFFERENCES = [
+    ("Agresion fisica en el patio.", 0.3, "keyword sin tilde"),
+    ("Dos agresiones en la misma semana.", 0.3, "plural de agresión"),
+    ("Una alumna aislada en el comedor.", 0.3, "femenino de aislado"),
+    ("Clase tranquila.", 0.0, "femenino de tranquilo"),
+    ("Tambien hubo risas.", 0.05, "'tambien' (sin tilde) no es 'bien'"),
+]
+
+def main():
+    failures = []
+    texts = PARITY_SAMPLES + [text for text, _, _ in EXPECTED_DIFFERENCES]
+    batch = dict(zip(texts, score_observations(texts)))
+
+    for text in PARITY_SAMPLES:
+        expected = legacy_score(text)
+        got = score_observation(text)
+        if abs(got - expected) > 1e-9 or abs(batch[text] - got) > 1e-9:
+            failures.append(f"parity   {text!r}: legacy {expected:.2f}, matcher {got:.2f}")
+
+    for text, expected, reason in EXPECTED_DIFFERENCES:
+        got = score_observation(text)
+        if abs(got - expected) > 1e-9 or abs(batch[text] - got) > 1e-9:
+            failures.append(f"expected {text!r}: {expected:.2f} ({reason}), matcher {got:.2f}")
+        elif abs(legacy_score(text) - expected) < 1e-9:
+            failures.append(f"expected {text!r}: no longer differs from legacy ({reason})")
+
+    print(f"Checked {len(PARITY_SAMPLES)} parity samples and {len(EXPECTED_DIFFERENCES)} expected differences")
+    if failures:
+        for line in failures:
+            print(f"❌ {line}")
+        sys.exit(1)
+    print("✅ Keyword matcher matches the legacy scorer")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Prueba del transporte de correo (app/utils/email.py) contra un servidor SMTP local (aiosmtpd),
+sin credenciales reales ni envíos a Gmail.
+
+Envía N mensajes con mail_queue, con un porcentaje de fallos transitorios (451) y permanentes (550),
+y comprueba que:
+  - se reutilizan las conexiones (muchos menos sesiones SMTP que mensajes),
+  - los fallos transitorios se reintentan y acaban entregándose,
+  - los permanentes se descartan sin reintento,
+  - enqueue no bloquea,
+  - si el servidor cierra las sesiones ociosas del pool (se reinicia el servidor local),
+    send_message y mail_queue reintentan en seguida por una conexión nueva, sin gastar reintentos.
+
+Requiere aiosmtpd (solo desarrollo):
+    pip install aiosmtpd
+    python dev_utils/check_mail_transport.py --messages 200 --transient-failures 10
+"""
+import sys
+import os
+import time
+import argparse
+import threading
+
+# Add parent dir to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.email import SMTPConnectionPool, MailQueue, send_message, build_message
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+class SinkHandler:
+    """Guarda los mensajes recibidos; falla con 451 las primeras `transient` entregas y con 550 a rechazados@."""
+
+    def __init__(self, transient: int):
+        self.transient = transient
+        self.received = []
+        self._lock = threading.Lock()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("rechazado"):
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        with self._lock:
+            if self.transient > 0:
+                self.transient -= 1
+                return "451 Try again later"
+            self.received.extend(envelope.rcpt_tos)
+        return "250 Message accepted"
+
+def check_idle_disconnect(port: int) -> bool:
+    """Sesiones del pool cerradas por el servidor mientras estaban ociosas."""
+    handler = SinkHandler(0)
+    controller = Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    pool = SMTPConnectionPool("127.0.0.1", port, starttls=False)
+    mail = MailQueue(pool, "app@localhost", backoff_seconds=0.1)
+    try:
+        # Deja conexiones ociosas en el pool (síncrona y de la cola)
+        send_message(pool, "app@localhost", "tutor@localhost", build_message("app@localhost", "tutor@localhost", "Antes", "<p>1</p>"))
+        mail.enqueue("tutor@localhost", "Antes", "<p>2</p>")
+        mail.flush(timeout=10)
+        # Reinicio del servidor: cierra todas las sesiones abiertas
+        controller.stop()
+        controller = Controller(handler, hostname="127.0.0.1", port=port)
+        controller.start()
+
+        sessions_before = pool.sessions_opened
+        sync_ok = True
+        try:
+            send_message(pool, "app@localhost", "tutor@localhost", build_message("app@localhost", "tutor@localhost", "Después", "<p>3</p>"))
+        except Exception as e:
+            print(f"send_message after server restart failed: {e}")
+            sync_ok = False
+        for i in range(5):
+            mail.enqueue(f"tutor{i}@localhost", "Después", "<p>4</p>")
+        queued_ok = mail.flush(timeout=10)
+        pool.close_all()
+    finally:
+        controller.stop()
+
+    delivered = len(handler.received)
+    print(f"Idle disconnect: delivered {delivered}/8, {pool.sessions_opened - sessions_before} new sessions, stats {mail.stats}")
+    return sync_ok and queued_ok and delivered == 8 and mail.stats["retried"] == 0 and mail.stats["failed"] == 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba del transporte SMTP con un servidor aiosmtpd local.")
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--transient-failures", type=int, default=10, help="Entregas que reciben 451")
+    parser.add_argument("--rejected", type=int, default=2, help="Mensajes a un destinatario rechazado (550)")
+    parser.add_argument("--port", type=int, default=8025)
+    args = parser.parse_args()
+
+    if Controller is None:
+        print("aiosmtpd is not installed: pip install aiosmtpd")
+        sys.exit(1)
+
+    handler = SinkHandler(args.transient_failures)
+    controller = Controller(handler, hostname="127.0.0.1", port=args.port)
+    controller.start()
+    try:
+        pool = SMTPConnectionPool("127.0.0.1", args.port, starttls=False)
+        mail = MailQueue(pool, "app@localhost", backoff_seconds=0.1)
+
+        started = time.perf_counter()
+        for i in range(args.messages):
+            mail.enqueue(f"tutor{i}@localhost", f"Prueba {i}", f"<p>Mensaje {i}</p>")
+        for i in range(args.rejected):
+            mail.enqueue(f"rechazado{i}@localhost", "Prueba", "<p>Rechazado</p>")
+        enqueue_ms = (time.perf_counter() - started) * 1000
+
+        flushed = mail.flush(timeout=60)
+        elapsed = time.perf_counter() - started
+        pool.close_all()
+    finally:
+        controller.stop()
+
+    delivered = len(handler.received)
+    print(f"Enqueued {args.messages + args.rejected} messages in {enqueue_ms:.1f} ms")
+    print(f"Delivered {delivered}/{args.messages} in {elapsed:.2f}s over {pool.sessions_opened} SMTP sessions")
+    print(f"Stats: {mail.stats}")
+
+    ok = (flushed and delivered == args.messages and mail.stats["failed"] == args.rejected
+          and pool.sessions_opened < args.messages)
+    ok = check_idle_disconnect(args.port) and ok
+    print("✅ Mail transport OK" if ok else "❌ Mail transport check failed")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import sys
+import os
+import json
+import argparse
+from sqlalchemy import select, insert
+
+# Add parent dir to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import SessionLocal, init_db
+from app.models import SurveyResponse, SurveyFeatures, Student
+from app.feature_store import feature_values, load_teacher_timelines
+
+def backfill(batch_size: int = 1000):
+    """
+    Rellena survey_features para las encuestas que aún no tienen vector.
+    El sentimiento se reconstruye as-of la fecha de cada encuesta, con el mismo
+    cálculo que usa submit_survey.
+    """
+    init_db() # Crea la tabla survey_features si no existe
+    db = SessionLocal()
+    try:
+        timelines = load_teacher_timelines(db)
+        total = 0
+        skipped = 0
+        last_id = 0
+
+        while True:
+            # Paginación por id: cada lote es una consulta acotada y su propia transacción
+            rows = db.execute(
+                select(SurveyResponse.id, SurveyResponse.raw_answers, SurveyResponse.date_submitted, Student.teacher_id)
+                .outerjoin(Student, SurveyResponse.student_id == Student.id)
+                .outerjoin(SurveyFeatures, SurveyFeatures.survey_id == SurveyResponse.id)
+                .filter(
+                    SurveyResponse.id > last_id,
+                    SurveyResponse.raw_answers.isnot(None),
+                    SurveyFeatures.survey_id.is_(None)
+                )
+                .order_by(SurveyResponse.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+
+            batch = []
+            for survey_id, raw_answers, date_submitted, teacher_id in rows:
+                try:
+                    answers = json.loads(raw_answers)
+                except ValueError:
+                    skipped += 1
+                    continue
+                timeline = timelines.get(teacher_id)
+                sentiment = timeline.sentiment_as_of(date_submitted) if timeline and date_submitted else 0.0
+                values = feature_values(answers, sentiment)
+                values['survey_id'] = survey_id
+                batch.append(values)
+
+            if batch:
+                db.execute(insert(SurveyFeatures), batch)
+            db.commit()
+
+            total += len(batch)
+            last_id = rows[-1][0]
+            print(f"Backfilled {total} surveys (last id {last_id})...")
+
+        print(f"Backfill finished: {total} rows written, {skipped} skipped (invalid JSON).")
+    except Exception as e:
+        db.rollback()
+        print(f"Error: {e}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill del feature store (survey_features).")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    backfill(args.batch_size)
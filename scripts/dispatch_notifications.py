@@ -0,0 +1,52 @@
+import sys
+import os
+import time
+import socket
+import argparse
+
+# Add parent dir to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import SessionLocal, init_db
+from app.notification_outbox import dispatch_pending, outbox_counts, OUTBOX_BATCH_SIZE
+
+def dispatch(batch_size: int = OUTBOX_BATCH_SIZE, interval: float = 10.0, once: bool = False):
+    """
+    Envía las alertas del outbox (notification_outbox): reclama filas listas por lotes,
+    genera el plan con el agente de incidentes (un resumen por tutor), envía el email
+    y las marca como enviadas. Las que fallan se reintentan con espera creciente.
+    Se pueden lanzar varios dispatchers: cada fila la reclama uno solo. La app web también
+    lleva uno (OUTBOX_DISPATCH_IN_PROCESS); con este proceso aparte se puede desactivar.
+    """
+    init_db()
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    print(f"Notification dispatcher {worker_id} started (batch {batch_size}, poll every {interval}s)")
+    while True:
+        try:
+            claimed, stats = dispatch_pending(worker_id, batch_size)
+            if claimed:
+                print(f"Dispatched {claimed} notifications: {stats}")
+        except Exception as e:
+            print(f"Error: {e}")
+            claimed = 0
+
+        if once and not claimed:
+            db = SessionLocal()
+            try:
+                print(f"Outbox: {outbox_counts(db)}")
+            finally:
+                db.close()
+            return
+        if not claimed:
+            time.sleep(interval)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dispatcher del outbox de notificaciones (alertas por email).")
+    parser.add_argument("--batch-size", type=int, default=OUTBOX_BATCH_SIZE)
+    parser.add_argument("--interval", type=float, default=10.0, help="Segundos de espera cuando no hay nada que enviar")
+    parser.add_argument("--once", action="store_true", help="Envía lo que esté listo y termina")
+    args = parser.parse_args()
+    try:
+        dispatch(args.batch_size, args.interval, args.once)
+    except KeyboardInterrupt:
+        print("Dispatcher stopped.")
@@ -0,0 +1,58 @@
+import sys
+import os
+import json
+import argparse
+
+# Add parent dir to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import SessionLocal, init_db
+from app.models import User
+from app.survey_ingest import ingest_jsonl, INGEST_CHUNK_SIZE
+
+def ingest(path: str, user_email: str, chunk_size: int = INGEST_CHUNK_SIZE, output: str = None, skip_alerts: bool = False):
+    """
+    Carga masiva de encuestas (p.ej. encuestas en papel transcritas) desde un fichero JSONL,
+    con el mismo formato que POST /surveys/api/submit_batch:
+        {"student_id": 123, "survey": {"p_item_1": 2, ...}}
+    """
+    init_db()
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.email == user_email).first()
+        if not user:
+            print(f"Error: user {user_email} not found.")
+            return
+
+        with (sys.stdin if path == "-" else open(path, encoding="utf-8")) as f:
+            results = ingest_jsonl(db, f, user.id, chunk_size=chunk_size, notify=not skip_alerts)
+
+        created = sum(1 for r in results if r["status"] == "created")
+        print(f"Ingest finished: {len(results)} lines, {created} created, {len(results) - created} failed.")
+        for r in results:
+            if r["status"] == "error":
+                print(f"  line {r['line']}: {r['error']}")
+
+        if output:
+            with open(output, "w", encoding="utf-8") as f:
+                for r in results:
+                    f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            print(f"Per-line results written to {output}")
+
+        if created and not skip_alerts:
+            print("High and critical alerts were queued in the notification outbox (sent by the outbox dispatcher).")
+    except Exception as e:
+        db.rollback()
+        print(f"Error: {e}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Carga masiva de encuestas desde JSONL.")
+    parser.add_argument("path", help="Fichero JSONL ('-' para stdin)")
+    parser.add_argument("--user-email", required=True, help="Usuario que figura como remitente de las encuestas")
+    parser.add_argument("--chunk-size", type=int, default=INGEST_CHUNK_SIZE)
+    parser.add_argument("--output", type=str, default=None, help="Fichero JSONL con el resultado de cada línea")
+    parser.add_argument("--skip-alerts", action="store_true", help="No encolar alertas para el agente de incidentes")
+    args = parser.parse_args()
+    ingest(args.path, args.user_email, args.chunk_size, args.output, args.skip_alerts)
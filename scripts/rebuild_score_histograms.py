@@ -0,0 +1,32 @@
+import sys
+import os
+import argparse
+
+# Add parent dir to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import SessionLocal, init_db
+from app.score_histograms import rebuild_histograms
+
+def rebuild(batch_size: int = 5000):
+    """
+    Recalcula los histogramas de puntuación (score_histograms) del simulador de umbrales
+    a partir de todas las encuestas. Sustituye los existentes.
+    """
+    init_db() # Crea la tabla score_histograms si no existe
+    db = SessionLocal()
+    try:
+        total = rebuild_histograms(db, batch_size)
+        db.commit()
+        print(f"Rebuild finished: {total} student/questionnaire entries.")
+    except Exception as e:
+        db.rollback()
+        print(f"Error: {e}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconstruye los histogramas del simulador de umbrales.")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+    rebuild(args.batch_size)
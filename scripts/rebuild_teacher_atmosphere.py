@@ -0,0 +1,28 @@
+import sys
+import os
+
+# Add parent dir to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import SessionLocal, init_db
+from app.feature_store import rebuild_teacher_atmosphere
+
+def rebuild():
+    """
+    Recalcula la ventana de ambiente de clase (teacher_atmosphere) de todos los profesores
+    a partir del histórico de class_observations. Sustituye los registros existentes.
+    """
+    init_db() # Crea la tabla teacher_atmosphere si no existe
+    db = SessionLocal()
+    try:
+        total = rebuild_teacher_atmosphere(db)
+        db.commit()
+        print(f"Rebuild finished: {total} teachers.")
+    except Exception as e:
+        db.rollback()
+        print(f"Error: {e}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    rebuild()
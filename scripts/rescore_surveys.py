@@ -0,0 +1,121 @@
+import sys
+import os
+import json
+import time
+import argparse
+from collections import Counter
+import numpy as np
+from sqlalchemy import select, update
+
+# Add parent dir to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import SessionLocal, init_db
+from app.models import SurveyResponse, SurveyFeatures, Student
+from app.agents.predictor import heuristic_engine, answers_to_matrices
+from app.feature_store import load_teacher_timelines
+from app.score_histograms import rebuild_histograms
+
+def rescore(chunk_size: int = 5000, dry_run: bool = False):
+    """
+    Recalcula calculated_risk_score y risk_level de todas las encuestas con las reglas
+    actuales de HeuristicPredictor (p.ej. tras cambiar umbrales).
+    Procesa por lotes (paginación por id), puntúa cada lote con analyze_batch y solo
+    escribe las filas que cambian, con un UPDATE masivo por lote.
+    """
+    init_db() # Crea score_histograms si no existe
+    db = SessionLocal()
+    started = time.time()
+    recommendations = {level: heuristic_engine._get_recommendation(level) for level in heuristic_engine.LEVELS}
+    timelines = None # Solo se cargan si hay encuestas sin feature store
+    total = 0
+    score_changed = 0
+    transitions = Counter()
+    skipped = 0
+    last_id = 0
+
+    try:
+        while True:
+            rows = db.execute(
+                select(
+                    SurveyResponse.id, SurveyResponse.raw_answers, SurveyResponse.calculated_risk_score,
+                    SurveyResponse.risk_level, SurveyResponse.ai_summary, SurveyResponse.date_submitted,
+                    SurveyFeatures.teacher_sentiment, Student.teacher_id
+                )
+                .outerjoin(SurveyFeatures, SurveyFeatures.survey_id == SurveyResponse.id)
+                .outerjoin(Student, SurveyResponse.student_id == Student.id)
+                .filter(SurveyResponse.id > last_id)
+                .order_by(SurveyResponse.id)
+                .limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            valid = []
+            answers_list = []
+            for row in rows:
+                try:
+                    answers_list.append(json.loads(row.raw_answers))
+                    valid.append(row)
+                except (TypeError, ValueError):
+                    skipped += 1
+
+            # Sentimiento usado al enviar (feature store) o reconstruido as-of la fecha
+            sentiments = np.zeros(len(valid))
+            for i, row in enumerate(valid):
+                if row.teacher_sentiment is not None:
+                    sentiments[i] = row.teacher_sentiment
+                elif row.teacher_id and row.date_submitted:
+                    if timelines is None:
+                        timelines = load_teacher_timelines(db)
+                    timeline = timelines.get(row.teacher_id)
+                    sentiments[i] = timeline.sentiment_as_of(row.date_submitted) if timeline else 0.0
+
+            parent, teacher, is_teacher = answers_to_matrices(answers_list)
+            scores, level_idx, _ = heuristic_engine.analyze_batch(parent, teacher, is_teacher, sentiments)
+
+            updates = []
+            for row, score, idx in zip(valid, scores.tolist(), level_idx.tolist()):
+                new_level = heuristic_engine.LEVELS[idx]
+                if score == row.calculated_risk_score and new_level == row.risk_level:
+                    continue
+                values = {"id": row.id, "calculated_risk_score": score, "risk_level": new_level}
+                if new_level != row.risk_level:
+                    transitions[(row.risk_level.value if row.risk_level else None, new_level.value)] += 1
+                    # El resumen por defecto depende del nivel; los personalizados no se tocan
+                    if row.risk_level and row.ai_summary == recommendations.get(row.risk_level):
+                        values["ai_summary"] = recommendations[new_level]
+                if score != row.calculated_risk_score:
+                    score_changed += 1
+                updates.append(values)
+
+            if updates and not dry_run:
+                db.execute(update(SurveyResponse), updates)
+                db.commit()
+
+            total += len(rows)
+            print(f"Rescored {total} surveys (last id {last_id}, {time.time() - started:.1f}s)...")
+
+        level_changed = sum(transitions.values())
+        if score_changed and not dry_run:
+            # Los histogramas del simulador de umbrales usan calculated_risk_score
+            rebuild_histograms(db)
+            db.commit()
+        print(f"\nRescore finished{' (dry run, nothing written)' if dry_run else ''}: "
+              f"{total} surveys, {level_changed} changed level, {score_changed} changed score, "
+              f"{skipped} skipped (invalid JSON) in {time.time() - started:.1f}s.")
+        for (old, new), count in sorted(transitions.items(), key=lambda t: -t[1]):
+            print(f"  {old} -> {new}: {count}")
+    except Exception as e:
+        db.rollback()
+        print(f"Error: {e}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recalcula el nivel de riesgo heurístico de las encuestas guardadas.")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--dry-run", action="store_true", help="Solo informa de los cambios, no escribe")
+    args = parser.parse_args()
+    rescore(args.chunk_size, args.dry_run)
@@ -18,7 +18,9 @@ def update_schema():
             "ALTER TABLE schools ADD COLUMN latitude FLOAT",
             "ALTER TABLE schools ADD COLUMN longitude FLOAT",
             "ALTER TABLE schools ADD COLUMN phone VARCHAR",
-            "ALTER TABLE survey_responses ADD COLUMN expert_label VARCHAR"
+            "ALTER TABLE survey_responses ADD COLUMN expert_label VARCHAR",
+            "ALTER TABLE survey_responses ADD COLUMN expert_label_at DATETIME",
+            "CREATE INDEX IF NOT EXISTS ix_survey_responses_student_id ON survey_responses (student_id)"
         ]
         
         for stmt in statements: